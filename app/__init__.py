@@ -1,3 +1,8 @@
+import time
+
+# 导入开始的时间，第一次 create_app 时计入启动耗时
+_import_started = time.perf_counter()
+
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
@@ -5,8 +10,11 @@ from flask_cors import CORS
 from flask_wtf.csrf import CSRFProtect
 from dotenv import load_dotenv
 import os
+import atexit
+import itertools
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from flask import Flask, render_template, request
 from flask_session import Session
 
@@ -28,20 +36,84 @@ login_manager.login_view = "auth.login"
 # 初始化清理任务
 cleanup_task = None
 
+# 在gunicorn主进程中预加载的应用，fork出worker后由 init_worker 启动后台任务
+preloaded_app = None
+
 
 def log_configuration(app):
     """将配置信息输出到日志中"""
-    if app.config.get("DEBUG", False):
-        app.logger.info("=" * 50)
-        app.logger.info("Configuration Properties:")
-        app.logger.info("=" * 50)
-        for key in app.config.keys():
-            app.logger.info(f"{key}: {app.config[key]}")
-        app.logger.info("=" * 50)
+    if app.config.get("DEBUG", False) and app.logger.isEnabledFor(logging.INFO):
+        lines = [f"{key}: {value}" for key, value in app.config.items()]
+        app.logger.info(
+            "Configuration Properties:\n%s\n%s\n%s", "=" * 50, "\n".join(lines), "=" * 50
+        )
+
+
+class ChunkLogSampler(logging.Filter):
+    """对标记了 sampled=True 的日志（如每个分片的日志）按 1/N 抽样输出"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = max(int(rate), 1)
+        self._counter = itertools.count()
+
+    def filter(self, record):
+        if not getattr(record, "sampled", False):
+            return True
+        return next(self._counter) % self.rate == 0
+
+
+# 后台写日志文件的队列监听器，整个进程只保留一个
+log_listener = None
+
+
+def stop_log_listener():
+    """停止后台日志线程并写出队列中剩余的日志"""
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+        log_listener = None
+
+
+atexit.register(stop_log_listener)
+
+
+def restart_log_listener():
+    """fork之后子进程中没有父进程的后台日志线程，换用新的队列和线程"""
+    global log_listener
+    if log_listener is None:
+        return
+    handlers = log_listener.handlers
+    new_queue = queue.SimpleQueue()
+    for handler in logging.getLogger().handlers:
+        if getattr(handler, "_groupbin_handler", False) and isinstance(handler, QueueHandler):
+            handler.queue = new_queue
+    log_listener = QueueListener(new_queue, *handlers, respect_handler_level=True)
+    log_listener.start()
+
+
+def init_worker():
+    """gunicorn预加载应用时，在每个fork出的worker中调用（见 gunicorn.conf.py）"""
+    started = time.perf_counter()
+    restart_log_listener()
+    app = preloaded_app
+    if app is None:
+        return
+    with app.app_context():
+        # 主进程中检查数据库结构时建立的连接不能在子进程中使用
+        db.engine.dispose(close=False)
+    cleanup_task.start()
+    from app.utils.blob_reaper import blob_reaper
+
+    blob_reaper.start()
+    from app.utils.metrics import BOOT_PHASE_SECONDS
+
+    BOOT_PHASE_SECONDS.observe(time.perf_counter() - started, phase="worker_init")
 
 
 # 添加日志配置
 def setup_logging(app):
+    global log_listener
     # 设置日志级别
     # 从配置中获取日志级别，默认为INFO
     log_level = getattr(
@@ -49,14 +121,31 @@ def setup_logging(app):
     )
     app.logger.setLevel(log_level)
 
+    from app.utils.request_id import RequestIdFilter
+
     # 调整现有处理器的日志级别，而不是添加新的处理器
     for handler in app.logger.handlers:
         handler.setLevel(log_level)
         # 设置日志格式（控制台格式）
         formatter = logging.Formatter(
-            "[%(asctime)s] %(levelname)s in %(name)s : %(message)s"
+            "[%(asctime)s] %(levelname)s in %(name)s [%(request_id)s]: %(message)s"
         )
         handler.setFormatter(formatter)
+        if not any(isinstance(f, RequestIdFilter) for f in handler.filters):
+            handler.addFilter(RequestIdFilter())
+
+    # 每个分片的日志按比例抽样
+    for log_filter in list(app.logger.filters):
+        if isinstance(log_filter, ChunkLogSampler):
+            app.logger.removeFilter(log_filter)
+    app.logger.addFilter(ChunkLogSampler(app.config.get("LOG_CHUNK_SAMPLE_RATE", 1)))
+
+    # 移除之前（例如重复调用create_app时）添加的文件日志处理器，避免重复写入
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        if getattr(handler, "_groupbin_handler", False):
+            root_logger.removeHandler(handler)
+    stop_log_listener()
 
     # 创建RotatingFileHandler
     if app.config.get("LOG_FILE"):
@@ -73,32 +162,51 @@ def setup_logging(app):
 
         # 设置纯文本日志格式
         file_formatter = logging.Formatter(
-            "[%(asctime)s] %(levelname)s in %(name)s: %(message)s"
+            "[%(asctime)s] %(levelname)s in %(name)s [%(request_id)s]: %(message)s"
         )
         file_handler.setFormatter(file_formatter)
         file_handler.setLevel(log_level)
 
-        # 添加处理器到app.logger和根日志记录器
-        app.logger.addHandler(file_handler)
-        
-        root_logger = logging.getLogger()
-        root_logger.addHandler(file_handler)
+        if app.config.get("LOG_ASYNC", True):
+            # 请求线程只把日志放入队列，由后台线程写入文件
+            handler = QueueHandler(queue.SimpleQueue())
+            log_listener = QueueListener(
+                handler.queue, file_handler, respect_handler_level=True
+            )
+            log_listener.start()
+        else:
+            handler = file_handler
+        handler._groupbin_handler = True
+        # 在写日志的请求中取请求ID，后台线程写文件时记录中已带有该字段
+        handler.addFilter(RequestIdFilter())
+
+        # 只添加到根日志记录器，app.logger的日志通过传播写入，避免同一条日志写两次
+        root_logger.addHandler(handler)
         root_logger.setLevel(log_level)
 
         app.logger.info(
-            "RotatingFileHandler configured for: %s with maxBytes: %d, backupCount: %d", 
-            app.config["LOG_FILE"], 
+            "RotatingFileHandler configured for: %s with maxBytes: %d, backupCount: %d",
+            app.config["LOG_FILE"],
             app.config.get("LOG_FILE_MAX_SIZE"),
-            app.config.get("LOG_FILE_BACKUP_COUNT")
+            app.config.get("LOG_FILE_BACKUP_COUNT"),
         )
 
 
 def create_app(config_name=None):
+    global _import_started, preloaded_app
+    from app.utils.boot import BootTimer, enable_template_cache, warm_templates
+
+    boot = BootTimer()
+    if _import_started is not None:
+        boot.record("imports", boot.started - _import_started)
+        _import_started = None
+
     if not config_name:
         config_name = os.environ.get("FLASK_CONFIG", "default")
 
     app = Flask(__name__)
     app.config.from_object(config[config_name])  # 从配置对象加载配置
+    enable_template_cache(app)
 
     # 初始化日志
     setup_logging(app)
@@ -107,6 +215,12 @@ def create_app(config_name=None):
     # 输出配置信息到日志
     log_configuration(app)
 
+    # 为每个请求分配请求ID，需要在其他before_request之前注册
+    from app.utils.request_id import init_request_id
+
+    init_request_id(app)
+    boot.mark("logging")
+
     # 确保session目录存在
     if app.config.get("SESSION_FILE_DIR"):
         os.makedirs(app.config["SESSION_FILE_DIR"], exist_ok=True)
@@ -114,14 +228,45 @@ def create_app(config_name=None):
             "Session folder configured at: %s", app.config["SESSION_FILE_DIR"]
         )
 
+    # 配置错误时在启动时报错，而不是在上传完成时
+    from app.utils.storage import check_storage_config
+
+    check_storage_config(app.config)
+
     # 初始化扩展
     db.init_app(app)
     login_manager.init_app(app)
-    CORS(app)
-    CSRFProtect(app)  # 初始化CSRF保护
+    from app.utils.metrics import metrics
+
+    metrics.init_app(app)
+    from app.utils.profiler import profiler
+
+    profiler.init_app(app)
+    from app.utils.admission import admission
+
+    admission.init_app(app)
+    from app.utils.previews import previews
+
+    previews.init_app(app)
+    from app.utils.compression import compressor
+
+    compressor.init_app(app)
+    from app.utils.group_events import group_events
+
+    group_events.init_app(app)
+    from app.utils.blob_reaper import blob_reaper
+
+    blob_reaper.init_app(app)
+    # 跨域的浏览器tus客户端需要读取这些响应头
+    CORS(
+        app,
+        expose_headers=["Location", "Upload-Offset", "Upload-Length", "Tus-Resumable"],
+    )
+    csrf = CSRFProtect(app)  # 初始化CSRF保护
 
     # 初始化Session
     Session(app)
+    boot.mark("extensions")
 
     # 添加方法覆盖处理
     @app.before_request
@@ -132,9 +277,9 @@ def create_app(config_name=None):
 
         if override_method in ["GET", "POST", "PUT", "DELETE", "PATCH"]:
             request.method = override_method
-            app.logger.info(f"原始方法: {original_method} 已覆盖为: {request.method}")
+            app.logger.debug("原始方法: %s 已覆盖为: %s", original_method, request.method)
         elif override_method:
-            app.logger.warning(f"无效的方法覆盖参数: {override_method}")
+            app.logger.warning("无效的方法覆盖参数: %s", override_method)
 
     # 确保上传文件夹存在
     try:
@@ -161,29 +306,65 @@ def create_app(config_name=None):
     from app.routes.file import file as file_bp
 
     app.register_blueprint(file_bp, url_prefix="/file")
+
+    from app.routes.tus import tus as tus_bp
+
+    # 标准的tus客户端不会携带CSRF令牌
+    csrf.exempt(tus_bp)
+    app.register_blueprint(tus_bp, url_prefix="/file/tus")
+
+    from app.routes.admin import admin as admin_bp
+
+    app.register_blueprint(admin_bp, url_prefix="/admin")
     app.logger.info("Blueprints registered successfully")
 
-    # 创建数据库表
+    # 命令行工具
+    from app.utils.storage_layout import migrate_storage_command
+
+    app.cli.add_command(migrate_storage_command)
+    boot.mark("blueprints")
+
+    # 创建数据库表，模型结构没有变化时只查询一次结构指纹
     with app.app_context():
         try:
-            db.create_all()
-            app.logger.info("Database tables created successfully")
+            from app.utils.schema import ensure_schema, stamp_schema
+
+            added = ensure_schema(db.engine, db.metadata)
+            if added is not None:
+                app.logger.info("Database tables created successfully")
+                # 结构有变化时按现有记录校正用量计数（包括新增的计数列），并为旧数据补上版本号。
+                # 全部完成后才记录指纹，中途失败时下次启动会重新执行
+                from app.utils.usage import reconcile_group_usage
+                from app.utils.file_handling import backfill_version_numbers
+
+                reconcile_group_usage()
+                backfill_version_numbers()
+                stamp_schema(db.engine, db.metadata)
         except Exception as e:
             app.logger.error("Failed to create database tables: %s", str(e))
             raise
+    boot.mark("schema")
 
-    # 初始化定时清理任务
+    # 初始化定时清理任务，预加载时与后台删除线程一起在fork出的worker中启动
     from app.utils.cleanup import CleanupTask
     global cleanup_task
     cleanup_task = CleanupTask(app)
-    cleanup_task.start()
+    if app.config.get("PRELOAD_APP"):
+        preloaded_app = app
+        warm_templates(app)
+        boot.mark("templates")
+    else:
+        cleanup_task.start()
+        blob_reaper.start()
 
     # 验证关键配置
     required_configs = ["SECRET_KEY", "UPLOAD_FOLDER", "SQLALCHEMY_DATABASE_URI"]
     for config_key in required_configs:
         if not app.config.get(config_key):
-            app.logger.error(f"Missing required configuration: {config_key}")
+            app.logger.error("Missing required configuration: %s", config_key)
             raise ValueError(f"Missing required configuration: {config_key}")
 
+    boot.mark("finalize")
+    boot.finish(app)
     app.logger.info("Application instance created successfully")
     return app
\ No newline at end of file
@@ -14,8 +14,16 @@ class Group(db.Model):
     created_duration_hours = db.Column(db.Integer, default=72)
     creator = db.Column(db.String(100), nullable=True) 
     allow_convert_to_readonly = db.Column(db.Boolean, default=False) 
+    # 存储用量计数，随上传和删除在同一事务中更新，由清理任务定期校正
+    used_bytes = db.Column(db.BigInteger, nullable=False, default=0, server_default="0")
+    file_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    version_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # 文件变化计数和最后上传时间，与用量计数一起更新，用于生成小组页面和文件列表的ETag
+    generation = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    last_upload_at = db.Column(db.DateTime, nullable=True)
     
     files = db.relationship('File', backref='group', lazy=True, cascade="all, delete-orphan")
+    upload_sessions = db.relationship('UploadSession', lazy=True, cascade="all, delete-orphan")
     
     def set_password(self, password):
         if password:
@@ -39,6 +47,11 @@ class Group(db.Model):
         self.expires_at = datetime.now(timezone.utc) + timedelta(hours=self.created_duration_hours)
 
 class File(db.Model):
+    __table_args__ = (
+        # 小组文件列表按文件名分页
+        db.Index('ix_file_group_name', 'group_id', 'original_filename'),
+    )
+
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     group_id = db.Column(db.String(36), db.ForeignKey('group.id'), nullable=False)
     original_filename = db.Column(db.String(255), nullable=False)
@@ -47,17 +60,87 @@ class File(db.Model):
     size = db.Column(db.Integer, nullable=False)  # 文件大小（字节）
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     content_type = db.Column(db.String(100), nullable=False)
+    # 最新版本，由 handle_file_upload 在添加版本时更新
+    latest_version_id = db.Column(db.String(36), nullable=True)
     
-    versions = db.relationship('FileVersion', backref='file', lazy=True, cascade="all, delete-orphan")
+    versions = db.relationship('FileVersion', backref='file', lazy=True, cascade="all, delete-orphan",
+                               order_by='FileVersion.version_number')
+    latest_version = db.relationship('FileVersion', lazy=True, viewonly=True,
+                                     primaryjoin='foreign(File.latest_version_id) == FileVersion.id')
 
 class FileVersion(db.Model):
+    __table_args__ = (
+        db.Index('ix_file_version_number', 'file_id', 'version_number', unique=True),
+    )
+
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     file_id = db.Column(db.String(36), db.ForeignKey('file.id'), nullable=False)
+    # 文件内的版本号，按上传顺序从1开始（0表示旧数据尚未编号）
+    version_number = db.Column(db.Integer, nullable=False, default=0, server_default="0")
     stored_filename = db.Column(db.String(255), nullable=False)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     uploader = db.Column(db.String(100), nullable=True)
     comment = db.Column(db.Text, nullable=True)
     size = db.Column(db.Integer, nullable=False)  # 文件大小（字节）
+    # 存储中的压缩编码（zstd、gzip），None 表示原样存储；压缩后 stored_size 为存储中的大小
+    codec = db.Column(db.String(16), nullable=True)
+    stored_size = db.Column(db.BigInteger, nullable=True)
+
+class UploadSession(db.Model):
+    """进行中的上传（Resumable.js分片上传或tus上传），多个节点通过这条记录协调同一个上传"""
+    __table_args__ = (
+        # 客户端提供的标识只在小组内唯一
+        db.UniqueConstraint('group_id', 'protocol', 'identifier', name='uq_upload_session_identifier'),
+    )
+
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    group_id = db.Column(db.String(36), db.ForeignKey('group.id'), nullable=False)
+    protocol = db.Column(db.String(16), nullable=False)  # resumable 或 tus
+    identifier = db.Column(db.String(255), nullable=False)
+    file_id = db.Column(db.String(36), nullable=True)  # 版本上传的目标文件
+    filename = db.Column(db.String(255), nullable=False)
+    total_size = db.Column(db.BigInteger, nullable=False)
+    chunk_size = db.Column(db.Integer, nullable=True)
+    total_chunks = db.Column(db.Integer, nullable=True)
+    # 已接收的范围，如 "1-5,8"（Resumable.js为分片序号，tus为字节偏移）
+    received = db.Column(db.Text, nullable=False, default="")
+    received_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    # 存储后端的分段上传
+    stored_filename = db.Column(db.String(255), nullable=True)
+    multipart_upload_id = db.Column(db.String(255), nullable=True)
+    parts = db.Column(db.Text, nullable=True)  # JSON：分片序号 -> ETag
+    meta = db.Column(db.Text, nullable=True)  # JSON：上传者、描述等完成上传时使用的参数
+    state = db.Column(db.String(16), nullable=False, default="uploading")  # uploading 或 merging
+    owner = db.Column(db.String(100), nullable=True)  # 创建或正在合并该上传的节点
+    revision = db.Column(db.Integer, nullable=False, default=0)  # 乐观锁版本号
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class GroupEvent(db.Model):
+    """小组的变化事件（文件添加、删除等），各worker轮询该表推送给小组页面（app/utils/group_events.py）"""
+    __table_args__ = (
+        db.Index('ix_group_event_group', 'group_id', 'id'),
+        # SQLite 默认会重用已删除的最大ID，客户端按ID续传，需要ID始终递增
+        {'sqlite_autoincrement': True},
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    group_id = db.Column(db.String(36), nullable=False)  # 小组删除后事件由清理任务按时间删除
+    kind = db.Column(db.String(32), nullable=False)  # file_added、version_added、file_deleted、group_readonly
+    payload = db.Column(db.Text, nullable=False, default="{}")  # JSON
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+
+class DeletedBlob(db.Model):
+    """已删除的文件版本在存储中的文件，由后台的 blob_reaper 删除（app/utils/blob_reaper.py）"""
+    id = db.Column(db.Integer, primary_key=True)
+    group_id = db.Column(db.String(36), nullable=False)
+    stored_filename = db.Column(db.String(255), nullable=False)
+    version_id = db.Column(db.String(36), nullable=True)  # 同时删除该版本的预览
+    attempts = db.Column(db.Integer, nullable=False, default=0)  # 已尝试次数，也用作领取时的乐观锁
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc), index=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
 # 用户模拟类（实际项目中可能不需要，因为小组链接和密码就是访问凭证）
 class User(UserMixin):
@@ -0,0 +1,95 @@
+from flask import (
+    Blueprint,
+    render_template,
+    request,
+    redirect,
+    flash,
+    jsonify,
+    session,
+    current_app,
+    abort,
+    send_from_directory,
+)
+import os
+import shutil
+import datetime
+from app.utils.profiler import profiler
+from app.utils.usage import usage_summary
+
+admin = Blueprint("admin", __name__)
+
+
+@admin.before_request
+def require_admin():
+    """管理页面需要配置ADMIN_PASSWORD，并通过密码验证"""
+    admin_password = current_app.config.get("ADMIN_PASSWORD")
+    if not admin_password:
+        abort(404)
+
+    if session.get("admin_authenticated", False):
+        return None
+
+    if request.method == "POST" and request.form.get("password"):
+        if request.form.get("password") == admin_password:
+            session["admin_authenticated"] = True
+            return redirect(request.url)
+        flash("管理密码错误，请重试", "danger")
+
+    return render_template(
+        "unified_password.html",
+        title="管理员验证",
+        message="请输入管理密码以继续访问。",
+        next_url=request.url,
+    )
+
+
+@admin.route("/profiles", methods=["GET", "POST"])
+def profiles():
+    """列出最近保存的请求剖析记录"""
+    entries = []
+    for entry_id in profiler.list_entry_ids():
+        entry = profiler.load_entry(entry_id)
+        if entry:
+            entry["time_str"] = datetime.datetime.fromtimestamp(entry["time"]).strftime(
+                "%m-%d %H:%M:%S"
+            )
+            entries.append(entry)
+    return render_template(
+        "admin_profiles.html", entries=entries, enabled=profiler.enabled
+    )
+
+
+@admin.route("/profiles/<entry_id>")
+def profile_detail(entry_id):
+    entry = profiler.load_entry(entry_id)
+    if entry is None:
+        abort(404)
+    return jsonify(entry)
+
+
+@admin.route("/profiles/<entry_id>/download")
+def profile_download(entry_id):
+    """下载cProfile原始数据，可用 python -m pstats 或 snakeviz 查看"""
+    filename = os.path.basename(entry_id) + ".prof"
+    if not profiler.profile_dir or not os.path.exists(
+        os.path.join(profiler.profile_dir, filename)
+    ):
+        abort(404)
+    return send_from_directory(profiler.profile_dir, filename, as_attachment=True)
+
+
+@admin.route("/usage", methods=["GET", "POST"])
+def usage():
+    """全站存储用量和用量最多的小组"""
+    summary = usage_summary()
+    disk = None
+    if current_app.config.get("STORAGE_BACKEND", "local") == "local":
+        upload_folder = current_app.config["UPLOAD_FOLDER"]
+        if os.path.isdir(upload_folder):
+            disk = shutil.disk_usage(upload_folder)
+    return render_template(
+        "admin_usage.html",
+        summary=summary,
+        disk=disk,
+        quota=current_app.config["GROUP_QUOTA_MB"],
+    )
@@ -1,4 +1,3 @@
-import threading
 from flask import (
     Blueprint,
     request,
@@ -10,39 +9,114 @@ from flask import (
     current_app,
     render_template,
     make_response,
+    Response,
+    stream_with_context,
+    send_file,
+    abort,
 )
 from app import db
-from app.models import Group, File, FileVersion
+from app.models import Group, File, FileVersion, UploadSession
 from flask_login import login_required, current_user
-from werkzeug.utils import secure_filename
 import os
-import uuid
-from datetime import datetime
-import zipfile
-import time
-from io import BytesIO
-from app.utils.file_handling import handle_file_upload
+import json
+from datetime import datetime, timezone
+from urllib.parse import quote
+from sqlalchemy.orm import selectinload
+from app.utils.file_handling import (
+    delete_files,
+    handle_file_upload,
+    UploadedFile,
+    StoredUpload,
+    copy_stream,
+)
+from app.utils.metrics import (
+    CHUNK_UPLOAD_SECONDS,
+    CHUNK_MERGE_SECONDS,
+    observe_download,
+)
+from app.utils.profiler import profile_phase
+from app.utils.concurrency import offload
+from app.utils.request_id import current_request_id
+from app.utils.upload_advice import advise_upload, chunk_load
+from app.utils.admission import admission
+from app.utils.storage import get_storage
+from app.utils.codecs import read_blob
+from app.utils.usage import check_quota
+from app.utils.blob_reaper import blob_reaper
+from app.utils.upload_sessions import (
+    claim_session,
+    covers,
+    create_session,
+    delete_session,
+    find_session,
+    record_received,
+    release_session,
+    session_dir,
+)
+from app.utils.previews import previews, preview_target
+from app.utils.zip_archive import (
+    ZipCache,
+    ZipCacheBusy,
+    group_fingerprint,
+    select_members,
+    stream_zip,
+    write_group_zip,
+    zip_options,
+)
 
 file = Blueprint("file", __name__, url_prefix="/file")
 
 
 @file.route("/upload/<group_id>", methods=["GET", "POST"])
+@admission.chunk_upload
 def upload(group_id):
     return handle_file_request(group_id)
 
 
 @file.route("/upload_version/<group_id>/<file_id>", methods=["GET", "POST"])
+@admission.chunk_upload
 def upload_version(group_id, file_id):
     return handle_file_request(group_id, file_id)
 
 
-def handle_file_request(group_id, file_id=None):
+# 分片以原始请求体（application/octet-stream）上传，参数放在查询字符串中，
+# 对应Resumable.js的 method: "octet"，避免multipart解析时的临时文件落盘和二次拷贝
+@file.route("/upload_raw/<group_id>", methods=["GET", "POST"])
+@admission.chunk_upload
+def upload_raw(group_id):
+    return handle_file_request(group_id, raw_body=True)
+
+
+@file.route("/upload_version_raw/<group_id>/<file_id>", methods=["GET", "POST"])
+@admission.chunk_upload
+def upload_version_raw(group_id, file_id):
+    return handle_file_request(group_id, file_id, raw_body=True)
+
+
+@file.route("/upload_advice", methods=["GET"])
+def upload_advice():
+    """为待上传的文件建议分片大小和并发数，每个size参数对应一个文件"""
+    files = []
+    for size in request.args.getlist("size", type=int):
+        advice = advise_upload(max(size, 0), current_app.config)
+        advice["size"] = size
+        files.append(advice)
+    return jsonify({"files": files})
+
+
+def get_upload_param(name, default=""):
+    """获取上传参数，multipart请求在表单中，原始请求体上传在查询字符串中"""
+    return request.form.get(name) or request.args.get(name) or default
+
+
+def handle_file_request(group_id, file_id=None, raw_body=False):
     """
     统一处理文件上传请求（包括普通上传和版本上传）
 
     Args:
         group_id: 小组ID
         file_id: 文件ID（可选，用于版本上传）
+        raw_body: 分片是否以原始请求体上传
     """
     # 检查是否是Resumable.js的分块上传请求
     resumable_identifier = request.form.get("resumableIdentifier", "")
@@ -78,6 +152,12 @@ def handle_file_request(group_id, file_id=None):
             # 检查分块是否已经上传
             return check_chunk(group_id, resumable_identifier, resumable_chunk_number)
         elif request.method == "POST":
+            # 参数只在表单中的客户端在此检查，已在 before_request 中检查过时直接返回
+            admission.acquire_chunk(
+                group_id,
+                request.remote_addr,
+                int(get_upload_param("resumableCurrentChunkSize", 0)),
+            )
             # 处理分块上传
             return handle_resumable_upload(
                 group_id,
@@ -85,6 +165,7 @@ def handle_file_request(group_id, file_id=None):
                 resumable_filename,
                 resumable_chunk_number,
                 file_id,
+                raw_body=raw_body,
             )
 
     # 如果是GET请求但不是Resumable.js的检查请求，则返回405
@@ -93,25 +174,27 @@ def handle_file_request(group_id, file_id=None):
 
 def check_chunk(group_id, resumable_identifier, resumable_chunk_number):
     """检查分块是否已存在"""
-    # 构建分块文件路径
-    chunk_dir = os.path.join(
-        current_app.config["UPLOAD_FOLDER"], "tmp", resumable_identifier
-    )
-    chunk_file = os.path.join(chunk_dir, str(resumable_chunk_number))
-
-    # 检查分块是否已存在
-    if os.path.exists(chunk_file):
+    # 已接收的分片记录在上传会话中，与接收分片的节点无关
+    upload_session = find_session(group_id, "resumable", resumable_identifier)
+    try:
+        chunk_number = int(resumable_chunk_number)
+    except ValueError:
+        chunk_number = 0
+    if upload_session is not None and covers(upload_session.received, chunk_number, chunk_number):
         return "found", 200
     else:
         return "not_found", 204  # 204表示分块不存在，需要上传
 
 
+@CHUNK_UPLOAD_SECONDS.time()
+@chunk_load.track()
 def handle_resumable_upload(
     group_id,
     resumable_identifier,
     resumable_filename,
     resumable_chunk_number,
     file_id=None,
+    raw_body=False,
 ):
     """处理Resumable.js上传请求"""
     group = Group.query.get_or_404(group_id)
@@ -130,25 +213,13 @@ def handle_resumable_upload(
             403,
         )
 
-    # 创建临时目录存储分块
-    chunk_dir = os.path.join(
-        current_app.config["UPLOAD_FOLDER"], "tmp", resumable_identifier
-    )
-    os.makedirs(chunk_dir, exist_ok=True)
-
-    # 保存上传的分块
-    chunk_file = os.path.join(chunk_dir, str(resumable_chunk_number))
-    uploaded_file = request.files["file"]
+    resumable_total_size = int(get_upload_param("resumableTotalSize", 0))
+    resumable_total_chunks = int(get_upload_param("resumableTotalChunks", 0))
 
     # 检查当前分块是否会导致总大小超过限制
-    # 注意：这个检查只在第一个分块时有效，因为其他分块可能已经上传了
     if resumable_chunk_number == "1":
         max_size = current_app.config.get("MAX_UPLOAD_SIZE_MB", 10 * 1024 * 1024)  # 默认10MB
-        resumable_total_size = int(request.form.get("resumableTotalSize", 0))
         if resumable_total_size > max_size:
-            # 清理已创建的目录
-            import shutil
-            shutil.rmtree(chunk_dir, ignore_errors=True)
             return (
                 jsonify(
                     {
@@ -160,21 +231,72 @@ def handle_resumable_upload(
                 413,
             )
 
+    storage = get_storage()
+    upload_session = find_session(group.id, "resumable", resumable_identifier)
+    if upload_session is None:
+        # 新的上传会话按文件总大小检查小组配额，已开始的上传不再检查
+        quota_error = check_quota(
+            group,
+            resumable_total_size,
+            current_app.config["GROUP_QUOTA_MB"],
+        )
+        if quota_error:
+            return (
+                jsonify(
+                    {
+                        "error": "quota_exceeded",
+                        "message": quota_error,
+                        "used_bytes": group.used_bytes,
+                        "quota": current_app.config["GROUP_QUOTA_MB"],
+                    }
+                ),
+                413,
+            )
+        # 支持分段上传的存储后端同时创建分段上传，分片直接作为分段上传
+        upload_session = create_session(
+            group.id,
+            "resumable",
+            resumable_identifier,
+            storage=storage,
+            file_id=file_id,
+            filename=resumable_filename,
+            total_size=resumable_total_size,
+            chunk_size=int(get_upload_param("resumableChunkSize", 0)) or None,
+            total_chunks=resumable_total_chunks,
+        )
+    session_id = upload_session.id
+    stored_filename = upload_session.stored_filename
+    multipart_upload_id = upload_session.multipart_upload_id
+
+    # 创建临时目录存储分块
+    chunk_dir = session_dir(session_id)
+    os.makedirs(chunk_dir, exist_ok=True)
+
+    # 保存上传的分块
+    chunk_file = os.path.join(chunk_dir, str(resumable_chunk_number))
+
     # 使用.un-complete后缀，防止文件写入过程中被其他线程误认为已完成
     chunk_file_temp = chunk_file + ".un-complete"
-    uploaded_file.save(chunk_file_temp)
 
     # 检查分片大小是否与声明的一致，防止恶意攻击者绕过限制
-    resumable_current_chunk_size = int(
-        request.form.get("resumableCurrentChunkSize", 0)
-    )
-    actual_chunk_size = os.path.getsize(chunk_file_temp)
+    resumable_current_chunk_size = int(get_upload_param("resumableCurrentChunkSize", 0))
+    with profile_phase("fs"):
+        if raw_body:
+            # 边接收边计数，超过声明大小时立即停止读取
+            actual_chunk_size = save_request_stream(
+                chunk_file_temp, resumable_current_chunk_size
+            )
+        else:
+            request.files["file"].save(chunk_file_temp)
+            actual_chunk_size = os.path.getsize(chunk_file_temp)
     
     if resumable_current_chunk_size != actual_chunk_size:
         # 分片大小不一致，可能是恶意攻击
         os.remove(chunk_file_temp)
         current_app.logger.warning(
-            f"分片大小不一致，声明大小: {resumable_current_chunk_size}, 实际大小: {actual_chunk_size}"
+            "分片大小不一致，声明大小: %s, 实际大小: %s",
+            resumable_current_chunk_size,
+            actual_chunk_size,
         )
         return (
             jsonify(
@@ -186,109 +308,82 @@ def handle_resumable_upload(
             400,
         )
 
-    # 确保文件完全写入磁盘后再重命名
-    os.rename(chunk_file_temp, chunk_file)
-
-    # 等待文件重命名完成，最多等待1秒
-    max_wait_time = 1.0  # 最长等待1秒
-    wait_interval = 0.1  # 每次检查间隔0.1秒
-    elapsed_time = 0
-    while elapsed_time < max_wait_time:
-        if os.path.exists(chunk_file) and not os.path.exists(chunk_file_temp):
-            break
-        time.sleep(wait_interval)
-        elapsed_time += wait_interval
-    # 出循环检查
-    if os.path.exists(chunk_file_temp) or (not os.path.exists(chunk_file)):
-        current_app.logger.warning(f"文件重命名失败，请检查逻辑")
+    chunk_number = int(resumable_chunk_number)
+    part = None
+    if multipart_upload_id:
+        # 分片直接作为分段上传到存储后端，分段的ETag记录在上传会话中
+        with profile_phase("storage"), open(chunk_file_temp, "rb") as chunk_stream:
+            etag = storage.upload_part(
+                group.id,
+                stored_filename,
+                multipart_upload_id,
+                chunk_number,
+                chunk_stream,
+                actual_chunk_size,
+            )
+        os.remove(chunk_file_temp)
+        part = (chunk_number, etag)
+    else:
+        # 确保文件完全写入磁盘后再重命名
+        os.rename(chunk_file_temp, chunk_file)
 
     # 获取请求的唯一标识符
-    request_id = getattr(threading.current_thread(), "ident", "unknown")
-
-    current_app.logger.info(f"线程 {request_id} 写入分片 {chunk_file}")
+    request_id = current_request_id()
 
-    # 检查是否所有分块都已上传完成
-    resumable_total_chunks = int(
-        request.args.get("resumableTotalChunks", 0)
-        or request.form.get("resumableTotalChunks", 0)
+    # 每个分片都会经过这里，按LOG_CHUNK_SAMPLE_RATE抽样输出
+    current_app.logger.info(
+        "请求 %s 写入分片 %s", request_id, chunk_file, extra={"sampled": True}
     )
 
-    if not all_chunks_uploaded(chunk_dir, resumable_total_chunks):
+    received = record_received(session_id, chunk_number, chunk_number, actual_chunk_size, part)
+
+    # 检查是否所有分块都已上传完成
+    if received is None or not covers(received, 1, resumable_total_chunks):
         # 最常见的情况：上传了一个分块，没有其他工作要做
         return "chunk_uploaded", 200
 
-    current_app.logger.info(
-        f"线程 {request_id} 启动分块合并进程…… {resumable_identifier}"
-    )
-
-    # 创建基于客户端IP+resumable_identifier的合并锁文件
-    # 使用request.remote_addr和resumable_identifier组合创建锁文件名
-    # TODO 反向代理？
-    lock_file_path = os.path.join(
-        current_app.config["UPLOAD_FOLDER"],
-        "tmp",
-        f"{request.remote_addr}_{resumable_identifier}.lock",
-    )
+    # 合并名额不足时返回429，客户端重传最后一个分片时会再次尝试合并
+    admission.acquire_merge()
 
-    # 尝试获取锁
-    lock_fd = None
-    try:
-        # 尝试创建锁文件，如果文件已存在会抛出异常
-        lock_fd = os.open(lock_file_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
-        current_app.logger.info(
-            f"[Request {request_id}] 成功获取合并锁: {lock_file_path}"
-        )
-    except FileExistsError:
-        # 锁已被其他进程获取
+    # 由上传会话保证只有一个请求（可能在其他节点上）执行合并
+    if not claim_session(session_id):
         current_app.logger.info(
-            f"[Request {request_id}] 合并锁已被占用，另一个线程正在进行合并: {lock_file_path}"
-        )
-        # 锁文件存在但无法获得，说明另一个线程已经在合并，当前线程无需等待，直接返回
-        return "chunk_uploaded", 200
-    except Exception as e:
-        # 其他异常
-        current_app.logger.error(
-            f"[Request {request_id}] 获取合并锁时发生错误: {str(e)}"
+            "[Request %s] 另一个请求正在合并: %s", request_id, resumable_identifier
         )
         return "chunk_uploaded", 200
 
-    # 获取锁后，再次检查临时目录是否存在（可能其他线程已完成合并并清理了目录）
-    if not os.path.exists(chunk_dir):
-        current_app.logger.warning(
-            f"[Request {request_id}] 临时目录不存在，但本线程已经获得锁，可能需要检查多线程逻辑"
-        )
-        # 关闭并删除锁文件
-        try:
-            if lock_fd is not None:
-                os.close(lock_fd)
-            os.remove(lock_file_path)
-            current_app.logger.info(
-                f"[Request {request_id}] 合并锁已释放: {lock_file_path}"
-            )
-        except:
-            pass
-        return "chunk_uploaded", 200
-
-    # 合并所有分块
-    marged_file_in_temp_path = merge_chunks(
-        chunk_dir, resumable_filename, resumable_total_chunks
+    current_app.logger.info(
+        "请求 %s 启动分块合并进程…… %s",
+        request_id,
+        resumable_identifier,
     )
 
-    # 检查合并后的文件是否存在
-    if not os.path.exists(marged_file_in_temp_path):
+    if multipart_upload_id:
+        # 由存储后端完成分段上传，无需在本地合并
+        file_upload = complete_multipart_session(
+            storage, group.id, session_id, resumable_filename
+        )
+    else:
+        # 合并所有分块
+        file_upload = None
+        if all_chunks_uploaded(chunk_dir, resumable_total_chunks):
+            # 大文件的合并在协程环境下交给系统线程，不阻塞其他连接
+            with profile_phase("fs"):
+                marged_file_in_temp_path = offload(
+                    merge_chunks, chunk_dir, resumable_filename, resumable_total_chunks
+                )
+            # 创建一个类文件对象供handle_file_upload使用
+            if os.path.exists(marged_file_in_temp_path):
+                file_upload = UploadedFile(marged_file_in_temp_path, resumable_filename)
+
+    # 检查合并结果是否存在
+    if file_upload is None:
         current_app.logger.error(
-            f"[Request {request_id}] 合并出现意外，合并结果文件不存在: {marged_file_in_temp_path}"
+            "[Request %s] 合并出现意外，合并结果不存在: %s",
+            request_id,
+            resumable_identifier,
         )
-        # 关闭并删除锁文件
-        try:
-            if lock_fd is not None:
-                os.close(lock_fd)
-            os.remove(lock_file_path)
-            current_app.logger.info(
-                f"[Request {request_id}] 合并锁已释放: {lock_file_path}"
-            )
-        except:
-            pass
+        release_session(session_id)
         return (
             jsonify(
                 {
@@ -300,29 +395,6 @@ def handle_resumable_upload(
             500,
         )
 
-    # 创建一个类文件对象供handle_file_upload使用
-    class UploadedFile:
-        def __init__(self, path, filename):
-            self.path = path
-            self.filename = filename
-            self.content_type = "application/octet-stream"  # 默认内容类型
-
-        def save(self, target_path):
-            os.rename(self.path, target_path)
-
-    file_upload = UploadedFile(marged_file_in_temp_path, resumable_filename)
-
-    # 这时候就可以关闭并删除锁文件了
-    try:
-        if lock_fd is not None:
-            os.close(lock_fd)
-        os.remove(lock_file_path)
-        current_app.logger.info(
-            f"[Request {request_id}] 合并锁已释放: {lock_file_path}"
-        )
-    except:
-        pass
-
     # 准备handle_file_upload参数
     upload_kwargs = {
         "group_id": group.id,
@@ -347,19 +419,19 @@ def handle_resumable_upload(
             "comment", "版本更新"
         )
 
-    # 处理文件上传
-    new_file = handle_file_upload(**upload_kwargs)
-    db.session.commit()
+    # 处理文件上传，文件记录和删除上传会话在同一事务中提交
+    try:
+        new_file = handle_file_upload(**upload_kwargs)
+        delete_session(session_id)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        release_session(session_id)
+        raise
 
     # 清理临时分块文件
     cleanup_chunks(chunk_dir)
 
-    # 最后检查一遍锁还在不在
-    if os.path.exists(lock_file_path):
-        current_app.logger.warning(
-            f"[Request {request_id}] 锁文件仍然存在，请检查合并逻辑: {lock_file_path}"
-        )
-
     return (
         jsonify(
             {
@@ -373,6 +445,27 @@ def handle_resumable_upload(
     )
 
 
+def save_request_stream(target_path, expected_size):
+    """将原始请求体按固定大小的缓冲区直接写入目标文件
+
+    Returns:
+        实际接收的字节数；超过 expected_size 时提前停止读取，返回值大于 expected_size
+    """
+    content_length = request.content_length
+    if content_length is not None and content_length != expected_size:
+        # 请求头声明的长度已经不一致，无需读取请求体
+        open(target_path, "wb").close()
+        return content_length
+
+    with open(target_path, "wb") as target:
+        return copy_stream(
+            request.stream,
+            target,
+            expected_size,
+            current_app.config["UPLOAD_STREAM_BUFFER_SIZE"],
+        )
+
+
 def all_chunks_uploaded(chunk_dir, total_chunks):
     """检查是否所有分块都已上传"""
     for i in range(1, total_chunks + 1):
@@ -381,6 +474,7 @@ def all_chunks_uploaded(chunk_dir, total_chunks):
     return True
 
 
+@CHUNK_MERGE_SECONDS.time()
 def merge_chunks(chunk_dir, filename, total_chunks):
     """合并所有分块文件"""
     final_file_path = os.path.join(chunk_dir, filename)
@@ -392,6 +486,22 @@ def merge_chunks(chunk_dir, filename, total_chunks):
     return final_file_path
 
 
+@CHUNK_MERGE_SECONDS.time()
+def complete_multipart_session(storage, group_id, session_id, filename):
+    """按上传会话中记录的ETag完成分段上传，返回供handle_file_upload使用的StoredUpload"""
+    upload_session = UploadSession.query.get(session_id)
+    parts = sorted((int(number), etag) for number, etag in json.loads(upload_session.parts).items())
+    try:
+        with profile_phase("storage"):
+            size = storage.complete_multipart(
+                group_id, upload_session.stored_filename, upload_session.multipart_upload_id, parts
+            )
+    except Exception as e:
+        current_app.logger.error("完成分段上传失败 %s: %s", session_id, e)
+        return None
+    return StoredUpload(upload_session.stored_filename, filename, size)
+
+
 def cleanup_chunks(chunk_dir):
     """清理临时分块文件"""
     import shutil
@@ -407,7 +517,7 @@ def download(group_id, file_id):
             "file.download_version",
             group_id=group_id,
             file_id=file_id,
-            version_id=file.versions[-1].id,
+            version_id=file.latest_version_id,
         )
     )
 
@@ -417,22 +527,58 @@ def download_version(group_id, file_id, version_id):
     version = FileVersion.query.get_or_404(version_id)
     file = version.file
 
-    # 添加调试日志
-    current_app.logger.info(
-        f"Download attempt - File ID: {file_id}, Version ID: {version_id}"
-    )
-    current_app.logger.info(f"File group ID: {file.group_id}, URL group ID: {group_id}")
-    current_app.logger.info(f"Stored filename: {version.stored_filename}")
+    # 如果文件有多个版本（不是第1版，或不是最新版本），则在文件名中添加版本号
+    download_name = file.original_filename
+    if version.version_number > 1 or version.id != file.latest_version_id:
+        # 在文件扩展名前添加版本号
+        if '.' in download_name:
+            name_parts = download_name.split('.')
+            name_parts[-2] += f'_v{version.version_number}'
+            download_name = '.'.join(name_parts)
+        else:
+            download_name += f'_v{version.version_number}'
+
+    storage = get_storage()
+    file_path = storage.local_path(file.group_id, version.stored_filename)
+    # 压缩存储的文件在客户端接受该编码时直接发送压缩数据，否则边解压边发送
+    encoding = accepted_encoding(version.codec)
+    # 下载可能持续很久（协程或ASGI模式下可能同时有上千个），提前把数据库连接还给连接池
+    db.session.close()
+    if file_path is None:
+        # 文件不在本地：重定向到预签名链接，或由服务器转发
+        if current_app.config["DOWNLOAD_PRESIGNED"] and (version.codec is None or encoding):
+            url = storage.presigned_url(
+                file.group_id,
+                version.stored_filename,
+                download_name,
+                current_app.config["PRESIGNED_URL_EXPIRES_SECONDS"],
+                content_encoding=encoding,
+            )
+            return with_storage_codec(redirect(url), version.codec, encoding)
+        if encoding:
+            response = send_from_storage(
+                storage, file.group_id, version.stored_filename, version.stored_size, download_name
+            )
+            return observe_download(
+                with_storage_codec(response, version.codec, encoding), version.stored_size
+            )
+        response = send_from_storage(
+            storage,
+            file.group_id,
+            version.stored_filename,
+            version.size,
+            download_name,
+            codec=version.codec,
+        )
+        return observe_download(with_storage_codec(response, version.codec), version.size)
 
     # 构建并验证文件路径 - 使用统一配置
-    file_path = os.path.join(
-        current_app.config["UPLOAD_FOLDER"], file.group_id, version.stored_filename
+    current_app.logger.debug(
+        "下载文件 - 文件ID: %s, 版本ID: %s, 路径: %s", file_id, version_id, file_path
     )
-    current_app.logger.info(f"Downloading from absolute path: {file_path}")
-    current_app.logger.info(f"File exists: {os.path.exists(file_path)}")
 
     if not os.path.exists(file_path):
-        current_app.logger.error(f"File not found at: {file_path}")
+        current_app.logger.error("File not found at: %s", file_path)
         # 返回500错误但提供明确的错误信息
         return (
             jsonify(
@@ -446,38 +592,88 @@ def download_version(group_id, file_id, version_id):
         )
         # abort(404, description=f"File not found: {version.stored_filename}")
 
+    if version.codec is not None and not encoding:
+        response = send_from_storage(
+            storage,
+            file.group_id,
+            version.stored_filename,
+            version.size,
+            download_name,
+            codec=version.codec,
+        )
+        return observe_download(with_storage_codec(response, version.codec), version.size)
+
     # 使用绝对路径调用send_from_directory
-    # 如果文件有多个版本，则在文件名中添加版本号
-    download_name = file.original_filename
-    if len(file.versions) > 1:
-        # 确定版本号（按上传时间正序，最早的版本是_v1）
-        version_numbers = sorted(file.versions, key=lambda v: v.uploaded_at, reverse=False)
-        version_index = version_numbers.index(version) + 1
-        # 在文件扩展名前添加版本号
-        if '.' in download_name:
-            name_parts = download_name.split('.')
-            name_parts[-2] += f'_v{version_index}'
-            download_name = '.'.join(name_parts)
-        else:
-            download_name += f'_v{version_index}'
-    
-    return send_from_directory(
+    response = send_from_directory(
         os.path.dirname(file_path),
         os.path.basename(file_path),
         as_attachment=True,
         download_name=download_name,
     )
+    if encoding:
+        return observe_download(
+            with_storage_codec(response, version.codec, encoding), version.stored_size
+        )
+    return observe_download(response, version.size)
+
+
+def accepted_encoding(codec):
+    """
+    客户端可以直接接收压缩存储的数据时返回 Content-Encoding，否则返回None
+
+    Range请求的范围是解压后的内容，总是解压后发送。
+    """
+    if codec is None or request.range is not None:
+        return None
+    if request.accept_encodings.quality(codec) > 0:
+        return codec
+    return None
+
+
+def with_storage_codec(response, codec, encoding=None):
+    """压缩存储的文件按 Accept-Encoding 返回不同的响应，设置 Vary 和 Content-Encoding"""
+    if codec is not None:
+        response.vary.add("Accept-Encoding")
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def send_from_storage(storage, group_id, stored_filename, size, download_name, codec=None):
+    """从存储后端流式转发文件（codec 不为None时边解压边发送），支持单个Range请求"""
+    start, end = 0, size
+    status = 200
+    if request.range is not None:
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            response = make_response("", 416)
+            response.headers["Content-Range"] = f"bytes */{size}"
+            return response
+        start, end = byte_range
+        status = 206
+
+    response = Response(
+        stream_with_context(read_blob(storage, group_id, stored_filename, codec, start, end - 1)),
+        status=status,
+        mimetype="application/octet-stream",
+        direct_passthrough=True,
+    )
+    response.headers["Content-Length"] = str(end - start)
+    response.headers["Accept-Ranges"] = "bytes"
+    response.headers["Content-Disposition"] = (
+        f"attachment; filename*=UTF-8''{quote(download_name)}"
+    )
+    if status == 206:
+        response.headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+    return response
 
 
 # 同时支持POST方法以兼容表单方法覆盖机制，DELETE用于直接API调用，POST用于表单提交
 @file.route("/delete/<group_id>/<file_id>", methods=["POST", "DELETE"])
 def delete_file(group_id, file_id):
-    # 添加详细日志
-    current_app.logger.info(
-        f"删除请求 - 方法: {request.method}, 组ID: {group_id}, 文件ID: {file_id}"
+    current_app.logger.debug(
+        "删除请求 - 方法: %s, 组ID: %s, 文件ID: %s", request.method, group_id, file_id
     )
-    current_app.logger.info(f"表单数据: {request.form.to_dict()}")
-    current_app.logger.info(f"方法覆盖来源: {request.form.get('_method')}")
 
     group = Group.query.get_or_404(group_id)
 
@@ -485,62 +681,188 @@ def delete_file(group_id, file_id):
     if group.is_readonly:
         return jsonify({"error": "该小组为只读，无法删除文件"}), 403
 
-    file = File.query.get_or_404(file_id)
+    file = File.query.filter_by(id=file_id, group_id=group_id).first_or_404()
 
-    # 删除文件和版本
-    for version in file.versions:
-        # 删除文件和版本 - 使用统一配置
-        file_path = os.path.join(
-            current_app.config["UPLOAD_FOLDER"], group_id, version.stored_filename
-        )
-        if os.path.exists(file_path):
-            os.remove(file_path)
-
-    db.session.delete(file)
+    # 删除文件和版本的记录，存储中的文件由后台删除
+    delete_files(group_id, [file])
     db.session.commit()
+    blob_reaper.wake()
 
     # 将原有的成功响应替换为重定向
     return redirect(url_for("group.view", group_id=group_id))
 
 
+@file.route("/delete_batch/<group_id>", methods=["POST"])
+def delete_batch(group_id):
+    """
+    批量删除文件，在一个事务中删除所有文件的记录后立即返回，存储中的文件由后台删除
+
+    请求体: JSON {"file_ids": [...]}，或表单中的多个 file_ids
+    返回: {"deleted": [已删除的文件ID], "not_found": [不存在或不属于该小组的文件ID]}
+    """
+    group = Group.query.get_or_404(group_id)
+    if group.is_readonly:
+        return jsonify({"error": "该小组为只读，无法删除文件"}), 403
+
+    payload = request.get_json(silent=True) or {}
+    file_ids = payload.get("file_ids") if request.is_json else request.form.getlist("file_ids")
+    if not isinstance(file_ids, list) or not all(isinstance(file_id, str) for file_id in file_ids):
+        return jsonify({"error": "invalid_parameter", "message": "file_ids 应为文件ID列表"}), 400
+    file_ids = list(dict.fromkeys(file_ids))
+    max_files = current_app.config["BATCH_DELETE_MAX_FILES"]
+    if len(file_ids) > max_files:
+        return jsonify(
+            {"error": "too_many_files", "message": f"一次最多删除 {max_files} 个文件"}
+        ), 400
+
+    files = (
+        File.query.options(selectinload(File.versions))
+        .filter(File.group_id == group_id, File.id.in_(file_ids))
+        .all()
+        if file_ids
+        else []
+    )
+    delete_files(group_id, files)
+    db.session.commit()
+    blob_reaper.wake()
+
+    deleted = {file.id for file in files}
+    current_app.logger.info("批量删除 %s 个文件，小组: %s", len(deleted), group_id)
+    return jsonify(
+        {
+            "deleted": [file_id for file_id in file_ids if file_id in deleted],
+            "not_found": [file_id for file_id in file_ids if file_id not in deleted],
+        }
+    )
+
+
+def parse_utc_datetime(value):
+    """解析ISO 8601时间，转换为与数据库一致的不带时区的UTC时间"""
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
 @file.route("/zip/<group_id>")
 def zip_download(group_id):
-    group = Group.query.get_or_404(group_id)
+    """
+    打包下载小组文件
 
-    # 创建内存中的ZIP文件
-    memory_file = BytesIO()
-    with zipfile.ZipFile(memory_file, "w", zipfile.ZIP_DEFLATED) as zf:
-        for file in group.files:
-            for version in file.versions:
-                # 生成带版本号的文件名
-                timestamp = version.uploaded_at.strftime("%m-%d-%H-%M-%S")
-                versioned_filename = f"v-{timestamp}_{file.original_filename}"
-                # 使用统一配置构建路径
-                file_path = os.path.join(
-                    current_app.config["UPLOAD_FOLDER"],
-                    group_id,
-                    version.stored_filename,
-                )
-                zf.write(file_path, versioned_filename)
+    查询参数（可组合）：
+        versions: all（默认，所有版本）或 latest（每个文件只打包最新版本）
+        file_id: 只打包这些文件，可以重复
+        since, until: 只打包上传时间在 [since, until) 内的版本，ISO 8601格式，不带时区时按UTC
+    """
+    group = Group.query.get_or_404(group_id)
 
-    memory_file.seek(0)
+    latest_only = request.args.get("versions", "all") == "latest"
+    file_ids = set(request.args.getlist("file_id")) or None
+    try:
+        since = parse_utc_datetime(request.args["since"]) if request.args.get("since") else None
+        until = parse_utc_datetime(request.args["until"]) if request.args.get("until") else None
+    except ValueError:
+        return jsonify({"error": "invalid_time", "message": "since/until 不是有效的ISO 8601时间"}), 400
+
+    storage = get_storage()
+    members = select_members(group.files, latest_only, file_ids, since, until)
+    # 打包和发送可能持续很久，提前把数据库连接还给连接池（已加载的属性仍可使用）
+    db.session.close()
+    suffix = "latest" if latest_only else "files"
+    download_name = f"group_{group_id}_{suffix}.zip"
+    options = zip_options(current_app.config)
+
+    zip_cache = ZipCache.from_config(current_app.config)
+    if not zip_cache.enabled:
+        # 不缓存时边打包边发送，members 中的数据已在此加载，后台线程不访问数据库
+        response = Response(
+            stream_zip(lambda target: write_group_zip(target, group_id, members, storage, **options)),
+            mimetype="application/zip",
+        )
+        response.headers["Content-Disposition"] = f"attachment; filename={download_name}"
+        return response
 
-    # 准备响应
-    response = make_response(memory_file.getvalue())
-    response.headers["Content-Disposition"] = (
-        f"attachment; filename=group_{group_id}_files.zip"
+    fingerprint = group_fingerprint(group_id, members)
+    try:
+        path, hit = zip_cache.get_or_build(
+            group_id,
+            fingerprint,
+            lambda target: write_group_zip(target, group_id, members, storage, **options),
+        )
+    except ZipCacheBusy:
+        response = jsonify({"error": "zip_busy", "message": "压缩包正在生成，请稍后重试"})
+        response.status_code = 503
+        response.headers["Retry-After"] = "5"
+        return response
+
+    # 缓存文件的mtime随使用更新，用内容指纹作为ETag
+    response = send_file(
+        path,
+        mimetype="application/zip",
+        as_attachment=True,
+        download_name=download_name,
+        etag=fingerprint,
+        conditional=True,
     )
-    response.headers["Content-type"] = "application/zip"
+    response.headers["X-GroupBin-Zip-Cache"] = "hit" if hit else "miss"
+    return response
+
 
+def get_group_version(group_id, version_id):
+    version = FileVersion.query.get_or_404(version_id)
+    if version.file.group_id != group_id:
+        abort(404)
+    return version
+
+
+@file.route("/preview/<group_id>/<version_id>")
+def preview(group_id, version_id):
+    """返回文件版本的预览（JSON），尚未生成时提交后台生成任务并返回202"""
+    version = get_group_version(group_id, version_id)
+    if not previews.enabled:
+        return jsonify({"error": "preview_disabled", "message": "未启用文件预览"}), 404
+
+    path = previews.find(version.id)
+    if path is None:
+        previews.schedule(preview_target(group_id, version, version.file.original_filename))
+        response = jsonify({"status": "pending"})
+        response.status_code = 202
+        response.headers["Retry-After"] = "2"
+        return response
+
+    # 版本内容不会变化，预览可以长时间缓存
+    max_age = 24 * 3600
+    if path.endswith(".json"):
+        return send_file(path, mimetype="application/json", max_age=max_age)
+    response = jsonify(
+        {
+            "kind": "image",
+            "url": url_for("file.preview_thumbnail", group_id=group_id, version_id=version.id),
+        }
+    )
+    response.cache_control.max_age = max_age
     return response
 
 
+@file.route("/preview/<group_id>/<version_id>/thumbnail")
+def preview_thumbnail(group_id, version_id):
+    version = get_group_version(group_id, version_id)
+    path = previews.find(version.id)
+    if path is None or path.endswith(".json"):
+        abort(404)
+    return send_file(path, max_age=24 * 3600)
+
+
 @file.route("/version_history/<group_id>/<file_id>")
 def version_history(group_id, file_id):
     file = File.query.get_or_404(file_id)
     group = Group.query.get_or_404(group_id)
-    # 按上传时间降序排列版本
-    versions = sorted(file.versions, key=lambda v: v.uploaded_at, reverse=True)
+    # 按版本号降序排列版本
+    versions = (
+        FileVersion.query.filter_by(file_id=file.id)
+        .order_by(FileVersion.version_number.desc())
+        .all()
+    )
     return render_template(
         "version_history.html", group=group, file=file, versions=versions
     )
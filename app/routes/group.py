@@ -8,11 +8,29 @@ from flask import (
     jsonify,
     session,
     current_app,
+    make_response,
 )
 import datetime
 from datetime import timedelta, timezone
 from app import db
-from app.models import Group  # 添加FileVersion模型导入
+from app.models import Group
+from app.utils.conditional import (
+    csrf_state,
+    group_etag,
+    not_modified,
+    not_modified_response,
+    revalidate,
+)
+from app.utils.file_listing import file_summary, list_group_files
+from app.utils.group_events import (
+    events_after,
+    format_event,
+    group_events,
+    latest_event_id,
+    missed_events,
+    publish,
+)
+from app.utils.storage_layout import current_layout
 import os
 
 group = Blueprint("group", __name__)
@@ -78,8 +96,7 @@ def create():
         db.session.commit()
 
         # 创建小组文件夹
-        group_folder = os.path.join(current_app.config["UPLOAD_FOLDER"], new_group.id)
-        os.makedirs(group_folder, exist_ok=True)
+        os.makedirs(current_layout().group_dir(new_group.id), exist_ok=True)
 
         return redirect(url_for("group.view", group_id=new_group.id))
 
@@ -107,7 +124,7 @@ def view(group_id):
     # current_app.logger.info(f"小组是否过期: {is_expired}")
 
     if is_expired:
-        current_app.logger.warning(f"小组已过期，重定向到过期页面: {group_id}")
+        current_app.logger.warning("小组已过期，重定向到过期页面: %s", group_id)
         return render_template("group_expired.html", group=group)
 
     # 检查是否需要统一密码验证（针对未设置密码的小组）
@@ -163,10 +180,142 @@ def view(group_id):
                 next_url=request.url,
             )
 
+    # 内容没有变化时不查询文件，直接返回304
+    etag = group_etag(group, *csrf_state())
+    if not_modified(etag):
+        return not_modified_response(etag)
+
     # current_app.logger.info(f"准备渲染小组页面: {group_id}")
-    return render_template(
-        "group.html", group=group, files=group.files, datetime=datetime
+    # 页面中只带第一页文件，其余的由页面滚动时通过 list_files 接口加载；
+    # 先取事件ID再查询文件，之后的变化都会通过 events 接口收到
+    last_event_id = latest_event_id() if group_events.mode != "off" else 0
+    rows, next_cursor = list_group_files(
+        group.id, limit=current_app.config["FILE_LIST_PAGE_SIZE"]
+    )
+    first_page = {
+        "files": [file_summary(group, file, version) for file, version in rows],
+        "next_cursor": next_cursor,
+    }
+    response = make_response(
+        render_template(
+            "group.html",
+            group=group,
+            first_page=first_page,
+            last_event_id=last_event_id,
+            events_enabled=group_events.mode != "off",
+            file_urls=file_url_templates(group),
+            datetime=datetime,
+        )
+    )
+    # 首次访问时渲染页面才生成CSRF令牌，重新计算ETag
+    return revalidate(response, group_etag(group, *csrf_state()))
+
+
+def file_url_templates(group):
+    """页面根据小组事件添加文件时使用的链接模板，{file_id}、{version_id} 由页面替换"""
+    templates = {
+        "download_url": url_for("file.download", group_id=group.id, file_id="{file_id}"),
+        "versions_url": url_for("file.version_history", group_id=group.id, file_id="{file_id}"),
+        "delete_url": url_for("file.delete_file", group_id=group.id, file_id="{file_id}"),
+    }
+    if current_app.config["PREVIEW_ENABLED"]:
+        templates["preview_url"] = url_for("file.preview", group_id=group.id, version_id="{version_id}")
+    return {key: value.replace("%7B", "{").replace("%7D", "}") for key, value in templates.items()}
+
+
+def is_group_authorized(group):
+    """当前会话是否已通过小组密码或统一密码验证（与 view 的检查相同）"""
+    if group.password_hash:
+        return group.id in session.get("authenticated_groups", [])
+    if current_app.config.get("UNIFIED_PUBLIC_PASSWORD"):
+        return session.get("unified_password_authenticated", False)
+    return True
+
+
+@group.route("/<group_id>/files")
+def list_files(group_id):
+    """
+    分页列出小组的文件（JSON）
+
+    Query参数:
+        sort: uploaded_at（默认，最新版本的上传时间）、name 或 size（最新版本的大小）
+        order: asc（默认）或 desc
+        q: 只列出文件名包含该字符串的文件
+        limit: 每页文件数（默认 FILE_LIST_PAGE_SIZE，最多500）
+        cursor: 上一页返回的 next_cursor
+    """
+    group = Group.query.get_or_404(group_id)
+    if group.is_expired():
+        return jsonify({"error": "expired", "message": "小组已过期"}), 410
+    if not is_group_authorized(group):
+        return jsonify({"error": "unauthorized", "message": "请先在小组页面输入密码"}), 403
+    # ETag 不包含查询参数，不同的查询参数是不同的URL，分别缓存
+    etag = group_etag(group)
+    if not_modified(etag):
+        return not_modified_response(etag)
+
+    try:
+        rows, next_cursor = list_group_files(
+            group.id,
+            sort=request.args.get("sort", "uploaded_at"),
+            order=request.args.get("order", "asc"),
+            cursor=request.args.get("cursor") or None,
+            limit=request.args.get("limit", current_app.config["FILE_LIST_PAGE_SIZE"], type=int),
+            search=request.args.get("q", "").strip() or None,
+        )
+    except ValueError as e:
+        return jsonify({"error": "invalid_parameter", "message": str(e)}), 400
+    response = jsonify(
+        {
+            "files": [file_summary(group, file, version) for file, version in rows],
+            "next_cursor": next_cursor,
+        }
     )
+    return revalidate(response, etag)
+
+
+@group.route("/<group_id>/events")
+def events(group_id):
+    """
+    小组变化事件（text/event-stream）
+
+    事件: file_added、version_added（data 中 file 为文件列表接口中除链接以外的字段）、
+    file_deleted（file_id、size）、group_readonly、reset（需要重新加载文件列表）
+
+    Query参数:
+        after: 从该事件ID之后开始，浏览器重连时以 Last-Event-ID 请求头为准
+    """
+    group = Group.query.get_or_404(group_id)
+    mode = group_events.mode
+    if mode == "off":
+        return jsonify({"error": "disabled", "message": "未启用小组变化通知"}), 404
+    if group.is_expired():
+        return jsonify({"error": "expired", "message": "小组已过期"}), 410
+    if not is_group_authorized(group):
+        return jsonify({"error": "unauthorized", "message": "请先在小组页面输入密码"}), 403
+    try:
+        after_id = int(request.headers.get("Last-Event-ID") or request.args.get("after") or 0)
+    except ValueError:
+        return jsonify({"error": "invalid_parameter", "message": "无效的事件ID"}), 400
+
+    prefix = []
+    if missed_events(after_id):
+        after_id = latest_event_id()
+        prefix.append(format_event(after_id, "reset", "{}"))
+
+    if mode == "stream":
+        body = group_events.stream(group.id, after_id, prefix)
+    else:
+        # 轮询模式：返回已有的事件后结束，浏览器按 retry 的间隔重连
+        body = prefix + [
+            format_event(event.id, event.kind, event.payload)
+            for event in events_after([group.id], after_id)
+        ]
+        body.append(f"retry: {current_app.config['GROUP_EVENTS_RETRY_SECONDS'] * 1000}\n\n")
+    response = current_app.response_class(body, mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-store"
+    response.headers["X-Accel-Buffering"] = "no"  # 不让nginx缓冲推送的事件
+    return response
 
 
 @group.route("/<group_id>/refresh")
@@ -188,6 +337,7 @@ def convert_to_readonly(group_id):
 
     # 执行转换
     group.is_readonly = True
+    publish(group.id, "group_readonly")
     db.session.commit()
 
     return jsonify({"success": True, "message": "小组已成功转换为只读状态"})
\ No newline at end of file
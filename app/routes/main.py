@@ -1,6 +1,7 @@
-from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify
+from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, abort, current_app
 from app import db
 from app.models import Group
+from app.utils.metrics import metrics, collect_upload_session_gauges
 import datetime 
 import uuid
 
@@ -9,3 +10,12 @@ main = Blueprint('main', __name__)
 @main.route('/')
 def index():
     return render_template('index.html', datetime=datetime)
+
+
+@main.route('/metrics')
+def metrics_endpoint():
+    """以Prometheus文本格式输出汇总后的运行指标"""
+    if not metrics.enabled:
+        abort(404)
+    gauges = collect_upload_session_gauges()
+    return metrics.render(gauges), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
@@ -0,0 +1,319 @@
+"""
+tus 1.0 断点续传协议（core、creation、termination 扩展）
+
+与 Resumable.js 的多分片上传不同，tus 客户端先用 POST 创建上传，再用任意长度的
+PATCH 请求从当前偏移量持续写入同一个文件；断线后用 HEAD 查询偏移量即可继续。
+上传的元数据和已接收的范围保存在 UploadSession 记录中（upload_id 即会话ID），
+数据写入 UPLOAD_FOLDER/tmp 下的会话目录，写满 Upload-Length 后通过
+handle_file_upload 创建 File/FileVersion 记录。
+"""
+import base64
+import json
+import os
+import shutil
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from flask import Blueprint, request, current_app, url_for, make_response
+from app import db
+from app.models import Group, UploadSession
+from app.utils.admission import admission, AdmissionRejected
+from app.utils.file_handling import handle_file_upload, UploadedFile, copy_stream
+from app.utils.upload_sessions import (
+    claim_session,
+    create_session,
+    delete_session,
+    record_received,
+    release_session,
+    session_dir,
+)
+from app.utils.usage import check_quota
+
+tus = Blueprint("tus", __name__)
+
+TUS_VERSION = "1.0.0"
+TUS_EXTENSIONS = "creation,termination"
+
+
+def tus_response(status=204, body="", **headers):
+    """生成带有 Tus-Resumable 头的响应"""
+    response = make_response(body, status)
+    response.headers["Tus-Resumable"] = TUS_VERSION
+    response.headers["Cache-Control"] = "no-store"
+    for key, value in headers.items():
+        response.headers[key.replace("_", "-")] = str(value)
+    return response
+
+
+def parse_upload_metadata(header):
+    """解析 Upload-Metadata 头：逗号分隔的 "键 base64值" 对"""
+    metadata = {}
+    for pair in (header or "").split(","):
+        pair = pair.strip()
+        if not pair:
+            continue
+        key, _, encoded = pair.partition(" ")
+        try:
+            metadata[key] = base64.b64decode(encoded).decode("utf-8") if encoded else ""
+        except ValueError:
+            metadata[key] = ""
+    return metadata
+
+
+def try_lock(fd):
+    """
+    对打开的锁文件加非阻塞的排他锁，已被其他请求锁定时返回False
+
+    锁由操作系统在文件关闭或进程退出时释放，worker 在写入中途被杀死也不会留下失效的锁。
+    """
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+def load_upload(group_id, upload_id):
+    """查找小组中的tus上传会话，不存在时返回None"""
+    return UploadSession.query.filter_by(id=upload_id, group_id=group_id, protocol="tus").first()
+
+
+def discard_orphan(upload):
+    """会话记录还在但临时目录已不存在（被清理或在其他节点上删除）时删除记录，客户端重新开始上传"""
+    current_app.logger.warning("tus上传的临时目录不存在，删除上传会话: %s", upload.id)
+    delete_session(upload.id)
+    db.session.commit()
+    return tus_response(404)
+
+
+@tus.errorhandler(AdmissionRejected)
+def admission_rejected(error):
+    """准入控制拒绝时返回带 Tus-Resumable 头的429，客户端按 Retry-After 重试"""
+    return tus_response(429, "服务器繁忙，请稍后重试", Retry_After=error.retry_after)
+
+
+@tus.before_request
+def check_tus_version():
+    if request.method == "OPTIONS":
+        return None
+    if request.headers.get("Tus-Resumable") != TUS_VERSION:
+        return tus_response(412, Tus_Version=TUS_VERSION)
+    return None
+
+
+@tus.route("/<group_id>", methods=["OPTIONS"])
+def options(group_id):
+    return tus_response(
+        204,
+        Tus_Version=TUS_VERSION,
+        Tus_Extension=TUS_EXTENSIONS,
+        Tus_Max_Size=current_app.config["MAX_UPLOAD_SIZE_MB"],
+    )
+
+
+@tus.route("/<group_id>", methods=["POST"])
+def create(group_id):
+    """creation 扩展：创建一个新的上传"""
+    group = Group.query.get_or_404(group_id)
+    if group.is_readonly:
+        return tus_response(403, "该小组为只读，无法上传文件")
+
+    try:
+        upload_length = int(request.headers.get("Upload-Length", ""))
+    except ValueError:
+        return tus_response(400, "缺少有效的Upload-Length")
+    if upload_length < 0:
+        return tus_response(400, "缺少有效的Upload-Length")
+
+    max_size = current_app.config["MAX_UPLOAD_SIZE_MB"]
+    if upload_length > max_size:
+        return tus_response(413, f"文件大小超过限制 ({max_size / 1024 / 1024:.1f} MB)")
+    quota_error = check_quota(group, upload_length, current_app.config["GROUP_QUOTA_MB"])
+    if quota_error:
+        return tus_response(413, quota_error)
+
+    metadata = parse_upload_metadata(request.headers.get("Upload-Metadata"))
+    filename = metadata.get("filename") or metadata.get("name")
+    if not filename:
+        return tus_response(400, "Upload-Metadata中缺少filename")
+
+    upload_id = str(uuid.uuid4())
+    meta = {
+        "content_type": metadata.get("filetype") or "application/octet-stream",
+        "uploader": metadata.get("uploader") or "anonymous",
+        "description": metadata.get("description", ""),
+        "comment": metadata.get("comment")
+        or ("版本更新" if metadata.get("file_id") else "常规上传"),
+    }
+    upload_dir = session_dir(upload_id)
+    os.makedirs(upload_dir)
+    open(os.path.join(upload_dir, "data"), "wb").close()
+    upload = create_session(
+        group.id,
+        "tus",
+        upload_id,
+        session_id=upload_id,
+        file_id=metadata.get("file_id") or None,
+        filename=filename,
+        total_size=upload_length,
+        meta=json.dumps(meta, ensure_ascii=False),
+    )
+
+    location = url_for("tus.upload_resource", group_id=group.id, upload_id=upload_id)
+    response = tus_response(201, Location=location, Upload_Offset=0)
+
+    # 空文件无需PATCH，创建时直接完成
+    if upload_length == 0:
+        return finish_upload(upload, response)
+    return response
+
+
+@tus.route("/<group_id>/<upload_id>", methods=["HEAD"])
+def upload_resource(group_id, upload_id):
+    """查询当前偏移量，客户端据此继续上传"""
+    upload = load_upload(group_id, upload_id)
+    if upload is None:
+        return tus_response(404)
+    try:
+        offset = os.path.getsize(os.path.join(session_dir(upload.id), "data"))
+    except FileNotFoundError:
+        return discard_orphan(upload)
+    response = tus_response(200, Upload_Offset=offset, Upload_Length=upload.total_size)
+    # 数据已写满但完成时合并名额不足，客户端查询到完整的偏移量后不会再发送PATCH，在此完成
+    if offset == upload.total_size:
+        return finish_upload(upload, response)
+    return response
+
+
+@tus.route("/<group_id>/<upload_id>", methods=["PATCH"])
+def patch(group_id, upload_id):
+    """从 Upload-Offset 开始把请求体追加到上传文件"""
+    if request.mimetype != "application/offset+octet-stream":
+        return tus_response(415)
+
+    upload = load_upload(group_id, upload_id)
+    if upload is None:
+        return tus_response(404)
+
+    upload_dir = session_dir(upload.id)
+    data_path = os.path.join(upload_dir, "data")
+
+    # 同一个上传同时只允许一个PATCH写入
+    try:
+        lock_fd = os.open(os.path.join(upload_dir, "patch.lock"), os.O_CREAT | os.O_WRONLY)
+    except FileNotFoundError:
+        return discard_orphan(upload)
+    if not try_lock(lock_fd):
+        os.close(lock_fd)
+        return tus_response(423, "该上传正在被另一个请求写入")
+
+    try:
+        try:
+            offset = int(request.headers.get("Upload-Offset", ""))
+        except ValueError:
+            return tus_response(400, "缺少有效的Upload-Offset")
+
+        try:
+            current_offset = os.path.getsize(data_path)
+        except FileNotFoundError:
+            return discard_orphan(upload)
+        if offset != current_offset:
+            return tus_response(409, Upload_Offset=current_offset)
+
+        remaining = upload.total_size - current_offset
+        # 超出并发限制时直接返回429，不读取请求体
+        admission.acquire_stream()
+        with open(data_path, "ab") as target:
+            received = copy_stream(
+                request.stream,
+                target,
+                remaining,
+                current_app.config["UPLOAD_STREAM_BUFFER_SIZE"],
+                # 接收时间可能超过名额的失效时间，边写边更新
+                on_progress=admission.refresh,
+            )
+        if received > remaining:
+            # 超出声明长度时整个PATCH无效，已写入的部分也丢弃，客户端从原偏移量重试
+            os.truncate(data_path, current_offset)
+            return tus_response(413, Upload_Offset=current_offset)
+
+        new_offset = current_offset + received
+        # 记录已接收的字节范围，同时延后上传会话的过期时间
+        if received:
+            record_received(upload.id, current_offset, new_offset - 1, received)
+    finally:
+        # 锁文件保留在会话目录中，删除会让等待中的请求锁住已经不在目录中的文件
+        os.close(lock_fd)
+
+    response = tus_response(204, Upload_Offset=new_offset)
+    if new_offset == upload.total_size:
+        return finish_upload(upload, response)
+    return response
+
+
+@tus.route("/<group_id>/<upload_id>", methods=["DELETE"])
+def terminate(group_id, upload_id):
+    """termination 扩展：放弃上传并删除已接收的数据"""
+    upload = load_upload(group_id, upload_id)
+    if upload is None:
+        return tus_response(404)
+    delete_session(upload.id)
+    db.session.commit()
+    shutil.rmtree(session_dir(upload_id), ignore_errors=True)
+    return tus_response(204)
+
+
+def finish_upload(upload, response):
+    """上传完整后创建文件记录，与Resumable.js上传的结果完全一致"""
+    upload_id = upload.id
+    upload_dir = session_dir(upload_id)
+    group = Group.query.get_or_404(upload.group_id)
+    if group.is_readonly:
+        delete_session(upload_id)
+        db.session.commit()
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        return tus_response(403, "该小组为只读，无法上传文件")
+
+    # 合并名额不足时返回429，数据已保存，客户端重试HEAD或PATCH时再次尝试完成
+    admission.acquire_merge()
+
+    # 同一个上传只完成一次
+    if not claim_session(upload_id):
+        return tus_response(409, "该上传正在完成中")
+
+    upload = UploadSession.query.get(upload_id)
+    meta = json.loads(upload.meta)
+    upload_kwargs = {
+        "group_id": group.id,
+        "file": UploadedFile(
+            os.path.join(upload_dir, "data"), upload.filename, meta["content_type"]
+        ),
+        "upload_folder": current_app.config["UPLOAD_FOLDER"],
+        "uploader": meta["uploader"],
+        "description": meta["description"],
+        "comment": meta["comment"],
+    }
+    if upload.file_id:
+        upload_kwargs["file_id"] = upload.file_id
+
+    # 文件记录和删除上传会话在同一事务中提交
+    try:
+        new_file = handle_file_upload(**upload_kwargs)
+        delete_session(upload_id)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        release_session(upload_id)
+        raise
+    shutil.rmtree(upload_dir, ignore_errors=True)
+
+    response.headers["X-GroupBin-File-Id"] = new_file.id
+    return response
@@ -2,12 +2,15 @@
  * 初始化Resumable.js上传组件
  * @param {Object} options - 配置选项
  * @param {string} options.target - 上传目标URL
+ * @param {string} options.rawTarget - 原始请求体上传目标URL（可选，设置后分片以application/octet-stream上传）
  * @param {boolean} options.allowMultiple - 是否允许多选
  * @param {string} options.csrfToken - CSRF令牌
  * @param {string} options.groupId - 小组ID
  * @param {string} options.fileId - 文件ID（用于版本上传）
  * @param {boolean} options.isVersionUpload - 是否为版本上传
  * @param {number} options.chunkSize - 分片大小（字节）
+ * @param {string} options.adviceUrl - 获取分片大小和并发数建议的URL（可选）
+ * @param {number} options.retryAfter - 服务端繁忙（429）且响应中没有Retry-After时的基础重试间隔（秒）
  * @param {number} options.maxFileSize - 最大文件大小（字节）
  */
 function initializeResumableUpload(options) {
@@ -38,13 +41,18 @@ function initializeResumableUpload(options) {
     var allowMultiple = options.allowMultiple;
 
     // 创建Resumable实例
+    // 服务端支持时，分片作为原始请求体上传，参数放在查询字符串中
+    var useRawBody = !!options.rawTarget;
+
     var r = new Resumable({
-        target: options.target,
+        target: useRawBody ? options.rawTarget : options.target,
         chunkSize: options.chunkSize || 1024 * 1024, // 使用配置的分片大小，默认1MB
         simultaneousUploads: 3,
         testChunks: true,
         throttleProgressCallbacks: 1,
-        method: "multipart",
+        method: useRawBody ? "octet" : "multipart",
+        // 413（文件过大、超出小组配额）重试也不会成功
+        permanentErrors: [400, 401, 403, 404, 409, 413, 415, 500, 501],
         headers: {
             'X-CSRFToken': options.csrfToken
         },
@@ -136,7 +144,76 @@ function initializeResumableUpload(options) {
                 r.opts.query.comment = commentElement.value;
             }
 
-            r.upload();
+            applyUploadAdvice(function () {
+                r.upload();
+            });
+        });
+
+        // 向服务端获取每个文件的分片大小和并发数建议，失败时使用默认配置
+        function applyUploadAdvice(callback) {
+            var pendingFiles = r.files.filter(function (file) {
+                return !file.isUploading() && file.progress() === 0;
+            });
+            if (!options.adviceUrl || pendingFiles.length === 0) {
+                callback();
+                return;
+            }
+
+            var params = pendingFiles.map(function (file) {
+                return 'size=' + file.size;
+            }).join('&');
+            fetch(options.adviceUrl + '?' + params)
+                .then(function (response) {
+                    return response.ok ? response.json() : null;
+                })
+                .then(function (data) {
+                    if (data && data.files && data.files.length === pendingFiles.length) {
+                        var simultaneousUploads = 1;
+                        pendingFiles.forEach(function (file, index) {
+                            var advice = data.files[index];
+                            if (advice.chunkSize !== file.getOpt('chunkSize')) {
+                                // 按新的分片大小重新切分文件
+                                file.opts.chunkSize = advice.chunkSize;
+                                file.bootstrap();
+                            }
+                            simultaneousUploads = Math.max(simultaneousUploads, advice.simultaneousUploads);
+                        });
+                        // Resumable.js的并发数对所有文件生效，取各文件建议的最大值
+                        r.opts.simultaneousUploads = simultaneousUploads;
+                    }
+                })
+                .catch(function () { })
+                .then(callback);
+        }
+
+        // 分片重试（服务端返回429等非永久性错误）时按指数退避并加入随机抖动，
+        // 避免大量客户端在同一时刻重试。Resumable.js在触发fileRetry后才读取
+        // chunkRetryInterval，因此在这里为该文件设置下一次的重试间隔
+        var baseRetryInterval = (options.retryAfter || 2) * 1000;
+        var maxRetryInterval = 30000;
+        // 服务端在429响应的Retry-After头中给出的秒数。触发fileRetry时该分片的请求还没有被中止，
+        // 之前重试过的分片请求已中止（status为0），因此只会找到本次被拒绝的分片
+        function serverRetryAfter(file) {
+            var seconds = 0;
+            file.chunks.forEach(function (chunk) {
+                var xhr = chunk.xhr;
+                if (xhr && xhr.readyState === 4 && xhr.status === 429) {
+                    seconds = Math.max(seconds, parseInt(xhr.getResponseHeader('Retry-After'), 10) || 0);
+                }
+            });
+            return seconds;
+        }
+        r.on('fileRetry', function (file) {
+            // 距上次重试之后上传有进展，说明服务端已恢复，重新从基础间隔开始退避
+            var progress = file.progress();
+            if (progress > (file.progressAtRetry || 0)) {
+                file.retryAttempts = 0;
+            }
+            file.progressAtRetry = progress;
+            file.retryAttempts = (file.retryAttempts || 0) + 1;
+            var base = serverRetryAfter(file) * 1000 || baseRetryInterval;
+            var interval = Math.min(base * Math.pow(2, file.retryAttempts - 1), maxRetryInterval);
+            file.opts.chunkRetryInterval = Math.round(interval * (0.5 + Math.random()));
         });
 
         // 上传进度事件
@@ -186,6 +263,12 @@ function initializeResumableUpload(options) {
 
         // 文件上传错误事件
         r.on('fileError', function (file, message) {
+            // 服务端返回的JSON错误优先显示其中的说明
+            try {
+                message = JSON.parse(message).message || message;
+            } catch (e) {
+                // 不是JSON，直接显示
+            }
             document.getElementById('resumable-progress-text').textContent = '上传失败: ' + message;
         });
 
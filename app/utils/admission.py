@@ -0,0 +1,220 @@
+"""
+上传准入控制
+
+限制同时写入的分片数、同时进行的合并数，以及每个小组、每个客户端正在上传的字节数。
+状态以文件的形式保存在 UPLOAD_ADMISSION_DIR 中（O_CREAT|O_EXCL 创建，与合并锁相同），
+因此对 gunicorn 的所有 worker 进程生效。超出限制的请求立即返回 429 和 Retry-After，
+不占用 worker 处理请求体，页面访问不会被上传请求饿死。
+
+以 chunk_upload 标记的分片上传视图在 before_request 中检查（在CSRF检查之前注册），
+此时还没有访问 request.form，multipart 分片也不会在被拒绝前解析和落盘请求体。
+分片参数需要在查询字符串中（Resumable.js 总会同时放在查询字符串中）。
+
+获取到的名额记录在 g 中，请求结束时统一释放；worker 异常退出遗留的名额文件
+超过 UPLOAD_ADMISSION_STALE_SECONDS 后视为失效。名额文件中写有持有者的令牌，
+释放时只删除令牌仍然匹配的文件；长时间接收请求体的请求定期调用 refresh 更新修改时间。
+"""
+import os
+import re
+import time
+import uuid
+
+from flask import g, jsonify, current_app, request
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self):
+        self.enabled = False
+        self.admission_dir = None
+        self._chunk_views = set()
+
+    def init_app(self, app):
+        self.enabled = app.config.get("UPLOAD_ADMISSION_ENABLED", False)
+        if not self.enabled:
+            return
+        self.admission_dir = app.config["UPLOAD_ADMISSION_DIR"]
+        self.max_chunks = app.config["UPLOAD_MAX_CONCURRENT_CHUNKS"]
+        self.max_merges = app.config["UPLOAD_MAX_CONCURRENT_MERGES"]
+        self.max_streams = app.config["UPLOAD_MAX_CONCURRENT_STREAMS"]
+        self.max_group_bytes = app.config["UPLOAD_MAX_GROUP_INFLIGHT_BYTES"]
+        self.max_client_bytes = app.config["UPLOAD_MAX_CLIENT_INFLIGHT_BYTES"]
+        self.retry_after = app.config["UPLOAD_RETRY_AFTER_SECONDS"]
+        self.stale_seconds = app.config["UPLOAD_ADMISSION_STALE_SECONDS"]
+        os.makedirs(self.admission_dir, exist_ok=True)
+
+        app.register_error_handler(AdmissionRejected, self._reject)
+        app.before_request(self._admit_chunk_upload)
+        app.teardown_request(self._release_all)
+
+    def chunk_upload(self, view):
+        """标记接收分片的视图，POST请求在读取请求体之前检查分片名额"""
+        self._chunk_views.add(view)
+        return view
+
+    def _admit_chunk_upload(self):
+        if request.method != "POST" or not request.args.get("resumableIdentifier"):
+            return
+        if current_app.view_functions.get(request.endpoint) not in self._chunk_views:
+            return
+        self.acquire_chunk(
+            request.view_args["group_id"],
+            request.remote_addr,
+            request.args.get("resumableCurrentChunkSize", 0, type=int),
+        )
+
+    def acquire_chunk(self, group_id, client, nbytes):
+        """分片写入前调用，超出任一限制时抛出 AdmissionRejected，同一个请求只检查一次"""
+        if not self.enabled or g.get("admission_chunk_admitted"):
+            return
+        g.admission_chunk_admitted = True
+        self._acquire_slot("chunks", self.max_chunks)
+        self._acquire_bytes(f"group_{group_id}", nbytes, self.max_group_bytes)
+        self._acquire_bytes(f"client_{client}", nbytes, self.max_client_bytes)
+
+    def acquire_stream(self):
+        """
+        tus 的PATCH写入前调用，超出并发数时抛出 AdmissionRejected
+
+        一个PATCH可能持续传完整个文件，使用单独的名额，不占用分片名额，也不计入字节额度
+        """
+        if not self.enabled:
+            return
+        self._acquire_slot("streams", self.max_streams)
+
+    def acquire_merge(self):
+        """合并分片前调用，超出并发合并数时抛出 AdmissionRejected"""
+        if not self.enabled:
+            return
+        self._acquire_slot("merges", self.max_merges)
+
+    def chunks_in_flight(self):
+        """
+        所有worker正在写入的分片数（持有的未失效分片名额数）
+
+        未启用准入控制或不限制分片并发数时没有名额文件，返回None。
+        """
+        if not self.enabled or self.max_chunks <= 0:
+            return None
+        slot_dir = os.path.join(self.admission_dir, "chunks")
+        try:
+            names = os.listdir(slot_dir)
+        except FileNotFoundError:
+            return 0
+        return sum(
+            1
+            for name in names
+            if name.endswith(".slot") and not self._is_stale(os.path.join(slot_dir, name))
+        )
+
+    def refresh(self):
+        """更新本请求持有的名额的修改时间（最多每 stale_seconds/4 一次），避免被当作失效回收"""
+        if not self.enabled or "admission_tickets" not in g:
+            return
+        now = time.time()
+        if now - g.get("admission_refreshed_at", 0) < self.stale_seconds / 4:
+            return
+        g.admission_refreshed_at = now
+        for path, _ in g.admission_tickets:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+    def _hold(self, path, token=None):
+        g.setdefault("admission_tickets", []).append((path, token))
+
+    def _is_stale(self, path):
+        try:
+            return os.path.getmtime(path) < time.time() - self.stale_seconds
+        except OSError:
+            return False
+
+    def _acquire_slot(self, kind, limit):
+        if limit <= 0:
+            return
+        slot_dir = os.path.join(self.admission_dir, kind)
+        os.makedirs(slot_dir, exist_ok=True)
+        for index in range(limit):
+            slot_path = os.path.join(slot_dir, f"{index}.slot")
+            token = uuid.uuid4().hex
+            for _ in range(2):
+                try:
+                    fd = os.open(slot_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                except FileExistsError:
+                    if not self._is_stale(slot_path):
+                        break
+                    # 持有者异常退出，回收名额后重试一次
+                    try:
+                        os.remove(slot_path)
+                    except OSError:
+                        pass
+                    continue
+                try:
+                    os.write(fd, token.encode())
+                finally:
+                    os.close(fd)
+                self._hold(slot_path, token)
+                return
+        raise AdmissionRejected(kind, self.retry_after)
+
+    def _acquire_bytes(self, key, nbytes, limit):
+        if limit <= 0:
+            return
+        key_dir = os.path.join(self.admission_dir, "bytes", re.sub(r"[^A-Za-z0-9_.-]", "_", key))
+        os.makedirs(key_dir, exist_ok=True)
+
+        in_flight = 0
+        for name in os.listdir(key_dir):
+            path = os.path.join(key_dir, name)
+            if self._is_stale(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            in_flight += int(name.rpartition("_")[2] or 0)
+
+        # 没有进行中的上传时总是放行，避免单个分片大于限制时永远无法上传。
+        # 统计与创建之间没有加锁，多个worker并发时最多超出各自的一个分片
+        if in_flight and in_flight + nbytes > limit:
+            raise AdmissionRejected(key.partition("_")[0] + "_bytes", self.retry_after)
+
+        ticket_path = os.path.join(key_dir, f"{uuid.uuid4().hex}_{int(nbytes)}")
+        os.close(os.open(ticket_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        self._hold(ticket_path)
+
+    def _release_all(self, exc):
+        for path, token in g.pop("admission_tickets", []):
+            try:
+                if token is not None:
+                    # 名额被当作失效回收后可能已属于其他请求，只删除自己的
+                    with open(path) as f:
+                        if f.read() != token:
+                            continue
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _reject(self, error):
+        current_app.logger.debug("上传请求被准入控制拒绝: %s", error.reason)
+        response = jsonify(
+            {
+                "error": "too_many_requests",
+                "message": "服务器繁忙，请稍后重试",
+                "reason": error.reason,
+                "retry_after": error.retry_after,
+            }
+        )
+        response.status_code = 429
+        response.headers["Retry-After"] = str(error.retry_after)
+        return response
+
+
+admission = AdmissionController()
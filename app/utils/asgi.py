@@ -0,0 +1,280 @@
+"""
+ASGI 服务模式
+
+把 Flask 应用包装为 ASGI 应用（见项目根目录的 asgi.py），由 uvicorn 等异步服务器运行。
+所有路由仍是原来的 Flask 视图，但连接上的 I/O 在事件循环中进行，不占用线程：
+- 请求体：在事件循环中接收完整的请求体（如一个分片），之后才在线程池中调用视图，
+  网速很慢的上传者不会占用线程。超过 ASGI_BUFFER_MB 或未声明长度的请求体（如tus的
+  单个大PATCH）边接收边交给视图，这类请求在接收期间占用一个线程
+- 响应体：每次只在线程池中取下一块数据，发送给客户端的过程在事件循环中等待，
+  下载和ZIP流式打包期间慢速的下载者同样不占用线程
+- 客户端断开时关闭响应的迭代器，ZIP打包等后台工作随之停止
+
+同一个请求的所有调用在同一个 contextvars.Context 中执行，stream_with_context 等依赖
+上下文变量的代码在不同线程中取数据时仍然有效。
+"""
+import asyncio
+import contextvars
+import io
+import logging
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.wsgi import FileWrapper
+
+logger = logging.getLogger(__name__)
+
+# 请求体在内存中缓冲的上限，超过后写入临时文件
+SPOOL_MEMORY_BYTES = 1024 * 1024
+# send_file 下载文件时每次读取的大小，减少线程池调度次数
+FILE_BLOCK_BYTES = 256 * 1024
+
+
+class _ReceiveStream(io.RawIOBase):
+    """在线程中按需从ASGI receive读取请求体，作为wsgi.input使用"""
+
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._buffer = b""
+        self._more = True
+        self.disconnected = False
+
+    def readable(self):
+        return True
+
+    def _fill(self):
+        message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+        if message["type"] == "http.disconnect":
+            self.disconnected = True
+            self._more = False
+            return
+        self._buffer += message.get("body", b"")
+        self._more = message.get("more_body", False)
+
+    def read(self, size=-1):
+        while self._more and (size < 0 or len(self._buffer) < size):
+            self._fill()
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readinto(self, target):
+        data = self.read(len(target))
+        target[: len(data)] = data
+        return len(data)
+
+    def readline(self, size=-1):
+        while self._more and b"\n" not in self._buffer and (size < 0 or len(self._buffer) < size):
+            self._fill()
+        end = self._buffer.find(b"\n") + 1 or len(self._buffer)
+        if size >= 0:
+            end = min(end, size)
+        data, self._buffer = self._buffer[:end], self._buffer[end:]
+        return data
+
+
+class AsgiBridge:
+    """
+    以ASGI协议运行WSGI应用
+
+    Args:
+        wsgi_app: Flask 应用
+        threads: 执行视图和读取响应数据的线程数
+        buffer_bytes: 在事件循环中完整接收的请求体大小上限
+    """
+
+    def __init__(self, wsgi_app, threads=32, buffer_bytes=64 * 1024 * 1024):
+        self.wsgi_app = wsgi_app
+        self.buffer_bytes = buffer_bytes
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="asgi")
+
+    @classmethod
+    def from_app(cls, app):
+        return cls(app, app.config["ASGI_THREADS"], app.config["ASGI_BUFFER_MB"])
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+        else:
+            raise RuntimeError(f"不支持的ASGI连接类型: {scope['type']}")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+
+        def call(fn, *args):
+            # 同一个请求的调用依次在同一个上下文中执行
+            return loop.run_in_executor(self.executor, context.run, fn, *args)
+
+        content_length, chunked = _body_headers(scope)
+        if content_length is None:
+            streaming = chunked
+        else:
+            streaming = content_length > self.buffer_bytes
+        if streaming:
+            body = _ReceiveStream(receive, loop)
+        else:
+            body = await self._receive_body(receive, call)
+            if body is None:
+                return  # 客户端在发送请求体时断开
+
+        environ = _build_environ(scope, body)
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get("started"):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [
+                (name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers
+            ]
+            return _write_not_supported
+
+        def next_chunk(iterator):
+            # 跳过空块，迭代结束时返回None
+            for chunk in iterator:
+                if chunk:
+                    return chunk
+            return None
+
+        iterable = await call(self.wsgi_app, environ, start_response)
+        disconnected = asyncio.Event()
+        watcher = None
+        try:
+            iterator = await call(iter, iterable)
+            first = await call(next_chunk, iterator)
+            response["started"] = True
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": response["status"],
+                    "headers": response["headers"],
+                }
+            )
+            if not streaming or not body._more:
+                watcher = asyncio.ensure_future(_watch_disconnect(receive, disconnected))
+            chunk = first
+            while chunk is not None and not disconnected.is_set():
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                chunk = await call(next_chunk, iterator)
+            if not disconnected.is_set():
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                # 关闭迭代器，客户端断开时停止ZIP打包等后台工作
+                await call(close)
+            if not streaming:
+                await call(body.close)
+
+    async def _receive_body(self, receive, call):
+        """在事件循环中接收完整的请求体，超过 SPOOL_MEMORY_BYTES 后在线程中写入临时文件"""
+        chunks = []
+        buffered = 0
+        spool = None
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                if spool is not None:
+                    await call(spool.close)
+                return None
+            data = message.get("body", b"")
+            if data:
+                chunks.append(data)
+                buffered += len(data)
+            if spool is None and buffered > SPOOL_MEMORY_BYTES:
+                spool = await call(tempfile.TemporaryFile)
+            if spool is not None and chunks:
+                await call(spool.writelines, chunks)
+                chunks = []
+            if not message.get("more_body", False):
+                break
+        if spool is None:
+            return io.BytesIO(b"".join(chunks))
+        await call(spool.seek, 0)
+        return spool
+
+
+async def _watch_disconnect(receive, disconnected):
+    """请求体接收完后，继续等待客户端断开的消息"""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            disconnected.set()
+            return
+
+
+def _file_wrapper(file, buffer_size=8192):
+    return FileWrapper(file, max(buffer_size, FILE_BLOCK_BYTES))
+
+
+def _write_not_supported(data):
+    raise NotImplementedError("不支持WSGI的write()，请返回可迭代对象")
+
+
+def _body_headers(scope):
+    """返回 (Content-Length或None, 是否为分块传输)"""
+    content_length = None
+    chunked = False
+    for name, value in scope["headers"]:
+        if name == b"content-length":
+            try:
+                content_length = int(value)
+            except ValueError:
+                pass
+        elif name == b"transfer-encoding":
+            chunked = b"chunked" in value.lower()
+    return content_length, chunked
+
+
+def _build_environ(scope, body):
+    """按PEP 3333由ASGI的连接信息构造WSGI environ"""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+        "wsgi.file_wrapper": _file_wrapper,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name == "CONTENT_LENGTH":
+            environ["CONTENT_LENGTH"] = value
+        else:
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
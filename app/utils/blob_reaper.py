@@ -0,0 +1,176 @@
+"""
+后台删除存储中的文件
+
+删除文件时只在事务中删除文件和版本的记录，并为每个版本写入一条 DeletedBlob，请求立即返回；
+存储中的文件和预览由每个worker的后台线程删除：
+
+- 每 BLOB_REAPER_INTERVAL_SECONDS 秒（本进程有删除时立即）领取一批到期的记录。领取时以
+  attempts 为乐观锁加1并把下次尝试时间推后，多个worker不会同时删除同一个文件
+- 按小组批量删除（S3 一次请求最多删除1000个对象），每秒最多删除 BLOB_REAPER_DELETES_PER_SECOND
+  个文件，大量删除不会占满磁盘或对象存储的I/O
+- 删除成功（或文件已不存在）后删除记录；失败时按指数退避重试，超过 BLOB_REAPER_MAX_ATTEMPTS
+  次后记录错误并放弃，留下的文件在小组过期被清理时一起删除
+"""
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import update
+
+from app import db
+from app.models import DeletedBlob
+from app.utils.concurrency import offload
+from app.utils.previews import previews
+from app.utils.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+# 领取后在该时间内完成删除，否则其他worker可以重新领取（如进程退出）
+CLAIM_LEASE_SECONDS = 300
+# 重试的最长间隔
+MAX_BACKOFF_SECONDS = 3600
+
+
+def retry_delay(attempts):
+    """第 attempts 次失败后等待的秒数：30秒起每次加倍，最长1小时"""
+    return min(30 * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS)
+
+
+class BlobReaper:
+    def __init__(self):
+        self.app = None
+        self.stop_event = None
+        self.wake_event = None
+        self.thread = None
+
+    def init_app(self, app):
+        self.app = app
+
+    @property
+    def config(self):
+        return self.app.config
+
+    def start(self):
+        """启动后台删除线程"""
+        interval = self.config["BLOB_REAPER_INTERVAL_SECONDS"]
+        if interval <= 0:
+            logger.info("后台删除间隔设置为0，不启动后台删除线程")
+            return
+        if self.thread is not None and self.thread.is_alive():
+            return
+        # 与清理任务相同，在启动时才创建线程和事件，gevent下是协程
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.wake_event.set()
+        self.thread.join()
+        self.thread = None
+
+    def wake(self):
+        """本进程提交了删除后调用，不等下一个间隔"""
+        if self.wake_event is not None:
+            self.wake_event.set()
+
+    def _run(self):
+        interval = self.config["BLOB_REAPER_INTERVAL_SECONDS"]
+        while not self.stop_event.is_set():
+            try:
+                with self.app.app_context():
+                    while not self.stop_event.is_set() and self.run_once():
+                        pass
+            except Exception as e:
+                logger.error("后台删除文件时出错: %s", e)
+            self.wake_event.wait(interval)
+            self.wake_event.clear()
+
+    def _throttle(self, count):
+        rate = self.config["BLOB_REAPER_DELETES_PER_SECOND"]
+        if rate > 0:
+            # 停止时不再等待
+            (self.stop_event or threading.Event()).wait(count / rate)
+
+    def claim(self, limit):
+        """领取一批到期的记录，返回 [(id, 小组ID, 存储文件名, 版本ID, 已尝试次数)]"""
+        now = datetime.now(timezone.utc)
+        rows = (
+            DeletedBlob.query.filter(DeletedBlob.next_attempt_at <= now)
+            .order_by(DeletedBlob.id)
+            .limit(limit)
+            .all()
+        )
+        claimed = []
+        for row in rows:
+            result = db.session.execute(
+                update(DeletedBlob)
+                .where(DeletedBlob.id == row.id, DeletedBlob.attempts == row.attempts)
+                .values(
+                    attempts=row.attempts + 1,
+                    next_attempt_at=now + timedelta(seconds=CLAIM_LEASE_SECONDS),
+                )
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 1:
+                claimed.append(
+                    (row.id, row.group_id, row.stored_filename, row.version_id, row.attempts + 1)
+                )
+        db.session.commit()
+        return claimed
+
+    def run_once(self):
+        """删除一批到期的文件，返回本批领取的数量（0表示没有到期的记录）"""
+        batch = self.claim(self.config["BLOB_REAPER_BATCH_SIZE"])
+        if not batch:
+            return 0
+
+        by_group = {}
+        for row in batch:
+            by_group.setdefault(row[1], []).append(row)
+        storage = get_storage(self.app)
+        errors = {}
+        for group_id, rows in by_group.items():
+            try:
+                failed = offload(storage.delete_many, group_id, [row[2] for row in rows])
+            except Exception as e:
+                failed = {row[2]: str(e) for row in rows}
+            errors.update({(group_id, name): error for name, error in failed.items()})
+
+        done = [row for row in batch if (row[1], row[2]) not in errors]
+        if done:
+            previews.delete([row[3] for row in done if row[3]])
+            DeletedBlob.query.filter(DeletedBlob.id.in_([row[0] for row in done])).delete(
+                synchronize_session=False
+            )
+
+        max_attempts = self.config["BLOB_REAPER_MAX_ATTEMPTS"]
+        now = datetime.now(timezone.utc)
+        for blob_id, group_id, stored_filename, _, attempts in batch:
+            error = errors.get((group_id, stored_filename))
+            if error is None:
+                continue
+            if attempts >= max_attempts:
+                logger.error(
+                    "删除存储文件失败 %s 次，放弃: %s/%s: %s", attempts, group_id, stored_filename, error
+                )
+                DeletedBlob.query.filter_by(id=blob_id).delete(synchronize_session=False)
+            else:
+                logger.warning("删除存储文件失败，稍后重试: %s/%s: %s", group_id, stored_filename, error)
+                DeletedBlob.query.filter_by(id=blob_id).update(
+                    {
+                        DeletedBlob.next_attempt_at: now + timedelta(seconds=retry_delay(attempts)),
+                        DeletedBlob.last_error: error,
+                    },
+                    synchronize_session=False,
+                )
+        db.session.commit()
+        logger.info("后台删除了 %s 个存储文件，%s 个失败", len(done), len(errors))
+        self._throttle(len(batch))
+        return len(batch)
+
+
+blob_reaper = BlobReaper()
@@ -1,18 +1,27 @@
 import os
 import logging
 from datetime import datetime, timedelta, timezone
-from threading import Thread, Event
+import shutil
+import threading
 import time
 from app import db
-from app.models import Group, File, FileVersion
+from app.models import Group, File, FileVersion, UploadSession
 from sqlalchemy import and_
+from app.utils.concurrency import offload
+from app.utils.group_events import purge_events
+from app.utils.metrics import metrics, CLEANUP_PHASE_SECONDS
+from app.utils.storage_layout import StorageLayout, is_shard_name
+from app.utils.storage import get_storage
+from app.utils.upload_sessions import expire_sessions
+from app.utils.usage import reconcile_group_usage
+from app.utils.zip_archive import ZipCache
 
 logger = logging.getLogger(__name__)
 
 class CleanupTask:
     def __init__(self, app):
         self.app = app
-        self.stop_event = Event()
+        self.stop_event = None
         self.thread = None
 
     def start(self):
@@ -27,9 +36,12 @@ class CleanupTask:
             logger.info("清理任务间隔设置为0或负数，不启动清理任务")
             return
             
-        self.thread = Thread(target=self._run, daemon=True)
+        # 在启动时才通过threading模块创建线程和事件：gevent替换标准库后，
+        # 清理循环是一个协程，等待间隔时不阻塞事件循环
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
         self.thread.start()
-        logger.info(f"定时清理任务已启动，间隔: {interval} 小时")
+        logger.info("定时清理任务已启动，间隔: %s 小时", interval)
 
     def stop(self):
         """停止定时清理任务"""
@@ -49,7 +61,7 @@ class CleanupTask:
             try:
                 self._perform_cleanup()
             except Exception as e:
-                logger.error(f"执行清理任务时出错: {e}")
+                logger.error("执行清理任务时出错: %s", e)
 
     def _perform_cleanup(self):
         """执行清理任务"""
@@ -57,17 +69,31 @@ class CleanupTask:
         
         with self.app.app_context():
             # 清理过期的小组和相关文件
-            self._cleanup_expired_groups()
+            with CLEANUP_PHASE_SECONDS.time(phase="expired_groups"):
+                self._cleanup_expired_groups()
             
             # 清理数据库中孤立的文件记录
-            self._cleanup_orphaned_files()
+            with CLEANUP_PHASE_SECONDS.time(phase="orphaned_files"):
+                self._cleanup_orphaned_files()
+            
+            # 按文件记录校正小组的用量计数
+            with CLEANUP_PHASE_SECONDS.time(phase="reconcile_usage"):
+                self._reconcile_group_usage()
             
             # 清理文件系统中的孤立文件
-            self._cleanup_orphaned_files_on_disk()
+            with CLEANUP_PHASE_SECONDS.time(phase="orphaned_files_on_disk"):
+                self._cleanup_orphaned_files_on_disk()
             
             # 清理过期的session文件
-            self._cleanup_expired_sessions()
+            with CLEANUP_PHASE_SECONDS.time(phase="expired_sessions"):
+                self._cleanup_expired_sessions()
+
+            # 清理已推送的小组事件
+            with CLEANUP_PHASE_SECONDS.time(phase="group_events"):
+                self._cleanup_group_events()
             
+        # 清理线程不经过请求周期，主动写出指标快照
+        metrics.flush(force=True)
         logger.info("定时清理任务执行完成")
 
     def _cleanup_expired_groups(self):
@@ -81,7 +107,7 @@ class CleanupTask:
         # 删除数据库中过期很久的小组
         old_groups = Group.query.filter(Group.expires_at < cutoff_time_db).all()
         for group in old_groups:
-            logger.info(f"删除过期小组: {group.name} (ID: {group.id})")
+            logger.info("删除过期小组: %s (ID: %s)", group.name, group.id)
             db.session.delete(group)
         
         # 删除文件系统中过期的小组文件
@@ -92,20 +118,23 @@ class CleanupTask:
             )
         ).all()
         
+        zip_cache = ZipCache.from_config(self.app.config)
+        for group in old_groups + expired_groups:
+            zip_cache.invalidate_group(group.id)
+
+        storage = get_storage(self.app)
         for group in expired_groups:
-            # 删除小组目录中的所有文件
-            group_dir = os.path.join(self.app.config['UPLOAD_FOLDER'], group.id)
-            if os.path.exists(group_dir):
-                try:
-                    import shutil
-                    shutil.rmtree(group_dir)
-                    logger.info(f"删除小组目录: {group_dir}")
-                except Exception as e:
-                    logger.error(f"删除小组目录失败 {group_dir}: {e}")
+            # 删除小组的所有文件（本地存储迁移布局期间新旧目录都会删除）
+            try:
+                # 删除大量文件较慢，协程环境下交给系统线程
+                offload(storage.delete_group, group.id)
+                logger.info("删除小组文件: %s", group.id)
+            except Exception as e:
+                logger.error("删除小组文件失败 %s: %s", group.id, e)
         
         if old_groups or expired_groups:
             db.session.commit()
-            logger.info(f"清理了 {len(old_groups)} 个过期小组记录和 {len(expired_groups)} 个过期小组文件")
+            logger.info("清理了 %s 个过期小组记录和 %s 个过期小组文件", len(old_groups), len(expired_groups))
 
     def _cleanup_orphaned_files_on_disk(self):
         """清理磁盘上的孤立文件"""
@@ -114,7 +143,7 @@ class CleanupTask:
             return
             
         # 获取所有小组ID
-        group_ids = [str(group.id) for group in Group.query.all()]
+        group_ids = {str(group.id) for group in Group.query.all()}
         
         # 遍历上传目录
         for item in os.listdir(upload_folder):
@@ -127,13 +156,16 @@ class CleanupTask:
                     # 清理tmp目录中的过期临时文件
                     self._cleanup_expired_temp_files(item_path)
                     continue
+
+                # 分层布局的子目录，其中的小组目录在下面统一检查
+                if is_shard_name(item):
+                    continue
                     
                 try:
-                    import shutil
-                    shutil.rmtree(item_path)
-                    logger.info(f"删除孤立目录: {item_path}")
+                    offload(shutil.rmtree, item_path)
+                    logger.info("删除孤立目录: %s", item_path)
                 except Exception as e:
-                    logger.error(f"删除孤立目录失败 {item_path}: {e}")
+                    logger.error("删除孤立目录失败 %s: %s", item_path, e)
                     
             # 如果是文件且不在任何小组中，则删除（处理遗留文件）
             elif os.path.isfile(item_path):
@@ -144,12 +176,39 @@ class CleanupTask:
                 if not file_exists and not version_exists:
                     try:
                         os.remove(item_path)
-                        logger.info(f"删除孤立文件: {item_path}")
+                        logger.info("删除孤立文件: %s", item_path)
                     except Exception as e:
-                        logger.error(f"删除孤立文件失败 {item_path}: {e}")
+                        logger.error("删除孤立文件失败 %s: %s", item_path, e)
+
+        # 分层布局下的小组目录
+        layout = StorageLayout.from_config(self.app.config)
+        for group_id, group_path in layout.iter_group_dirs():
+            if group_id in group_ids or os.path.dirname(group_path) == os.path.normpath(upload_folder):
+                continue
+            try:
+                offload(shutil.rmtree, group_path)
+                logger.info("删除孤立目录: %s", group_path)
+            except Exception as e:
+                logger.error("删除孤立目录失败 %s: %s", group_path, e)
 
     def _cleanup_expired_temp_files(self, tmp_dir):
-        """清理tmp目录中过期的临时文件"""
+        """清理过期的上传会话和tmp目录中不属于任何上传会话的过期临时文件"""
+        # 上传会话按 expires_at 索引查询，不依赖目录的修改时间
+        try:
+            expired_count = expire_sessions(get_storage(self.app))
+            if expired_count:
+                logger.info("清理了 %s 个过期上传会话", expired_count)
+        except Exception as e:
+            db.session.rollback()
+            logger.error("清理过期上传会话时出错: %s", e)
+            return
+
+        # 其余目录和锁文件来自升级前的上传或已丢失的会话记录，仍按修改时间清理
+        session_ids = {session_id for (session_id,) in db.session.query(UploadSession.id)}
+        self._cleanup_stray_temp_files(tmp_dir, session_ids)
+
+    def _cleanup_stray_temp_files(self, tmp_dir, session_ids):
+        """清理tmp目录中不属于任何上传会话的过期临时文件"""
         if not os.path.exists(tmp_dir):
             return
             
@@ -162,18 +221,25 @@ class CleanupTask:
             for item in os.listdir(tmp_dir):
                 item_path = os.path.join(tmp_dir, item)
                 
+                # 分层布局的子目录，递归清理其中的上传任务目录
+                if os.path.isdir(item_path) and is_shard_name(item):
+                    self._cleanup_stray_temp_files(item_path, session_ids)
+
+                # 进行中的上传会话由过期时间管理
+                elif item in session_ids:
+                    continue
+
                 # 检查是否为目录（每个上传任务的临时目录）
-                if os.path.isdir(item_path):
+                elif os.path.isdir(item_path):
                     # 检查目录的修改时间判断是否过期
                     dir_mtime = os.path.getmtime(item_path)
                     if dir_mtime < cutoff_time:
                         # 目录已过期，删除它
                         try:
-                            import shutil
-                            shutil.rmtree(item_path)
-                            logger.info(f"删除过期临时目录: {item_path}")
+                            offload(shutil.rmtree, item_path)
+                            logger.info("删除过期临时目录: %s", item_path)
                         except Exception as e:
-                            logger.error(f"删除过期临时目录失败 {item_path}: {e}")
+                            logger.error("删除过期临时目录失败 %s: %s", item_path, e)
                     # 如果目录未过期，则保留它（可能正在上传中）
                 
                 # 检查是否为锁文件
@@ -184,13 +250,13 @@ class CleanupTask:
                         # 锁文件已过期，删除它
                         try:
                             os.remove(item_path)
-                            logger.info(f"删除过期锁文件: {item_path}")
+                            logger.info("删除过期锁文件: %s", item_path)
                         except Exception as e:
-                            logger.error(f"删除过期锁文件失败 {item_path}: {e}")
+                            logger.error("删除过期锁文件失败 %s: %s", item_path, e)
                     # 如果锁文件未过期，则保留它（可能正在合并中）
                         
         except Exception as e:
-            logger.error(f"清理临时文件时出错: {e}")
+            logger.error("清理临时文件时出错: %s", e)
 
     def _cleanup_orphaned_files(self):
         """清理数据库中孤立的文件记录"""
@@ -201,7 +267,7 @@ class CleanupTask:
         # 将File.group_id转换为字符串进行比较
         orphaned_files = File.query.filter(~File.group_id.cast(db.String).in_([str(gid) for gid in group_ids])).all()
         for file in orphaned_files:
-            logger.info(f"删除孤立文件记录: {file.original_filename} (ID: {file.id})")
+            logger.info("删除孤立文件记录: %s (ID: %s)", file.original_filename, file.id)
             db.session.delete(file)
             
         # 查找不属于任何现有文件的文件版本
@@ -209,12 +275,30 @@ class CleanupTask:
         # 将FileVersion.file_id转换为字符串进行比较
         orphaned_versions = FileVersion.query.filter(~FileVersion.file_id.cast(db.String).in_([str(fid) for fid in file_ids])).all()
         for version in orphaned_versions:
-            logger.info(f"删除孤立文件版本记录: {version.id}")
+            logger.info("删除孤立文件版本记录: %s", version.id)
             db.session.delete(version)
             
         if orphaned_files or orphaned_versions:
             db.session.commit()
-            logger.info(f"清理了 {len(orphaned_files)} 个孤立文件记录和 {len(orphaned_versions)} 个孤立文件版本记录")
+            logger.info("清理了 %s 个孤立文件记录和 %s 个孤立文件版本记录", len(orphaned_files), len(orphaned_versions))
+
+    def _reconcile_group_usage(self):
+        """校正小组用量计数的偏差"""
+        try:
+            reconcile_group_usage()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("校正小组用量计数时出错: %s", e)
+
+    def _cleanup_group_events(self):
+        """删除超过保留时间的小组事件"""
+        try:
+            deleted = purge_events(self.app.config['GROUP_EVENTS_RETENTION_MINUTES'])
+            if deleted:
+                logger.info("清理了 %s 个小组事件", deleted)
+        except Exception as e:
+            db.session.rollback()
+            logger.error("清理小组事件时出错: %s", e)
 
     def _cleanup_expired_sessions(self):
         """清理过期的session文件"""
@@ -236,10 +320,10 @@ class CleanupTask:
                     try:
                         os.remove(item_path)
                         deleted_count += 1
-                        logger.info(f"删除过期session文件: {item_path}")
+                        logger.info("删除过期session文件: %s", item_path)
                     except Exception as e:
-                        logger.error(f"删除过期session文件失败 {item_path}: {e}")
+                        logger.error("删除过期session文件失败 %s: %s", item_path, e)
                         
-            logger.info(f"清理了 {deleted_count} 个过期session文件")
+            logger.info("清理了 %s 个过期session文件", deleted_count)
         except Exception as e:
-            logger.error(f"清理session文件时出错: {e}")
\ No newline at end of file
+            logger.error("清理session文件时出错: %s", e)
\ No newline at end of file
@@ -0,0 +1,187 @@
+"""
+存储文件的压缩编码
+
+FileVersion.codec 记录文件在存储中的编码，None 表示原样存储：
+- zstd：需要安装 zstandard（pip install zstandard），压缩和解压都比gzip快得多
+- gzip：标准库实现，未安装 zstandard 时使用
+
+两种编码的输出都是标准的流格式，可以直接作为HTTP响应的 Content-Encoding 发送。
+读取存储文件的地方（下载、ZIP打包、预览）都通过 read_blob / open_blob 读取解压后的内容。
+"""
+import logging
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # 未安装zstandard时使用gzip
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+ZSTD = "zstd"
+GZIP = "gzip"
+# 各编码在存储文件名后添加的后缀
+SUFFIXES = {ZSTD: ".zst", GZIP: ".gz"}
+DEFAULT_LEVELS = {ZSTD: 3, GZIP: 6}
+# 浏览器只支持回溯窗口不超过8MB的zstd流，级别20以上会超出
+MAX_ZSTD_LEVEL = 19
+# gzip格式的zlib窗口参数
+GZIP_WBITS = 31
+# 解压时每块输出的最大字节数
+OUTPUT_CHUNK_SIZE = 1024 * 1024
+
+
+def resolve_codec(name):
+    """
+    把 STORAGE_CODEC 配置解析为实际使用的编码
+
+    auto 和 zstd 在未安装 zstandard 时使用 gzip；off 或空字符串返回None（不压缩）。
+    """
+    name = (name or "off").lower()
+    if name == "off":
+        return None
+    if name in ("auto", ZSTD):
+        if zstandard is not None:
+            return ZSTD
+        if name == ZSTD:
+            logger.warning("未安装zstandard，存储压缩使用gzip")
+        return GZIP
+    if name == GZIP:
+        return GZIP
+    raise ValueError(f"不支持的存储编码: {name}")
+
+
+def codec_level(codec, level=0):
+    """压缩级别，0表示使用编码的默认级别"""
+    if not level:
+        return DEFAULT_LEVELS[codec]
+    return min(level, MAX_ZSTD_LEVEL) if codec == ZSTD else level
+
+
+def _compressor(codec, level):
+    if codec == ZSTD:
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    if codec == GZIP:
+        return zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    raise ValueError(f"不支持的存储编码: {codec}")
+
+
+def compress_chunks(codec, chunks, level):
+    """把数据块流式压缩，返回压缩后的数据块"""
+    compressor = _compressor(codec, level)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    data = compressor.flush()
+    if data:
+        yield data
+
+
+def decompress_chunks(codec, chunks):
+    """
+    把压缩的数据块流式解压，返回解压后的数据块
+
+    每块解压后最多 OUTPUT_CHUNK_SIZE 字节，压缩率很高的数据（如全是0）不会一次解压出很大的块。
+    """
+    if codec == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("读取zstd压缩的文件需要安装zstandard: pip install zstandard")
+        yield from zstandard.ZstdDecompressor().read_to_iter(
+            ChunkReader(chunks), write_size=OUTPUT_CHUNK_SIZE
+        )
+        return
+    if codec != GZIP:
+        raise ValueError(f"不支持的存储编码: {codec}")
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    for chunk in chunks:
+        while chunk:
+            data = decompressor.decompress(chunk, OUTPUT_CHUNK_SIZE)
+            if data:
+                yield data
+            chunk = decompressor.unconsumed_tail
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+def compressed_size(codec, data, level):
+    """试压一段数据，返回压缩后的大小"""
+    return sum(len(chunk) for chunk in compress_chunks(codec, [data], level))
+
+
+def _slice_chunks(chunks, start, end):
+    """从数据块中取出 [start, end] 范围（end 包含在内，None 表示到末尾）"""
+    position = 0
+    for chunk in chunks:
+        chunk_end = position + len(chunk)
+        if chunk_end > start:
+            if end is not None and position > end:
+                return
+            yield chunk[max(start - position, 0): None if end is None else end - position + 1]
+        if end is not None and chunk_end > end:
+            return
+        position = chunk_end
+
+
+def read_blob(storage, group_id, stored_filename, codec, start=0, end=None):
+    """
+    按块读取存储文件解压后 [start, end] 范围内的数据（end 包含在内，None 表示到末尾）
+
+    未压缩的文件直接按范围读取；压缩的文件需要从头解压，start 之前的数据解压后丢弃。
+    """
+    if codec is None:
+        return storage.iter_range(group_id, stored_filename, start, end)
+    chunks = decompress_chunks(codec, storage.iter_range(group_id, stored_filename))
+    if start == 0 and end is None:
+        return chunks
+    return _slice_chunks(chunks, start, end)
+
+
+class ChunkReader:
+    """把数据块迭代器包装为只读的文件对象（tarfile、upload_fileobj 等按 read(n) 读取）"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+        self._offset = 0
+
+    def read(self, size=-1):
+        parts = []
+        wanted = None if size is None or size < 0 else size
+        while wanted is None or wanted > 0:
+            if self._offset >= len(self._buffer):
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    break
+                self._buffer, self._offset = chunk, 0
+                continue
+            # 按偏移读取缓冲区，小块读取时不反复复制整个数据块
+            stop = len(self._buffer) if wanted is None else self._offset + wanted
+            part = self._buffer[self._offset:stop]
+            self._offset += len(part)
+            if wanted is not None:
+                wanted -= len(part)
+            parts.append(part)
+        return b"".join(parts)
+
+    def readable(self):
+        return True
+
+    def close(self):
+        close = getattr(self._chunks, "close", None)
+        if close is not None:
+            close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_blob(storage, group_id, stored_filename, codec):
+    """以只读文件对象打开存储文件解压后的内容，不能定位"""
+    if codec is None:
+        return storage.open(group_id, stored_filename)
+    return ChunkReader(read_blob(storage, group_id, stored_filename, codec))
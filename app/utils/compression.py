@@ -0,0 +1,230 @@
+"""
+存储文件的后台压缩
+
+设置 STORAGE_CODEC 后，上传的事务提交后把新版本交给后台线程池压缩，上传请求不等待：
+- 已知的压缩格式（扩展名）和小于 STORAGE_CODEC_MIN_KB 的文件不压缩
+- 先试压开头64KB，压缩后超过原大小的 STORAGE_CODEC_MAX_RATIO 时不压缩
+- 把压缩结果流式写入一个新的存储文件，再在一个事务中把版本改为指向新文件并记录编码；
+  原文件交给 blob_reaper 延迟删除，已经开始读取原文件的下载不受影响
+- 版本在压缩期间被删除或已被其他进程压缩时，删除新写入的文件
+
+压缩任务只保存在进程内存中，进程退出或等待的任务过多时未压缩的版本保持原样，
+读取时按 FileVersion.codec 判断，原样存储和压缩的文件可以共存。
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import DeletedBlob, File, FileVersion
+from app.utils.codecs import (
+    SUFFIXES,
+    ZSTD,
+    ChunkReader,
+    codec_level,
+    compress_chunks,
+    compressed_size,
+    resolve_codec,
+    zstandard,
+)
+from app.utils.concurrency import offload
+from app.utils.storage import get_storage
+from app.utils.upload_advice import chunk_load
+from app.utils.zip_archive import COMPRESSED_EXTENSIONS, PROBE_BYTES
+
+logger = logging.getLogger(__name__)
+
+# 替换后的原文件延迟删除的时间，已经查到原文件名的下载和预览在此期间可以打开它
+REPLACED_BLOB_GRACE_SECONDS = 300
+# 每个进程等待压缩的版本数上限，超出时不压缩
+MAX_PENDING = 1000
+# 推迟压缩时每次等待的秒数和最长等待时间
+BUSY_WAIT_INTERVAL = 0.5
+BUSY_MAX_WAIT_SECONDS = 30
+
+
+class StorageCompressor:
+    def __init__(self):
+        self.app = None
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def init_app(self, app):
+        self.app = app
+        # 配置错误时在启动时报错，而不是在上传时
+        resolve_codec(app.config.get("STORAGE_CODEC"))
+        if app.config.get("STORAGE_CODEC") == ZSTD and zstandard is None:
+            logger.warning("未安装zstandard，存储压缩使用gzip")
+        if not getattr(self, "_listeners_registered", False):
+            # 只在上传的事务提交后压缩，回滚时丢弃
+            event.listen(Session, "after_commit", self._after_commit)
+            event.listen(Session, "after_rollback", self._after_rollback)
+            self._listeners_registered = True
+
+    @property
+    def config(self):
+        return self.app.config
+
+    @property
+    def codec(self):
+        """新压缩的文件使用的编码，None 表示不压缩"""
+        if self.app is None:
+            return None
+        return resolve_codec(self.config.get("STORAGE_CODEC"))
+
+    # 调度
+    def defer(self, session, target):
+        """在会话提交后压缩新版本（target 为 PreviewTarget），在上传事务中调用"""
+        if self.codec is not None and target.size >= self.config["STORAGE_CODEC_MIN_BYTES"]:
+            session.info.setdefault("compress_targets", []).append(target)
+
+    def _after_commit(self, session):
+        for target in session.info.pop("compress_targets", []):
+            self.schedule(target)
+
+    def _after_rollback(self, session):
+        session.info.pop("compress_targets", None)
+
+    def schedule(self, target):
+        """提交后台压缩任务，不等待完成；等待的任务过多时返回False"""
+        with self._lock:
+            if self._pid != os.getpid():
+                # fork之后的子进程创建自己的线程池
+                self._executor = None
+                self._pending = {}
+                self._pid = os.getpid()
+            if target.version_id in self._pending:
+                return True
+            if len(self._pending) >= MAX_PENDING:
+                logger.info("等待压缩的文件过多，跳过: %s", target.version_id)
+                return False
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.config["STORAGE_CODEC_WORKERS"], thread_name_prefix="compress"
+                )
+            future = self._executor.submit(self._run, self.app, target)
+            self._pending[target.version_id] = future
+        return True
+
+    def wait(self, timeout=None):
+        """等待当前所有压缩任务完成（测试和基准测试使用）"""
+        with self._lock:
+            futures = list(self._pending.values())
+        wait(futures, timeout=timeout)
+
+    def _run(self, app, target):
+        try:
+            with app.app_context():
+                self._wait_until_idle(app.config)
+                self.compress(target)
+        except Exception as e:
+            logger.error("压缩存储文件失败 %s: %s", target.version_id, e)
+        finally:
+            with self._lock:
+                self._pending.pop(target.version_id, None)
+
+    def _wait_until_idle(self, config):
+        """正在处理的分片较多时推迟压缩"""
+        busy = config["UPLOAD_BUSY_INFLIGHT_CHUNKS"] / 2
+        waited = 0
+        while chunk_load.current() >= busy and waited < BUSY_MAX_WAIT_SECONDS:
+            time.sleep(BUSY_WAIT_INTERVAL)
+            waited += BUSY_WAIT_INTERVAL
+
+    # 压缩
+    def compress(self, target):
+        """压缩一个版本的存储文件，返回使用的编码，不值得压缩或版本已变化时返回None"""
+        codec = self.codec
+        if codec is None or os.path.splitext(target.filename)[1].lower() in COMPRESSED_EXTENSIONS:
+            return None
+        if target.codec is not None:
+            return None
+        storage = get_storage(self.app)
+        level = codec_level(codec, self.config["STORAGE_CODEC_LEVEL"])
+        max_ratio = self.config["STORAGE_CODEC_MAX_RATIO"]
+
+        sample = b"".join(
+            storage.iter_range(target.group_id, target.stored_filename, 0, PROBE_BYTES - 1)
+        )
+        if not sample or compressed_size(codec, sample, level) > len(sample) * max_ratio:
+            logger.debug("文件压缩效果差，不压缩: %s", target.version_id)
+            return None
+
+        extension = os.path.splitext(target.stored_filename)[1]
+        stored_filename = f"{uuid.uuid4()}{extension}{SUFFIXES[codec]}"
+        source = storage.iter_range(target.group_id, target.stored_filename)
+        try:
+            # 压缩是CPU密集的工作，协程环境下交给系统线程
+            stored_size = offload(
+                storage.put_stream,
+                target.group_id,
+                stored_filename,
+                ChunkReader(compress_chunks(codec, source, level)),
+            )
+        except BaseException:
+            self._discard(storage, target.group_id, stored_filename)
+            raise
+
+        if stored_size > target.size * max_ratio:
+            logger.debug("文件压缩效果差，保留原文件: %s", target.version_id)
+            self._discard(storage, target.group_id, stored_filename)
+            return None
+        if not self._replace(target, codec, stored_filename, stored_size):
+            logger.info("版本已删除或已压缩，丢弃压缩结果: %s", target.version_id)
+            self._discard(storage, target.group_id, stored_filename)
+            return None
+        logger.info(
+            "压缩存储文件 %s: %s -> %s 字节 (%s)", target.version_id, target.size, stored_size, codec
+        )
+        return codec
+
+    def _replace(self, target, codec, stored_filename, stored_size):
+        """把版本改为指向压缩后的文件并延迟删除原文件，版本已变化时返回False"""
+        result = db.session.execute(
+            update(FileVersion)
+            .where(
+                FileVersion.id == target.version_id,
+                FileVersion.stored_filename == target.stored_filename,
+                FileVersion.codec.is_(None),
+            )
+            .values(stored_filename=stored_filename, codec=codec, stored_size=stored_size)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            db.session.rollback()
+            return False
+        # 文件记录中保存的是第一个版本的存储文件名
+        db.session.execute(
+            update(File)
+            .where(File.group_id == target.group_id, File.stored_filename == target.stored_filename)
+            .values(stored_filename=stored_filename)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.add(
+            DeletedBlob(
+                group_id=target.group_id,
+                stored_filename=target.stored_filename,
+                next_attempt_at=datetime.now(timezone.utc)
+                + timedelta(seconds=REPLACED_BLOB_GRACE_SECONDS),
+            )
+        )
+        db.session.commit()
+        return True
+
+    def _discard(self, storage, group_id, stored_filename):
+        try:
+            storage.delete(group_id, stored_filename)
+        except Exception as e:
+            logger.warning("删除未使用的压缩文件失败 %s/%s: %s", group_id, stored_filename, e)
+
+
+compressor = StorageCompressor()
@@ -0,0 +1,59 @@
+"""
+协程（gevent/eventlet）部署支持
+
+以 gunicorn -k gevent 运行时，threading、socket、time.sleep 等被替换为协程版本，一个进程
+可以同时保持上千个连接；但 CPU 密集的计算（压缩、缩略图）和大文件的磁盘读写仍会阻塞整个
+进程的事件循环，期间其他连接都无法收发数据。
+
+offload 和 cpu_executor 在协程环境下把这类调用交给真正的系统线程执行，在普通的线程环境下
+直接调用或使用普通线程池，不改变原来的行为。交给系统线程的函数不能访问数据库会话、请求上下文
+或协程版本的锁。
+"""
+import concurrent.futures
+
+
+def cooperative_backend():
+    """返回已替换标准库的协程库名称（"gevent" 或 "eventlet"），没有时返回None"""
+    try:
+        from gevent import monkey
+
+        if monkey.is_module_patched("threading"):
+            return "gevent"
+    except ImportError:
+        pass
+    try:
+        from eventlet import patcher
+
+        if patcher.is_monkey_patched("thread"):
+            return "eventlet"
+    except ImportError:
+        pass
+    return None
+
+
+def offload(fn, *args, **kwargs):
+    """执行阻塞调用：协程环境下在系统线程中执行并让出事件循环，否则直接调用"""
+    backend = cooperative_backend()
+    if backend == "gevent":
+        import gevent
+
+        return gevent.get_hub().threadpool.apply(fn, args, kwargs)
+    if backend == "eventlet":
+        from eventlet import tpool
+
+        return tpool.execute(fn, *args, **kwargs)
+    return fn(*args, **kwargs)
+
+
+def cpu_executor(max_workers):
+    """
+    CPU密集任务的线程池
+
+    gevent环境下标准库的线程池会变成协程池，任务仍在事件循环中串行执行，
+    这里改用gevent基于系统线程的线程池，等待结果时只阻塞当前协程。
+    """
+    if cooperative_backend() == "gevent":
+        from gevent.threadpool import ThreadPoolExecutor
+
+        return ThreadPoolExecutor(max_workers=max_workers)
+    return concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
@@ -0,0 +1,79 @@
+"""
+小组页面和文件列表的条件请求（ETag / 304）
+
+ETag 由小组记录中的字段计算：文件变化计数 generation、最后上传时间、文件数、用量，
+以及页面上显示的名称、有效期和只读状态。这些字段都在已经加载的小组记录中，
+If-None-Match 匹配时在查询任何文件和版本之前返回304，内容没有变化的刷新几乎没有开销。
+部署了新的代码或模板后ETag也会变化，不会返回旧版本渲染的页面。
+"""
+import functools
+import hashlib
+import os
+import time
+
+from flask import current_app, request, session
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@functools.lru_cache(maxsize=None)
+def code_version(root=APP_DIR):
+    """应用代码和模板的指纹（按文件的修改时间和大小），同一份部署的所有worker相同"""
+    digest = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(name for name in dirnames if name not in ("__pycache__", "static"))
+        for name in sorted(filenames):
+            if name.endswith((".py", ".html")):
+                path = os.path.join(dirpath, name)
+                stat = os.stat(path)
+                digest.update(f"{os.path.relpath(path, root)}:{stat.st_mtime_ns}:{stat.st_size};".encode())
+    return digest.hexdigest()[:16]
+
+
+def group_etag(group, *extra):
+    """小组内容的弱ETag，extra 为响应还依赖的其他值"""
+    source = (
+        code_version(),
+        group.id,
+        group.generation,
+        group.last_upload_at,
+        group.file_count,
+        group.used_bytes,
+        group.name,
+        group.expires_at,
+        group.is_readonly,
+    ) + extra
+    return hashlib.sha256(repr(source).encode()).hexdigest()[:32]
+
+
+def csrf_state():
+    """
+    页面中嵌入的CSRF令牌的状态
+
+    令牌在 WTF_CSRF_TIME_LIMIT 后失效，ETag 按半个有效期分段变化，
+    浏览器缓存的页面中的令牌不会过期。
+    """
+    config = current_app.config
+    if not config.get("WTF_CSRF_ENABLED", True):
+        return ()
+    token = session.get(config.get("WTF_CSRF_FIELD_NAME", "csrf_token"))
+    limit = config.get("WTF_CSRF_TIME_LIMIT", 3600)
+    period = int(time.time() // max(limit // 2, 1)) if limit else 0
+    return (token, period)
+
+
+def not_modified(etag):
+    """GET请求的 If-None-Match 是否与 etag 匹配"""
+    return request.method in ("GET", "HEAD") and request.if_none_match.contains_weak(etag)
+
+
+def revalidate(response, etag):
+    """设置弱ETag，要求浏览器每次使用缓存前向服务器确认（私有缓存，页面需要密码访问）"""
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified_response(etag):
+    return revalidate(current_app.response_class(status=304), etag)
@@ -0,0 +1,58 @@
+"""
+磁盘缓存目录的LRU淘汰
+
+缓存文件的mtime表示最近使用时间，使用时调用 touch 更新；
+目录总大小超过上限时从最久未使用的文件开始删除。
+"""
+import os
+
+
+def touch(path):
+    """文件存在时更新使用时间并返回True"""
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def evict_lru(directory, max_bytes, suffixes=None, keep=None):
+    """
+    按最近使用时间淘汰目录中的缓存文件，直到总大小不超过 max_bytes
+
+    Args:
+        suffixes: 只统计和删除这些后缀的文件，正在写入的临时文件不受影响
+        keep: 不删除的文件路径（如刚生成的文件）
+
+    Returns:
+        删除的文件数
+    """
+    entries = []
+    total = 0
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if suffixes and not entry.name.endswith(tuple(suffixes)):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+    except FileNotFoundError:
+        return 0
+
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        total -= size
+    return removed
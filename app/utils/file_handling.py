@@ -1,13 +1,67 @@
 import os
 import uuid
-import time
 from datetime import datetime, timezone
+from sqlalchemy import func, select, update
 from werkzeug.utils import secure_filename
 from app import db
-from app.models import File, FileVersion
+from app.models import DeletedBlob, File, FileVersion
 from flask import current_app
+from app.utils.metrics import FILE_UPLOAD_HANDLE_SECONDS
+from app.utils.profiler import profile_phase
+from app.utils.storage import get_storage
+from app.utils.usage import record_delete, record_upload
+from app.utils.file_listing import file_fields
+from app.utils.group_events import publish
+from app.utils.zip_archive import ZipCache
+from app.utils.previews import previews, preview_target
+from app.utils.compression import compressor
 
 
+class StoredUpload:
+    """已经保存在存储后端中的上传文件（如完成的S3分段上传），供handle_file_upload使用"""
+
+    def __init__(self, stored_filename, filename, size, content_type="application/octet-stream"):
+        self.stored_filename = stored_filename
+        self.filename = filename
+        self.size = size
+        self.content_type = content_type
+
+
+class UploadedFile:
+    """已经落盘的上传文件（如分片合并结果），供handle_file_upload使用"""
+
+    def __init__(self, path, filename, content_type="application/octet-stream"):
+        self.path = path
+        self.filename = filename
+        self.content_type = content_type  # 默认内容类型
+
+    def save(self, target_path):
+        os.rename(self.path, target_path)
+
+
+def copy_stream(stream, target, max_bytes, buffer_size, on_progress=None):
+    """按固定大小的缓冲区把stream写入target，边写边计数，每写入一块后调用 on_progress
+
+    Returns:
+        实际读取的字节数；超过 max_bytes 时提前停止读取，返回值大于 max_bytes，
+        超出部分不会写入target
+    """
+    received = 0
+    while True:
+        # 最多多读1个字节，用于发现超出限制的数据
+        buffer = stream.read(min(buffer_size, max_bytes - received + 1))
+        if not buffer:
+            break
+        received += len(buffer)
+        if received > max_bytes:
+            break
+        target.write(buffer)
+        if on_progress is not None:
+            on_progress()
+    return received
+
+
+@FILE_UPLOAD_HANDLE_SECONDS.time()
 def handle_file_upload(
     group_id,
     file,
@@ -17,61 +71,35 @@ def handle_file_upload(
     comment="",
     file_id=None,
 ):
-    # 创建小组目录
-    group_folder = os.path.join(upload_folder, group_id)
-    os.makedirs(group_folder, exist_ok=True)
-
-    # 生成安全的文件名
     original_filename = file.filename  # 保留原始文件名（含中文）
-    # 仅对存储文件名使用安全处理
-    safe_extension = secure_filename(os.path.splitext(file.filename)[1])
-    stored_filename = str(uuid.uuid4()) + safe_extension
-    file_path = os.path.join(group_folder, stored_filename)
-
-    # 保存文件
-    file.save(file_path)
-
-    # 等待文件完全写入磁盘
-    max_wait_time = (
-        current_app.config.get("FILE_MOVE_OPERATION_MAX_WAIT_MS") / 1000.0
-    )  # 转换为秒
-    wait_interval = 0.25
-    elapsed_time = 0
-
-    while elapsed_time < max_wait_time:
-        if os.path.exists(file_path):
-            try:
-                # 尝试获取文件大小，确保文件完全可用
-                file_size = os.path.getsize(file_path)
-                break
-            except OSError:
-                # 文件存在但无法访问，继续等待
-                pass
-
-        # 记录INFO级别日志
-        current_app.logger.info(
-            f"等待文件完全写入磁盘: {file_path}, 已等待 {elapsed_time:.2f} 秒"
-        )
-
-        # 等待150毫秒
-        time.sleep(wait_interval)
-        elapsed_time += wait_interval
+    if getattr(file, "stored_filename", None):
+        # 分片已经直接上传到存储后端（如S3分段上传），无需再保存
+        stored_filename = file.stored_filename
+        file_size = file.size
     else:
-        # 超时仍未找到文件或无法访问文件
-        current_app.logger.error(
-            f"文件操作超时，无法访问文件: {file_path}，已等待 {max_wait_time} 秒"
-        )
-        raise FileNotFoundError(f"文件操作超时，无法访问文件: {file_path}")
+        # 仅对存储文件名使用安全处理
+        safe_extension = secure_filename(os.path.splitext(file.filename)[1])
+        stored_filename = str(uuid.uuid4()) + safe_extension
 
-    # 获取文件大小
-    file_size = os.path.getsize(file_path)
+        # 保存文件，本地存储时按配置的磁盘布局确定位置
+        storage = get_storage(upload_folder=upload_folder)
+        with profile_phase("fs"):
+            file_size = storage.save_file(group_id, stored_filename, file)
 
     # 如果提供了file_id，表示是版本更新
     if file_id:
-        existing_file = File.query.get_or_404(file_id)
+        # 锁定文件记录，同一文件同时上传的版本依次编号（SQLite本身串行写入）
+        existing_file = File.query.with_for_update().filter_by(id=file_id).first_or_404()
+        last_number = (
+            db.session.query(func.max(FileVersion.version_number))
+            .filter(FileVersion.file_id == existing_file.id)
+            .scalar()
+        )
         # 创建新版本
         new_version = FileVersion(
+            id=str(uuid.uuid4()),
             file_id=existing_file.id,
+            version_number=(last_number or 0) + 1,
             stored_filename=stored_filename,
             size=file_size,
             uploaded_at=datetime.now(timezone.utc),
@@ -79,11 +107,20 @@ def handle_file_upload(
             comment=comment,
         )
         db.session.add(new_version)
+        existing_file.latest_version_id = new_version.id
+        record_upload(existing_file.group_id, file_size, new_file=False)
+        ZipCache.from_config(current_app.config).invalidate_group(existing_file.group_id)
+        target = preview_target(existing_file.group_id, new_version, original_filename)
+        previews.defer(db.session, target)
+        compressor.defer(db.session, target)
+        publish(existing_file.group_id, "version_added", file=file_fields(existing_file, new_version))
         return new_version
     else:
         # 创建新文件
+        initial_version_id = str(uuid.uuid4())
         new_file = File(
             id=str(uuid.uuid4()),
+            latest_version_id=initial_version_id,
             group_id=group_id,
             original_filename=original_filename,
             stored_filename=stored_filename,
@@ -97,7 +134,9 @@ def handle_file_upload(
 
         # 创建初始版本
         initial_version = FileVersion(
+            id=initial_version_id,
             file_id=new_file.id,
+            version_number=1,
             stored_filename=stored_filename,
             size=file_size,
             uploaded_at=datetime.now(timezone.utc),
@@ -105,4 +144,71 @@ def handle_file_upload(
             comment=comment,
         )
         db.session.add(initial_version)
+        record_upload(group_id, file_size, new_file=True)
+        ZipCache.from_config(current_app.config).invalidate_group(group_id)
+        target = preview_target(group_id, initial_version, original_filename)
+        previews.defer(db.session, target)
+        compressor.defer(db.session, target)
+        publish(group_id, "file_added", file=file_fields(new_file, initial_version))
         return new_file
+
+
+def delete_files(group_id, files):
+    """
+    删除文件及其所有版本的记录，需要调用方提交事务
+
+    存储中的文件和预览不在请求中删除，而是为每个版本记录一条 DeletedBlob，
+    事务提交后由后台的 blob_reaper 删除（调用方提交后调用 blob_reaper.wake()）。
+    files 应预先加载 versions，避免逐个文件查询。
+    """
+    for file in files:
+        for version in file.versions:
+            db.session.add(
+                DeletedBlob(
+                    group_id=group_id,
+                    stored_filename=version.stored_filename,
+                    version_id=version.id,
+                )
+            )
+        record_delete(group_id, file)
+        publish(
+            group_id,
+            "file_deleted",
+            file_id=file.id,
+            size=sum(version.size for version in file.versions),
+        )
+        db.session.delete(file)
+    if files:
+        ZipCache.from_config(current_app.config).invalidate_group(group_id)
+
+
+def backfill_version_numbers():
+    """
+    为添加版本号之前的数据按上传时间编号，并设置文件的最新版本，返回编号的版本数
+
+    在添加 version_number 列后调用一次，最后创建 (file_id, version_number) 唯一索引
+    （已有的表不会由 create_all 创建索引）。
+    """
+    numbered = 0
+    if db.session.query(FileVersion.query.filter_by(version_number=0).exists()).scalar():
+        number = func.row_number().over(
+            partition_by=FileVersion.file_id,
+            order_by=(FileVersion.uploaded_at, FileVersion.id),
+        ).label("number")
+        rows = db.session.execute(
+            select(FileVersion.id, FileVersion.file_id, number).order_by(FileVersion.file_id, number)
+        ).all()
+        db.session.execute(
+            update(FileVersion), [{"id": row.id, "version_number": row.number} for row in rows]
+        )
+        # 每个文件编号最大的版本排在最后
+        latest = {row.file_id: row.id for row in rows}
+        db.session.execute(
+            update(File),
+            [{"id": file_id, "latest_version_id": version_id} for file_id, version_id in latest.items()],
+        )
+        db.session.commit()
+        numbered = len(rows)
+    for index in FileVersion.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+    return numbered
@@ -0,0 +1,131 @@
+"""
+小组文件列表的分页查询
+
+按游标（上一页最后一个文件的排序值和ID）分页，每页只查询 limit+1 行，翻到后面的页
+不需要像 OFFSET 那样扫描前面所有的行，文件再多每页的耗时也不变。游标对客户端不透明。
+"""
+import base64
+import json
+from datetime import datetime, timezone
+
+from flask import current_app, url_for
+from sqlalchemy import and_, or_
+
+from app.models import File, FileVersion
+
+# 可排序的字段及排序值所在的列
+SORT_KEYS = {
+    "uploaded_at": FileVersion.uploaded_at,  # 最新版本的上传时间
+    "name": File.original_filename,
+    "size": FileVersion.size,  # 最新版本的大小
+}
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(sort, value, file_id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([sort, value, file_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, sort):
+    """解析游标，返回 (排序值, 文件ID)，游标无效或与排序字段不一致时抛出ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, value, file_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise ValueError("无效的分页游标")
+    if cursor_sort != sort or not isinstance(file_id, str):
+        raise ValueError("分页游标与排序方式不一致")
+    if sort == "uploaded_at":
+        value = datetime.fromisoformat(value)
+    return value, file_id
+
+
+def list_group_files(group_id, sort="uploaded_at", order="asc", cursor=None, limit=100, search=None):
+    """
+    查询小组的一页文件及其最新版本
+
+    Args:
+        sort: uploaded_at、name 或 size
+        order: asc 或 desc
+        cursor: 上一页返回的游标，None表示第一页
+        limit: 每页文件数，不超过 MAX_PAGE_SIZE
+        search: 只列出文件名包含该字符串的文件
+
+    Returns:
+        ([(文件, 最新版本)], 下一页的游标或None)
+
+    Raises:
+        ValueError: 参数无效
+    """
+    if sort not in SORT_KEYS:
+        raise ValueError(f"不支持的排序字段: {sort}")
+    if order not in ("asc", "desc"):
+        raise ValueError(f"不支持的排序方向: {order}")
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    key = SORT_KEYS[sort]
+    descending = order == "desc"
+
+    query = (
+        File.query.join(FileVersion, FileVersion.id == File.latest_version_id)
+        .filter(File.group_id == group_id)
+        .with_entities(File, FileVersion)
+    )
+    if search:
+        escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query = query.filter(File.original_filename.ilike(f"%{escaped}%", escape="\\"))
+    if cursor:
+        value, file_id = decode_cursor(cursor, sort)
+        if descending:
+            after = or_(key < value, and_(key == value, File.id < file_id))
+        else:
+            after = or_(key > value, and_(key == value, File.id > file_id))
+        query = query.filter(after)
+    if descending:
+        query = query.order_by(key.desc(), File.id.desc())
+    else:
+        query = query.order_by(key.asc(), File.id.asc())
+
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_file, last_version = rows[-1]
+        last_value = getattr(last_file if key.class_ is File else last_version, key.key)
+        next_cursor = encode_cursor(sort, last_value, last_file.id)
+    return [tuple(row) for row in rows], next_cursor
+
+
+def utc_isoformat(value):
+    """数据库中的时间不带时区（UTC），转换为带时区的ISO格式"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.isoformat()
+
+
+def file_fields(file, version):
+    """文件及其最新版本的字段，不含链接（小组事件中使用，可以在请求之外生成）"""
+    return {
+        "id": file.id,
+        "name": file.original_filename,
+        "description": file.description,
+        "size": version.size,
+        "uploaded_at": utc_isoformat(version.uploaded_at),
+        "uploader": version.uploader,
+        "version_count": version.version_number,  # 版本不会单独删除，最新版本号即版本数
+        "latest_version_id": version.id,
+    }
+
+
+def file_summary(group, file, version):
+    """文件列表中一个文件的信息，只包含最新版本的字段"""
+    summary = file_fields(file, version)
+    summary["download_url"] = url_for("file.download", group_id=group.id, file_id=file.id)
+    summary["versions_url"] = url_for("file.version_history", group_id=group.id, file_id=file.id)
+    if current_app.config["PREVIEW_ENABLED"]:
+        summary["preview_url"] = url_for("file.preview", group_id=group.id, version_id=version.id)
+    if not group.is_readonly:
+        summary["delete_url"] = url_for("file.delete_file", group_id=group.id, file_id=file.id)
+    return summary
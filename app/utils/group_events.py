@@ -0,0 +1,194 @@
+"""
+小组变化通知（Server-Sent Events）
+
+上传、删除文件和转为只读时，在同一事务中写入一条 GroupEvent，事务提交后事件才可见，
+回滚时随之丢弃。小组页面通过 /group/<group_id>/events 接收事件并更新文件列表，
+不需要整页刷新。事件表就是各worker之间的消息通道，不依赖额外的服务：
+
+- 推送模式（stream）：每个worker有一个后台轮询线程，只在有订阅者时每
+  GROUP_EVENTS_POLL_SECONDS 秒查询一次订阅中的小组的新事件，分发给本进程的所有连接。
+  连接数多少都只有一个查询，连接在 GROUP_EVENTS_STREAM_SECONDS 后关闭，由浏览器重连
+- 轮询模式（poll）：返回客户端之后的事件后立即结束响应，并通过 retry 字段让浏览器
+  GROUP_EVENTS_RETRY_SECONDS 秒后重连，每次重连只有一次按索引的查询
+
+长时间保持的连接在同步（sync）或线程worker中会一直占用一个worker或线程，
+因此默认（auto）只在gevent等协程worker中使用推送模式，其他情况使用轮询模式。
+事件ID单调递增，浏览器重连时通过 Last-Event-ID 从上次收到的事件继续；
+需要的事件已被清理时发送 reset 事件，页面重新加载文件列表。
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func
+
+from app import db
+from app.models import GroupEvent
+from app.utils.concurrency import cooperative_backend
+
+logger = logging.getLogger(__name__)
+
+# 推送模式下没有事件时发送注释行的间隔，避免代理断开空闲连接
+HEARTBEAT_SECONDS = 15
+# 每次查询的最大事件数
+POLL_BATCH = 500
+
+
+def publish(group_id, kind, **data):
+    """记录一个小组事件，需要调用方提交事务"""
+    db.session.add(
+        GroupEvent(group_id=group_id, kind=kind, payload=json.dumps(data, ensure_ascii=False))
+    )
+
+
+def latest_event_id():
+    """当前最新的事件ID，页面从该ID之后开始接收事件"""
+    return db.session.query(func.max(GroupEvent.id)).scalar() or 0
+
+
+def events_after(group_ids, after_id, limit=POLL_BATCH):
+    """查询指定小组ID大于 after_id 的事件，按ID排序"""
+    return (
+        GroupEvent.query.filter(GroupEvent.group_id.in_(group_ids), GroupEvent.id > after_id)
+        .order_by(GroupEvent.id)
+        .limit(limit)
+        .all()
+    )
+
+
+def missed_events(after_id):
+    """after_id 之后的事件是否可能已被清理（客户端需要重新加载）"""
+    if not after_id:
+        return False
+    oldest = db.session.query(func.min(GroupEvent.id)).scalar()
+    return oldest is not None and after_id < oldest - 1
+
+
+def purge_events(retention_minutes):
+    """删除超过保留时间的事件，返回删除的数量"""
+    cutoff = datetime.now(timezone.utc) - timedelta(minutes=retention_minutes)
+    deleted = GroupEvent.query.filter(GroupEvent.created_at < cutoff).delete(
+        synchronize_session=False
+    )
+    db.session.commit()
+    return deleted
+
+
+def format_event(event_id, kind, payload):
+    """按SSE格式编码一个事件，payload 为JSON字符串"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {kind}")
+    lines.append(f"data: {payload}")
+    return "\n".join(lines) + "\n\n"
+
+
+class Subscription:
+    """一个推送连接，last_id 为已发给该连接的最后一个事件ID"""
+
+    def __init__(self, group_id, last_id):
+        self.group_id = group_id
+        self.last_id = last_id
+        self.queue = queue.Queue()
+
+
+class GroupEventBroker:
+    def __init__(self):
+        self.app = None
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+        self._thread = None
+        self._pid = None
+
+    def init_app(self, app):
+        self.app = app
+
+    @property
+    def config(self):
+        return self.app.config
+
+    @property
+    def mode(self):
+        """stream、poll 或 off"""
+        mode = self.config.get("GROUP_EVENTS_MODE", "auto")
+        if mode == "auto":
+            return "stream" if cooperative_backend() else "poll"
+        return mode
+
+    def subscribe(self, group_id, last_id):
+        subscription = Subscription(group_id, last_id)
+        with self._lock:
+            self._subscriptions.add(subscription)
+            # fork出的worker中没有父进程的轮询线程
+            if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def stream(self, group_id, after_id, prefix=()):
+        """
+        推送模式的响应体：先发送 prefix，之后是事件和心跳，连接达到最长时间或客户端断开时结束
+
+        开始迭代时才订阅，响应关闭时取消订阅。
+        """
+        subscription = self.subscribe(group_id, after_id)
+        deadline = time.monotonic() + self.config["GROUP_EVENTS_STREAM_SECONDS"]
+        try:
+            yield from prefix
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    event = subscription.queue.get(timeout=min(HEARTBEAT_SECONDS, remaining))
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_event(*event)
+        finally:
+            self.unsubscribe(subscription)
+
+    def _run(self):
+        """轮询线程：有订阅者时定期查询新事件，没有订阅者时退出"""
+        interval = self.config["GROUP_EVENTS_POLL_SECONDS"]
+        while True:
+            time.sleep(interval)
+            with self._lock:
+                subscriptions = list(self._subscriptions)
+                if not subscriptions:
+                    self._thread = None
+                    return
+            try:
+                with self.app.app_context():
+                    self._dispatch(subscriptions)
+            except Exception as e:
+                logger.error("查询小组事件失败: %s", e)
+
+    def _dispatch(self, subscriptions):
+        group_ids = {subscription.group_id for subscription in subscriptions}
+        after_id = min(subscription.last_id for subscription in subscriptions)
+        try:
+            events = [
+                (event.id, event.group_id, event.kind, event.payload)
+                for event in events_after(group_ids, after_id)
+            ]
+        finally:
+            db.session.remove()
+        for subscription in subscriptions:
+            for event_id, group_id, kind, payload in events:
+                if group_id == subscription.group_id and event_id > subscription.last_id:
+                    subscription.queue.put((event_id, kind, payload))
+                    subscription.last_id = event_id
+
+
+group_events = GroupEventBroker()
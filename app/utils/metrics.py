@@ -0,0 +1,385 @@
+"""
+运行时指标收集与 Prometheus 文本格式导出
+
+每个进程在内存中累计直方图数据，并节流地（默认每秒最多一次）写入
+METRICS_DIR/metrics_<pid>.json。/metrics 接口读取目录中所有进程的快照并求和，
+因此在 gunicorn 多个 worker 下也能得到正确的汇总结果。
+
+已退出进程的快照在汇总时并入 metrics_dead.json 后删除，worker 重启后累计值不倒退，
+目录中的文件数也不会随重启次数增长。进程号只在本机有意义，METRICS_DIR 不能由多个节点共用。
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# 耗时类直方图的桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# 传输速率直方图的桶（字节/秒），64KB/s 到 1GB/s
+THROUGHPUT_BUCKETS = tuple(64 * 1024 * 4**i for i in range(8))
+# 单个请求SQL查询数的桶
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+# 已退出进程的快照并入的文件
+DEAD_SNAPSHOT = "metrics_dead.json"
+# 合并已退出进程快照时的锁，超过该时间未删除时视为持有进程已退出
+FOLD_LOCK_STALE_SECONDS = 60
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """带可选标签的直方图，数据保存在所属的 MetricsRegistry 中"""
+
+    def __init__(self, registry, name, documentation, buckets):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        self.registry._observe(self, value, tuple(sorted(labels.items())))
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.histograms = {}
+        self.enabled = False
+        self.metrics_dir = None
+        self.flush_interval = 1.0
+        self._values = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_flush = 0.0
+        self._pid = None
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS):
+        metric = Histogram(self, name, documentation, buckets)
+        self.histograms[name] = metric
+        return metric
+
+    def init_app(self, app):
+        self.enabled = app.config.get("METRICS_ENABLED", True)
+        if not self.enabled:
+            return
+        self.metrics_dir = app.config["METRICS_DIR"]
+        self.flush_interval = app.config.get("METRICS_FLUSH_INTERVAL_SECONDS", 1.0)
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        self._load_own_snapshot()
+
+        @app.before_request
+        def start_request_metrics():
+            g.metrics_request_started = time.perf_counter()
+            g.metrics_query_count = 0
+
+        @app.teardown_request
+        def finish_request_metrics(exc):
+            query_count = g.pop("metrics_query_count", None)
+            if query_count is not None:
+                DB_QUERIES_PER_REQUEST.observe(
+                    query_count, endpoint=request.endpoint or "unknown"
+                )
+
+        if not getattr(self, "_listeners_registered", False):
+            event.listen(Engine, "before_cursor_execute", _count_query)
+            atexit.register(self.flush, force=True)
+            self._listeners_registered = True
+
+    def _snapshot_path(self, pid=None):
+        return os.path.join(self.metrics_dir, f"metrics_{pid or os.getpid()}.json")
+
+    def _load_own_snapshot(self):
+        """进程号被复用时接着旧快照累计，避免汇总值倒退"""
+        self._pid = os.getpid()
+        self._values = {}
+        path = self._snapshot_path()
+        if os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    self._values = _decode_snapshot(json.load(f))
+            except (OSError, ValueError):
+                self._values = {}
+
+    def _observe(self, histogram, value, labels):
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # fork之后的子进程使用自己的快照文件
+                self._load_own_snapshot()
+            key = (histogram.name, labels)
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = {
+                    "buckets": [0] * len(histogram.buckets),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+            for index, bound in enumerate(histogram.buckets):
+                if value <= bound:
+                    data["buckets"][index] += 1
+                    break
+            data["sum"] += value
+            data["count"] += 1
+            self._dirty = True
+        self.flush()
+
+    def flush(self, force=False):
+        """将本进程的数据写入快照文件（节流）"""
+        if not self.enabled or not self._dirty:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < self.flush_interval:
+            return
+        with self._lock:
+            payload = _encode_snapshot(self._values)
+            self._dirty = False
+            self._last_flush = now
+        path = self._snapshot_path()
+        temp_path = path + ".tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(payload, f)
+            os.replace(temp_path, path)
+        except OSError:
+            self._dirty = True
+
+    def _read_snapshot(self, name):
+        """读取一个快照文件，不存在或损坏时返回None"""
+        try:
+            with open(os.path.join(self.metrics_dir, name), encoding="utf-8") as f:
+                return _decode_snapshot(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def _fold_dead_snapshots(self):
+        """把已退出进程的快照并入 DEAD_SNAPSHOT 后删除"""
+        if os.name != "posix":
+            # Windows 上 os.kill 会结束目标进程，无法用来检查进程是否存在
+            return
+        dead = [
+            item
+            for item in os.listdir(self.metrics_dir)
+            if _snapshot_pid(item) not in (None, os.getpid())
+            and not _pid_alive(_snapshot_pid(item))
+        ]
+        if not dead:
+            return
+
+        # 同时只有一个进程合并，避免重复累加或丢失 DEAD_SNAPSHOT 的更新
+        lock_path = os.path.join(self.metrics_dir, "fold.lock")
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            try:
+                if os.path.getmtime(lock_path) < time.time() - FOLD_LOCK_STALE_SECONDS:
+                    os.remove(lock_path)
+            except OSError:
+                pass
+            return
+        except OSError:
+            return
+        try:
+            totals = self._read_snapshot(DEAD_SNAPSHOT) or {}
+            folded = []
+            for item in dead:
+                values = self._read_snapshot(item)
+                if values is not None:
+                    _merge_values(totals, values)
+                    folded.append(item)
+            path = os.path.join(self.metrics_dir, DEAD_SNAPSHOT)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(_encode_snapshot(totals), f)
+            os.replace(path + ".tmp", path)
+            for item in folded:
+                os.remove(os.path.join(self.metrics_dir, item))
+        except OSError:
+            pass
+        finally:
+            try:
+                os.remove(lock_path)
+            except OSError:
+                pass
+
+    def collect(self):
+        """读取所有进程的快照并汇总"""
+        self.flush(force=True)
+        self._fold_dead_snapshots()
+        merged = {}
+        for item in os.listdir(self.metrics_dir):
+            if not (item.startswith("metrics_") and item.endswith(".json")):
+                continue
+            values = self._read_snapshot(item)
+            if values is not None:
+                _merge_values(merged, values)
+        return merged
+
+    def render(self, gauges=()):
+        """生成 Prometheus 文本格式
+
+        Args:
+            gauges: (名称, 说明, 数值) 列表，抓取时即时计算的指标
+        """
+        merged = self.collect()
+        lines = []
+        for name, histogram in self.histograms.items():
+            lines.append(f"# HELP {name} {histogram.documentation}")
+            lines.append(f"# TYPE {name} histogram")
+            for (metric_name, labels), data in sorted(merged.items()):
+                if metric_name != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets, data["buckets"]):
+                    cumulative += bucket_count
+                    bucket_labels = _format_labels(labels + (("le", _format_value(bound)),))
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                inf_labels = _format_labels(labels + (("le", "+Inf"),))
+                lines.append(f"{name}_bucket{inf_labels} {data['count']}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(data['sum'])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {data['count']}")
+        for name, documentation, value in gauges:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _encode_snapshot(values):
+    return [
+        {"name": name, "labels": list(labels), **data} for (name, labels), data in values.items()
+    ]
+
+
+def _decode_snapshot(payload):
+    values = {}
+    for item in payload:
+        labels = tuple(tuple(pair) for pair in item["labels"])
+        values[(item["name"], labels)] = {
+            "buckets": list(item["buckets"]),
+            "sum": float(item["sum"]),
+            "count": int(item["count"]),
+        }
+    return values
+
+
+def _merge_values(target, values):
+    """把一个快照的数据累加到 target 中"""
+    for key, data in values.items():
+        merged = target.get(key)
+        if merged is None:
+            target[key] = data
+            continue
+        merged["buckets"] = [a + b for a, b in zip(merged["buckets"], data["buckets"])]
+        merged["sum"] += data["sum"]
+        merged["count"] += data["count"]
+
+
+def _snapshot_pid(name):
+    """快照文件名中的进程号，不是进程快照时返回None"""
+    if not (name.startswith("metrics_") and name.endswith(".json")):
+        return None
+    pid = name[len("metrics_"):-len(".json")]
+    return int(pid) if pid.isdigit() else None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # 没有权限发送信号，进程存在
+        return True
+    return True
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "metrics_query_count" in g:
+        g.metrics_query_count += 1
+
+
+def observe_download(response, size):
+    """在响应发送完毕后记录下载速率"""
+    started = g.get("metrics_request_started")
+    if not metrics.enabled or started is None or not size:
+        return response
+
+    def record():
+        elapsed = time.perf_counter() - started
+        if elapsed > 0:
+            DOWNLOAD_BYTES_PER_SECOND.observe(size / elapsed)
+
+    response.call_on_close(record)
+    return response
+
+
+def collect_upload_session_gauges():
+    """
+    统计正在进行的上传会话数和已接收的字节数
+
+    按 UploadSession 记录汇总，每次抓取只执行一条聚合查询，不遍历上传临时目录
+    """
+    from sqlalchemy import func
+
+    from app import db
+    from app.models import UploadSession
+
+    sessions, received_bytes = db.session.query(
+        func.count(UploadSession.id), func.coalesce(func.sum(UploadSession.received_bytes), 0)
+    ).one()
+    return [
+        ("groupbin_upload_sessions_active", "正在进行的上传会话数", sessions),
+        ("groupbin_upload_received_bytes", "正在进行的上传会话已接收的字节数", received_bytes),
+    ]
+
+
+metrics = MetricsRegistry()
+
+CHUNK_UPLOAD_SECONDS = metrics.histogram(
+    "groupbin_chunk_upload_seconds", "分片上传请求的处理耗时（秒）"
+)
+CHUNK_MERGE_SECONDS = metrics.histogram(
+    "groupbin_chunk_merge_seconds", "分片合并耗时（秒）"
+)
+FILE_UPLOAD_HANDLE_SECONDS = metrics.histogram(
+    "groupbin_file_upload_handle_seconds", "handle_file_upload 的执行耗时（秒）"
+)
+DOWNLOAD_BYTES_PER_SECOND = metrics.histogram(
+    "groupbin_download_bytes_per_second", "文件下载速率（字节/秒）", THROUGHPUT_BUCKETS
+)
+ZIP_BUILD_SECONDS = metrics.histogram(
+    "groupbin_zip_build_seconds", "小组ZIP打包耗时（秒）"
+)
+CLEANUP_PHASE_SECONDS = metrics.histogram(
+    "groupbin_cleanup_phase_seconds", "定时清理各阶段耗时（秒）"
+)
+DB_QUERIES_PER_REQUEST = metrics.histogram(
+    "groupbin_db_queries_per_request", "单个请求执行的SQL查询数", QUERY_COUNT_BUCKETS
+)
+BOOT_PHASE_SECONDS = metrics.histogram(
+    "groupbin_boot_phase_seconds", "应用启动各阶段耗时（秒）"
+)
@@ -0,0 +1,310 @@
+"""
+文件预览
+
+上传的事务提交后，在后台线程池中为新版本生成预览，保存在 PREVIEW_DIR 中：
+- 图片：缩略图 <version_id>.jpg / <version_id>.png（需要安装 Pillow）
+- 文本：开头 PREVIEW_TEXT_BYTES 字节的内容，<version_id>.json
+- 压缩包（zip/tar）：文件列表，<version_id>.json
+- 其他类型：只记录类型为none，避免重复生成
+
+预览目录总大小超过 PREVIEW_MAX_MB 时按最近使用时间淘汰，被淘汰或在启用前上传的文件
+在第一次请求预览时重新生成。生成预览不会阻塞上传请求：线程数由 PREVIEW_WORKERS 限制，
+等待生成的任务超过 PREVIEW_MAX_PENDING 时丢弃（之后按需生成），
+正在处理的分片较多时推迟生成，避免与上传争抢CPU和磁盘。
+"""
+import io
+import json
+import logging
+import os
+import tarfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.utils.codecs import open_blob, read_blob
+from app.utils.concurrency import offload
+from app.utils.disk_cache import evict_lru, touch
+from app.utils.storage import get_storage
+from app.utils.upload_advice import chunk_load
+
+try:
+    from PIL import Image
+except ImportError:  # 未安装Pillow时不生成图片缩略图
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp", ".tif", ".tiff"}
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+PREVIEW_SUFFIXES = (".json", ".jpg", ".png")
+# 推迟生成时每次等待的秒数和最长等待时间
+BUSY_WAIT_INTERVAL = 0.5
+BUSY_MAX_WAIT_SECONDS = 30
+
+
+class PreviewTarget:
+    """生成预览需要的版本信息，在请求线程中从模型复制，后台线程不访问数据库"""
+
+    def __init__(self, group_id, version_id, stored_filename, filename, size, codec=None):
+        self.group_id = group_id
+        self.version_id = version_id
+        self.stored_filename = stored_filename
+        self.filename = filename
+        self.size = size
+        self.codec = codec
+
+
+def _decode_text(data):
+    """把文本开头的字节解码为字符串，不是文本时返回None"""
+    if b"\0" in data:
+        return None
+    # 截断位置可能在多字节字符中间，最多去掉末尾3个字节后重试
+    for trim in range(4):
+        chunk = data[: len(data) - trim] if trim else data
+        for encoding in ("utf-8", "gb18030"):
+            try:
+                return chunk.decode(encoding)
+            except UnicodeDecodeError:
+                continue
+    return None
+
+
+def _archive_preview(entries, limit, total=None):
+    """total 为None表示条目总数未知（流式读取时只读了前 limit+1 个）"""
+    truncated = len(entries) > limit or (total or 0) > limit
+    return {
+        "kind": "archive",
+        "entries": entries[:limit],
+        "total": total if total is not None else (None if truncated else len(entries)),
+        "truncated": truncated,
+    }
+
+
+class PreviewService:
+    def __init__(self):
+        self.app = None
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def init_app(self, app):
+        self.app = app
+        if not getattr(self, "_listeners_registered", False):
+            # 只在上传的事务提交后生成预览，回滚时丢弃
+            event.listen(Session, "after_commit", self._after_commit)
+            event.listen(Session, "after_rollback", self._after_rollback)
+            self._listeners_registered = True
+
+    @property
+    def config(self):
+        return self.app.config
+
+    @property
+    def enabled(self):
+        return self.app is not None and self.config.get("PREVIEW_ENABLED", False)
+
+    # 路径
+    def preview_path(self, version_id, suffix):
+        return os.path.join(self.config["PREVIEW_DIR"], f"{version_id}{suffix}")
+
+    def find(self, version_id):
+        """返回已生成的预览文件路径并更新使用时间，没有时返回None"""
+        for suffix in PREVIEW_SUFFIXES:
+            path = self.preview_path(version_id, suffix)
+            if touch(path):
+                return path
+        return None
+
+    def delete(self, version_ids):
+        for version_id in version_ids:
+            for suffix in PREVIEW_SUFFIXES:
+                try:
+                    os.remove(self.preview_path(version_id, suffix))
+                except FileNotFoundError:
+                    pass
+
+    # 调度
+    def defer(self, session, target):
+        """在会话提交后生成预览，在上传事务中调用"""
+        if self.enabled:
+            session.info.setdefault("preview_targets", []).append(target)
+
+    def _after_commit(self, session):
+        for target in session.info.pop("preview_targets", []):
+            self.schedule(target)
+
+    def _after_rollback(self, session):
+        session.info.pop("preview_targets", None)
+
+    def schedule(self, target):
+        """提交后台生成任务，不等待完成；已在生成或等待的任务过多时返回False"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            if self._pid != os.getpid():
+                # fork之后的子进程创建自己的线程池
+                self._executor = None
+                self._pending = {}
+                self._pid = os.getpid()
+            if target.version_id in self._pending:
+                return True
+            if len(self._pending) >= self.config["PREVIEW_MAX_PENDING"]:
+                logger.info("等待生成的预览过多，跳过: %s", target.version_id)
+                return False
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.config["PREVIEW_WORKERS"], thread_name_prefix="preview"
+                )
+            future = self._executor.submit(self._run, self.app, target)
+            self._pending[target.version_id] = future
+        return True
+
+    def wait(self, timeout=None):
+        """等待当前所有生成任务完成（测试和基准测试使用）"""
+        with self._lock:
+            futures = list(self._pending.values())
+        wait(futures, timeout=timeout)
+
+    def _run(self, app, target):
+        try:
+            with app.app_context():
+                self._wait_until_idle(app.config)
+                self.generate(target)
+        except Exception as e:
+            logger.error("生成预览失败 %s: %s", target.version_id, e)
+        finally:
+            with self._lock:
+                self._pending.pop(target.version_id, None)
+
+    def _wait_until_idle(self, config):
+        """正在处理的分片较多时推迟生成"""
+        busy = config["UPLOAD_BUSY_INFLIGHT_CHUNKS"] / 2
+        waited = 0
+        while chunk_load.current() >= busy and waited < BUSY_MAX_WAIT_SECONDS:
+            time.sleep(BUSY_WAIT_INTERVAL)
+            waited += BUSY_WAIT_INTERVAL
+
+    # 生成
+    def generate(self, target):
+        """生成预览并写入预览目录，返回预览文件路径"""
+        existing = self.find(target.version_id)
+        if existing:
+            return existing
+        try:
+            # 缩略图等CPU密集的工作在协程环境下交给系统线程
+            suffix, data = offload(self._build, get_storage(self.app), target)
+        except Exception as e:
+            # 记录为无法预览，避免每次请求预览时重复失败
+            logger.warning("无法生成预览 %s: %s", target.version_id, e)
+            suffix, data = ".json", json.dumps({"kind": "none"}).encode("utf-8")
+
+        preview_dir = self.config["PREVIEW_DIR"]
+        os.makedirs(preview_dir, exist_ok=True)
+        path = self.preview_path(target.version_id, suffix)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        evict_lru(
+            preview_dir, self.config["PREVIEW_MAX_MB"], suffixes=PREVIEW_SUFFIXES, keep=path
+        )
+        return path
+
+    def _build(self, storage, target):
+        """返回 (预览文件后缀, 内容)"""
+        name = target.filename.lower()
+        extension = os.path.splitext(name)[1]
+        preview = None
+        if extension in IMAGE_EXTENSIONS and Image is not None:
+            if target.size <= self.config["PREVIEW_MAX_SOURCE_MB"]:
+                return self._image_preview(storage, target)
+        elif extension == ".zip":
+            preview = self._zip_preview(storage, target)
+        elif name.endswith(TAR_SUFFIXES):
+            preview = self._tar_preview(storage, target)
+        else:
+            preview = self._text_preview(storage, target)
+        preview = preview or {"kind": "none"}
+        return ".json", json.dumps(preview, ensure_ascii=False).encode("utf-8")
+
+    def _local_path(self, storage, target):
+        """可以直接打开的本地文件路径，文件在对象存储中或压缩存储时返回None"""
+        if target.codec is not None:
+            return None
+        return storage.local_path(target.group_id, target.stored_filename)
+
+    def _read(self, storage, target, limit):
+        data = bytearray()
+        for chunk in read_blob(
+            storage, target.group_id, target.stored_filename, target.codec, 0, limit - 1
+        ):
+            data += chunk
+        return bytes(data)
+
+    def _text_preview(self, storage, target):
+        limit = self.config["PREVIEW_TEXT_BYTES"]
+        if target.size == 0:
+            return {"kind": "text", "text": "", "truncated": False}
+        text = _decode_text(self._read(storage, target, limit))
+        if text is None:
+            return None
+        return {"kind": "text", "text": text, "truncated": target.size > limit}
+
+    def _zip_preview(self, storage, target):
+        path = self._local_path(storage, target)
+        if path is None:
+            # zip的目录在文件末尾，对象存储中或压缩存储的大文件不读取整个文件
+            if target.size > self.config["PREVIEW_MAX_SOURCE_MB"]:
+                return None
+            path = io.BytesIO(self._read(storage, target, target.size))
+        try:
+            with zipfile.ZipFile(path) as zf:
+                infos = zf.infolist()
+        except zipfile.BadZipFile:
+            return None
+        entries = [{"name": info.filename, "size": info.file_size} for info in infos]
+        return _archive_preview(entries, self.config["PREVIEW_ARCHIVE_ENTRIES"], len(entries))
+
+    def _tar_preview(self, storage, target):
+        limit = self.config["PREVIEW_ARCHIVE_ENTRIES"]
+        entries = []
+        # 流式读取，列出前limit个条目后停止，不读取整个文件
+        with open_blob(storage, target.group_id, target.stored_filename, target.codec) as stream:
+            try:
+                with tarfile.open(fileobj=stream, mode="r|*") as tf:
+                    for member in tf:
+                        if len(entries) > limit:
+                            break
+                        entries.append({"name": member.name, "size": member.size})
+            except tarfile.TarError:
+                return None
+        return _archive_preview(entries, limit)
+
+    def _image_preview(self, storage, target):
+        path = self._local_path(storage, target)
+        source = path if path is not None else io.BytesIO(self._read(storage, target, target.size))
+        size = self.config["PREVIEW_THUMBNAIL_SIZE"]
+        with Image.open(source) as image:
+            image.draft("RGB", (size, size))  # JPEG按缩小后的尺寸解码，减少内存和CPU
+            image.thumbnail((size, size))
+            output = io.BytesIO()
+            if image.mode in ("RGBA", "LA", "P"):
+                image.save(output, "PNG", optimize=True)
+                return ".png", output.getvalue()
+            image.convert("RGB").save(output, "JPEG", quality=80)
+            return ".jpg", output.getvalue()
+
+
+def preview_target(group_id, version, filename):
+    return PreviewTarget(
+        group_id, version.id, version.stored_filename, filename, version.size, version.codec
+    )
+
+
+previews = PreviewService()
@@ -0,0 +1,197 @@
+"""
+可选的请求性能剖析
+
+启用后按 PROFILER_SAMPLE_RATE 抽样请求并用 cProfile 记录调用剖析；
+所有请求都会统计数据库、文件系统和模板渲染的分阶段耗时以及执行的SQL，
+被抽样或耗时超过 PROFILER_SLOW_REQUEST_MS 的请求会被保存到
+PROFILER_DIR 中，最多保留 PROFILER_MAX_ENTRIES 条（环形覆盖最旧的记录）。
+
+未启用时不注册任何钩子，对请求没有额外开销。
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import time
+import uuid
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request, template_rendered, before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# 每个请求最多记录的SQL语句数
+MAX_STATEMENTS = 200
+# 摘要中保留的函数数
+SUMMARY_FUNCTIONS = 30
+
+
+def _current_record():
+    if has_request_context():
+        return g.get("profile_record")
+    return None
+
+
+@contextmanager
+def profile_phase(name):
+    """统计一段代码在当前请求中的耗时，未启用剖析时几乎没有开销"""
+    record = _current_record()
+    if record is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases = record["phases"]
+        phases[name] = phases.get(name, 0.0) + time.perf_counter() - start
+
+
+class RequestProfiler:
+    def __init__(self):
+        self.enabled = False
+        self.profile_dir = None
+        self.max_entries = 200
+
+    def init_app(self, app):
+        self.enabled = app.config.get("PROFILER_ENABLED", False)
+        if not self.enabled:
+            return
+        self.sample_rate = app.config.get("PROFILER_SAMPLE_RATE", 0.01)
+        self.slow_request_seconds = app.config.get("PROFILER_SLOW_REQUEST_MS", 1000) / 1000.0
+        self.profile_dir = app.config["PROFILER_DIR"]
+        self.max_entries = app.config.get("PROFILER_MAX_ENTRIES", 200)
+        os.makedirs(self.profile_dir, exist_ok=True)
+
+        app.before_request(self._start_request)
+        app.teardown_request(self._finish_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+
+        if not getattr(self, "_listeners_registered", False):
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+            self._listeners_registered = True
+
+    def _start_request(self):
+        record = {
+            "started": time.perf_counter(),
+            "phases": {},
+            "statements": [],
+            "statement_count": 0,
+            "profile": None,
+        }
+        if random.random() < self.sample_rate:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                record["profile"] = profile
+            except ValueError:
+                # 同一时刻只能有一个剖析器处于启用状态（Python 3.12+）
+                pass
+        g.profile_record = record
+
+    def _finish_request(self, exc):
+        record = g.pop("profile_record", None)
+        if record is None:
+            return
+        profile = record["profile"]
+        if profile is not None:
+            profile.disable()
+        elapsed = time.perf_counter() - record["started"]
+        if profile is None and elapsed < self.slow_request_seconds:
+            return
+        try:
+            self._save(record, elapsed, exc)
+        except OSError:
+            pass
+
+    def _before_render(self, sender, template, context, **extra):
+        record = _current_record()
+        if record is not None:
+            record["render_started"] = time.perf_counter()
+
+    def _after_render(self, sender, template, context, **extra):
+        record = _current_record()
+        if record is not None and "render_started" in record:
+            phases = record["phases"]
+            elapsed = time.perf_counter() - record.pop("render_started")
+            phases["template"] = phases.get("template", 0.0) + elapsed
+
+    def _save(self, record, elapsed, exc):
+        entry_id = f"{int(time.time() * 1000):015d}_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+        profile = record["profile"]
+        entry = {
+            "id": entry_id,
+            "time": time.time(),
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "elapsed_ms": round(elapsed * 1000, 2),
+            "sampled": profile is not None,
+            "slow": elapsed >= self.slow_request_seconds,
+            "error": repr(exc) if exc else None,
+            "phases_ms": {name: round(value * 1000, 2) for name, value in record["phases"].items()},
+            "statement_count": record["statement_count"],
+            "statements": record["statements"],
+        }
+        if profile is not None:
+            profile.dump_stats(os.path.join(self.profile_dir, entry_id + ".prof"))
+            summary = io.StringIO()
+            pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(
+                SUMMARY_FUNCTIONS
+            )
+            entry["summary"] = summary.getvalue()
+        with open(os.path.join(self.profile_dir, entry_id + ".json"), "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        self._trim()
+
+    def _trim(self):
+        """删除超出上限的最旧记录"""
+        entries = self.list_entry_ids()
+        for entry_id in entries[self.max_entries:]:
+            for suffix in (".json", ".prof"):
+                try:
+                    os.remove(os.path.join(self.profile_dir, entry_id + suffix))
+                except OSError:
+                    pass
+
+    def list_entry_ids(self):
+        """按时间倒序返回已保存的记录ID"""
+        if not self.profile_dir or not os.path.isdir(self.profile_dir):
+            return []
+        names = [item[:-5] for item in os.listdir(self.profile_dir) if item.endswith(".json")]
+        return sorted(names, reverse=True)
+
+    def load_entry(self, entry_id):
+        path = os.path.join(self.profile_dir, os.path.basename(entry_id) + ".json")
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    record = _current_record()
+    if record is not None:
+        conn.info.setdefault("profile_query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    record = _current_record()
+    if record is None:
+        return
+    started_stack = conn.info.get("profile_query_started")
+    if not started_stack:
+        return
+    elapsed = time.perf_counter() - started_stack.pop()
+    phases = record["phases"]
+    phases["db"] = phases.get("db", 0.0) + elapsed
+    record["statement_count"] += 1
+    if len(record["statements"]) < MAX_STATEMENTS:
+        record["statements"].append({"sql": statement, "ms": round(elapsed * 1000, 3)})
+
+
+profiler = RequestProfiler()
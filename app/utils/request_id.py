@@ -0,0 +1,55 @@
+"""
+请求ID
+
+每个请求分配一个ID（优先使用反向代理传入的 X-Request-ID），保存在上下文变量中。
+上下文变量在线程、gevent协程和ASGI服务模式下都只属于当前请求，
+不会像线程ID那样在协程之间共用或被下一个请求复用。日志和响应头 X-Request-ID 中带有该ID。
+"""
+import contextvars
+import logging
+import re
+import uuid
+
+from flask import g, request
+
+_request_id = contextvars.ContextVar("groupbin_request_id", default="-")
+
+# 只接受简单的ID，避免日志注入
+VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+def current_request_id():
+    """当前请求的ID，请求之外为 "-" """
+    return _request_id.get()
+
+
+class RequestIdFilter(logging.Filter):
+    """为日志记录添加 request_id 字段"""
+
+    def filter(self, record):
+        if not hasattr(record, "request_id"):
+            record.request_id = _request_id.get()
+        return True
+
+
+def init_request_id(app):
+    @app.before_request
+    def assign_request_id():
+        incoming = request.headers.get("X-Request-ID", "")
+        request_id = incoming if VALID_REQUEST_ID.match(incoming) else uuid.uuid4().hex[:16]
+        g.request_id_token = _request_id.set(request_id)
+
+    @app.after_request
+    def expose_request_id(response):
+        response.headers["X-Request-ID"] = _request_id.get()
+        return response
+
+    @app.teardown_request
+    def reset_request_id(exc):
+        token = g.pop("request_id_token", None)
+        if token is not None:
+            try:
+                _request_id.reset(token)
+            except ValueError:
+                # 响应在其他上下文中结束（如流式响应），下一个请求会重新设置
+                _request_id.set("-")
@@ -0,0 +1,134 @@
+"""
+轻量的数据库结构升级
+
+db.create_all 只创建缺失的表，不会给已有的表添加新列。这里对比模型和数据库，
+用 ALTER TABLE ADD COLUMN 补上缺失的列，新列需要设置 server_default 或允许为空。
+
+检查需要对每个表查询一次结构。升级和数据整理都完成后，stamp_schema 把模型结构的指纹
+记录在 schema_stamp 表中，指纹没有变化时（即没有部署新的模型）启动只需一次查询。
+"""
+import hashlib
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, DateTime, Integer, String, Table, inspect, select, text
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+
+def add_missing_columns(engine, metadata):
+    """为已有的表添加模型中新增的列，返回添加的 "表名.列名" 列表"""
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    added = []
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = (
+                    f"ALTER TABLE {preparer.quote(table.name)} ADD COLUMN "
+                    f"{preparer.quote(column.name)} {column.type.compile(dialect=engine.dialect)}"
+                )
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                    if not column.nullable:
+                        ddl += " NOT NULL"
+                conn.execute(text(ddl))
+                added.append(f"{table.name}.{column.name}")
+                logger.info("数据库添加列: %s.%s", table.name, column.name)
+    return added
+
+
+def add_missing_indexes(engine, metadata):
+    """
+    为已有的表创建模型中新增的普通索引，返回创建的索引名列表
+
+    唯一索引可能需要先整理已有数据，由调用方在整理后创建。
+    """
+    inspector = inspect(engine)
+    created = []
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.unique or index.name in existing:
+                continue
+            index.create(engine)
+            created.append(index.name)
+            logger.info("数据库添加索引: %s", index.name)
+    return created
+
+
+STAMP_TABLE = "schema_stamp"
+
+
+def _stamp_table(metadata):
+    """记录结构指纹的表，放在模型的 metadata 中，随 create_all/drop_all 创建和删除"""
+    if STAMP_TABLE in metadata.tables:
+        return metadata.tables[STAMP_TABLE]
+    return Table(
+        STAMP_TABLE,
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("fingerprint", String(64), nullable=False),
+        Column("updated_at", DateTime),
+    )
+
+
+def schema_fingerprint(metadata):
+    """模型中表、列和索引定义的指纹"""
+    digest = hashlib.sha256()
+    for table in metadata.sorted_tables:
+        if table.name == STAMP_TABLE:
+            continue
+        digest.update(f"table {table.name}\n".encode())
+        for column in table.columns:
+            digest.update(f"{column.name} {column.type!r} {column.nullable}\n".encode())
+        for index in sorted(table.indexes, key=lambda index: index.name or ""):
+            digest.update(f"index {index.name}\n".encode())
+    return digest.hexdigest()[:32]
+
+
+def ensure_schema(engine, metadata):
+    """
+    创建缺失的表和列，模型结构与上次记录的指纹相同时跳过
+
+    不记录指纹：调用方完成数据整理（补版本号、校正用量等）后调用 stamp_schema，
+    整理失败时下次启动仍会重新检查和整理。
+
+    Returns:
+        跳过时返回None，否则返回添加的 "表名.列名" 列表
+    """
+    stamp = _stamp_table(metadata)
+    try:
+        with engine.connect() as conn:
+            current = conn.execute(select(stamp.c.fingerprint).where(stamp.c.id == 1)).scalar()
+    except SQLAlchemyError:
+        current = None  # 新数据库或旧版本创建的数据库，还没有指纹表
+    if current == schema_fingerprint(metadata):
+        return None
+
+    metadata.create_all(engine)
+    added = add_missing_columns(engine, metadata)
+    add_missing_indexes(engine, metadata)
+    return added
+
+
+def stamp_schema(engine, metadata):
+    """记录当前模型结构的指纹，之后启动时 ensure_schema 直接跳过"""
+    stamp = _stamp_table(metadata)
+    fingerprint = schema_fingerprint(metadata)
+    values = {"fingerprint": fingerprint, "updated_at": datetime.now(timezone.utc)}
+    try:
+        with engine.begin() as conn:
+            if conn.execute(stamp.update().where(stamp.c.id == 1).values(**values)).rowcount == 0:
+                conn.execute(stamp.insert().values(id=1, **values))
+    except IntegrityError:
+        pass  # 多个进程同时启动，其他进程已经写入
+    logger.info("数据库结构已更新，指纹: %s", fingerprint)
@@ -0,0 +1,378 @@
+"""
+文件存储后端
+
+存储的文件以 (group_id, stored_filename) 标识。LocalStorage 把文件保存在 UPLOAD_FOLDER 中
+（目录布局见 storage_layout）；S3Storage 保存在 S3 兼容的对象存储中（AWS S3、MinIO 等），
+需要安装 boto3。
+
+S3Storage 支持分段上传：Resumable.js 的每个分片直接作为一个分段上传，
+所有分片完成后由对象存储完成合并，服务器本地不需要再合并分片。
+"""
+import os
+import shutil
+import time
+
+from flask import current_app
+
+from app.utils.storage_layout import StorageLayout
+
+# 流式读取时每次读取的字节数
+READ_CHUNK_SIZE = 1024 * 1024
+# S3分段上传除最后一段外的最小分段大小
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class StorageBackend:
+    """存储后端接口"""
+
+    name = None
+    # 是否支持把分片直接作为分段上传（create_multipart 等方法）
+    supports_multipart = False
+
+    def save_file(self, group_id, stored_filename, file):
+        """保存上传的文件（FileStorage 或 UploadedFile），返回文件大小"""
+        if hasattr(file, "path"):
+            with open(file.path, "rb") as stream:
+                size = self.put_stream(group_id, stored_filename, stream)
+            os.remove(file.path)
+            return size
+        return self.put_stream(group_id, stored_filename, file.stream)
+
+    def put_stream(self, group_id, stored_filename, stream):
+        """把可读流写入存储，返回写入的字节数"""
+        raise NotImplementedError
+
+    def open(self, group_id, stored_filename):
+        """以二进制只读方式打开文件"""
+        raise NotImplementedError
+
+    def iter_range(self, group_id, stored_filename, start=0, end=None):
+        """按块读取 [start, end] 范围内的数据（end 包含在内，None 表示到文件末尾）"""
+        with self.open(group_id, stored_filename) as f:
+            f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                size = READ_CHUNK_SIZE if remaining is None else min(READ_CHUNK_SIZE, remaining)
+                data = f.read(size)
+                if not data:
+                    break
+                if remaining is not None:
+                    remaining -= len(data)
+                yield data
+
+    def exists(self, group_id, stored_filename):
+        raise NotImplementedError
+
+    def delete(self, group_id, stored_filename):
+        raise NotImplementedError
+
+    def delete_many(self, group_id, stored_filenames):
+        """删除小组的多个文件，返回 {文件名: 错误信息}（删除失败的文件），文件不存在不算失败"""
+        errors = {}
+        for stored_filename in stored_filenames:
+            try:
+                self.delete(group_id, stored_filename)
+            except Exception as e:
+                errors[stored_filename] = str(e)
+        return errors
+
+    def delete_group(self, group_id):
+        """删除小组的所有文件"""
+        for stored_filename in self.list(group_id):
+            self.delete(group_id, stored_filename)
+
+    def list(self, group_id):
+        """返回小组的所有存储文件名"""
+        raise NotImplementedError
+
+    def local_path(self, group_id, stored_filename):
+        """文件在本地文件系统中的路径，不在本地时返回None"""
+        return None
+
+    def presigned_url(self, group_id, stored_filename, download_name, expires, content_encoding=None):
+        """生成可以直接下载的临时链接，不支持时返回None；content_encoding 为响应的 Content-Encoding"""
+        return None
+
+    # 分段上传
+    def create_multipart(self, group_id, stored_filename):
+        """开始分段上传，返回upload_id"""
+        raise NotImplementedError
+
+    def upload_part(self, group_id, stored_filename, upload_id, part_number, stream, length):
+        """上传一个分段，返回完成时需要的分段标识（ETag）"""
+        raise NotImplementedError
+
+    def complete_multipart(self, group_id, stored_filename, upload_id, parts):
+        """按 [(分段号, ETag), ...] 完成分段上传，返回文件大小"""
+        raise NotImplementedError
+
+    def abort_multipart(self, group_id, stored_filename, upload_id):
+        raise NotImplementedError
+
+
+class LocalStorage(StorageBackend):
+    name = "local"
+
+    def __init__(self, layout, max_wait_seconds=3.0):
+        self.layout = layout
+        self.max_wait_seconds = max_wait_seconds
+
+    def save_file(self, group_id, stored_filename, file):
+        file_path = self.layout.new_blob_path(group_id, stored_filename)
+        # UploadedFile 直接重命名，FileStorage 写入目标文件
+        file.save(file_path)
+        return self._wait_for_file(file_path)
+
+    def _wait_for_file(self, file_path):
+        """等待文件完全写入磁盘，返回文件大小"""
+        wait_interval = 0.25
+        elapsed_time = 0
+
+        while elapsed_time < self.max_wait_seconds:
+            if os.path.exists(file_path):
+                try:
+                    # 尝试获取文件大小，确保文件完全可用
+                    return os.path.getsize(file_path)
+                except OSError:
+                    # 文件存在但无法访问，继续等待
+                    pass
+
+            current_app.logger.info(
+                "等待文件完全写入磁盘: %s, 已等待 %.2f 秒",
+                file_path,
+                elapsed_time,
+            )
+            time.sleep(wait_interval)
+            elapsed_time += wait_interval
+
+        # 超时仍未找到文件或无法访问文件
+        current_app.logger.error(
+            "文件操作超时，无法访问文件: %s，已等待 %s 秒",
+            file_path,
+            self.max_wait_seconds,
+        )
+        raise FileNotFoundError(f"文件操作超时，无法访问文件: {file_path}")
+
+    def put_stream(self, group_id, stored_filename, stream):
+        file_path = self.layout.new_blob_path(group_id, stored_filename)
+        with open(file_path, "wb") as target:
+            shutil.copyfileobj(stream, target, READ_CHUNK_SIZE)
+        return os.path.getsize(file_path)
+
+    def open(self, group_id, stored_filename):
+        return open(self.layout.blob_path(group_id, stored_filename), "rb")
+
+    def exists(self, group_id, stored_filename):
+        return os.path.exists(self.layout.blob_path(group_id, stored_filename))
+
+    def delete(self, group_id, stored_filename):
+        try:
+            os.remove(self.layout.blob_path(group_id, stored_filename))
+        except FileNotFoundError:
+            pass
+
+    def delete_group(self, group_id):
+        for group_dir in self.layout.group_dirs(group_id):
+            shutil.rmtree(group_dir)
+
+    def list(self, group_id):
+        names = []
+        for group_dir in self.layout.group_dirs(group_id):
+            for _, _, files in os.walk(group_dir):
+                names.extend(files)
+        return names
+
+    def local_path(self, group_id, stored_filename):
+        return self.layout.blob_path(group_id, stored_filename)
+
+
+class S3Storage(StorageBackend):
+    name = "s3"
+    supports_multipart = True
+
+    def __init__(self, bucket, prefix="", endpoint_url=None, region=None,
+                 access_key_id=None, secret_access_key=None, client=None):
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError("使用S3存储后端需要安装boto3: pip install boto3")
+            client = boto3.client(
+                "s3",
+                endpoint_url=endpoint_url or None,
+                region_name=region or None,
+                aws_access_key_id=access_key_id or None,
+                aws_secret_access_key=secret_access_key or None,
+            )
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+
+    def key(self, group_id, stored_filename):
+        return f"{self.prefix}{group_id}/{stored_filename}"
+
+    def put_stream(self, group_id, stored_filename, stream):
+        # upload_fileobj 对大文件自动使用分段上传，不会把整个文件读入内存
+        counter = _CountingReader(stream)
+        self.client.upload_fileobj(counter, self.bucket, self.key(group_id, stored_filename))
+        return counter.count
+
+    def open(self, group_id, stored_filename):
+        response = self.client.get_object(Bucket=self.bucket, Key=self.key(group_id, stored_filename))
+        return response["Body"]
+
+    def iter_range(self, group_id, stored_filename, start=0, end=None):
+        byte_range = f"bytes={start}-{'' if end is None else end}"
+        response = self.client.get_object(
+            Bucket=self.bucket, Key=self.key(group_id, stored_filename), Range=byte_range
+        )
+        body = response["Body"]
+        try:
+            for data in iter(lambda: body.read(READ_CHUNK_SIZE), b""):
+                yield data
+        finally:
+            body.close()
+
+    def exists(self, group_id, stored_filename):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(group_id, stored_filename))
+        except self.client.exceptions.ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def delete(self, group_id, stored_filename):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(group_id, stored_filename))
+
+    def delete_many(self, group_id, stored_filenames):
+        errors = {}
+        names = list(stored_filenames)
+        # DeleteObjects 每次最多1000个对象
+        for index in range(0, len(names), 1000):
+            response = self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={
+                    "Objects": [{"Key": self.key(group_id, name)} for name in names[index:index + 1000]],
+                    "Quiet": True,
+                },
+            )
+            for error in response.get("Errors", []):
+                name = error["Key"][len(self.key(group_id, "")):]
+                errors[name] = f"{error.get('Code')}: {error.get('Message')}"
+        return errors
+
+    def delete_group(self, group_id):
+        keys = [self.key(group_id, name) for name in self.list(group_id)]
+        # DeleteObjects 每次最多1000个对象
+        for index in range(0, len(keys), 1000):
+            self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": key} for key in keys[index:index + 1000]], "Quiet": True},
+            )
+
+    def list(self, group_id):
+        group_prefix = self.key(group_id, "")
+        names = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=group_prefix):
+            for item in page.get("Contents", []):
+                names.append(item["Key"][len(group_prefix):])
+        return names
+
+    def presigned_url(self, group_id, stored_filename, download_name, expires, content_encoding=None):
+        from urllib.parse import quote
+
+        params = {
+            "Bucket": self.bucket,
+            "Key": self.key(group_id, stored_filename),
+            "ResponseContentDisposition": f"attachment; filename*=UTF-8''{quote(download_name)}",
+        }
+        if content_encoding:
+            params["ResponseContentEncoding"] = content_encoding
+        return self.client.generate_presigned_url("get_object", Params=params, ExpiresIn=expires)
+
+    def create_multipart(self, group_id, stored_filename):
+        response = self.client.create_multipart_upload(
+            Bucket=self.bucket, Key=self.key(group_id, stored_filename)
+        )
+        return response["UploadId"]
+
+    def upload_part(self, group_id, stored_filename, upload_id, part_number, stream, length):
+        response = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key(group_id, stored_filename),
+            UploadId=upload_id,
+            PartNumber=int(part_number),
+            Body=stream,
+            ContentLength=length,
+        )
+        return response["ETag"]
+
+    def complete_multipart(self, group_id, stored_filename, upload_id, parts):
+        key = self.key(group_id, stored_filename)
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={
+                "Parts": [{"PartNumber": int(number), "ETag": etag} for number, etag in parts]
+            },
+        )
+        return self.client.head_object(Bucket=self.bucket, Key=key)["ContentLength"]
+
+    def abort_multipart(self, group_id, stored_filename, upload_id):
+        self.client.abort_multipart_upload(
+            Bucket=self.bucket, Key=self.key(group_id, stored_filename), UploadId=upload_id
+        )
+
+
+class _CountingReader:
+    """统计读取字节数的只读流包装"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.count += len(data)
+        return data
+
+
+def check_storage_config(config):
+    """
+    启动时检查存储相关的配置
+
+    使用S3时每个分片直接作为一个分段上传，除最后一段外不能小于5MB。自适应分片会提高最小分片大小，
+    但关闭自适应分片或获取建议失败时前端使用 CHUNK_SIZE，过小时要到合并时才会失败。
+    """
+    if config.get("STORAGE_BACKEND", "local") == "s3" and config["CHUNK_SIZE"] < S3_MIN_PART_SIZE:
+        raise ValueError(
+            f"使用S3存储时 CHUNK_SIZE_MB 不能小于 {S3_MIN_PART_SIZE // 1024 // 1024}"
+        )
+
+
+def get_storage(app=None, upload_folder=None):
+    """返回当前应用配置的存储后端"""
+    app = app or current_app._get_current_object()
+    config = app.config
+    if config.get("STORAGE_BACKEND", "local") == "s3":
+        # S3客户端创建开销较大且线程安全，每个应用只创建一次
+        storage = app.extensions.get("groupbin_storage")
+        if storage is None:
+            storage = S3Storage(
+                config["S3_BUCKET"],
+                prefix=config.get("S3_PREFIX", ""),
+                endpoint_url=config.get("S3_ENDPOINT_URL"),
+                region=config.get("S3_REGION"),
+                access_key_id=config.get("S3_ACCESS_KEY_ID"),
+                secret_access_key=config.get("S3_SECRET_ACCESS_KEY"),
+            )
+            app.extensions["groupbin_storage"] = storage
+        return storage
+    # 本地存储没有状态，按当前配置创建（测试中会修改UPLOAD_FOLDER）
+    return LocalStorage(
+        StorageLayout.from_config(config, upload_folder),
+        config.get("FILE_MOVE_OPERATION_MAX_WAIT_MS", 3000) / 1000.0,
+    )
@@ -0,0 +1,192 @@
+"""
+上传目录的磁盘布局
+
+默认（STORAGE_FANOUT_LEVELS=0）所有小组目录和 tmp 平铺在 UPLOAD_FOLDER 中，
+小组的文件平铺在小组目录中。启用分层后按名称的 MD5 取前几级两位十六进制作为子目录：
+
+    UPLOAD_FOLDER/ab/cd/<group_id>/ef/<stored_filename>
+    UPLOAD_FOLDER/tmp/12/34/<resumable_identifier>/
+
+两位十六进制的目录名不会与小组ID、上传标识冲突，因此两种布局可以共存：
+读取时先找新布局的位置，再找旧布局的位置；新文件写入小组当前所在的目录。
+flask migrate-storage 命令在线把已有数据移动到当前配置的布局。
+"""
+import hashlib
+import os
+import string
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+SHARD_WIDTH = 2
+# 向下查找分层目录的最大深度
+MAX_SHARD_DEPTH = 4
+
+
+def is_shard_name(name):
+    """是否为分层目录名（两位十六进制）"""
+    return len(name) == SHARD_WIDTH and all(c in string.hexdigits for c in name)
+
+
+def shard_parts(name, levels):
+    digest = hashlib.md5(name.encode("utf-8")).hexdigest()
+    return [digest[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(levels)]
+
+
+def _iter_leaves(path, depth=0):
+    """遍历目录下的非分层子项，返回 (名称, 路径, 是否为目录)"""
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return
+    for entry in entries:
+        is_dir = entry.is_dir(follow_symlinks=False)
+        if is_dir and is_shard_name(entry.name) and depth < MAX_SHARD_DEPTH:
+            yield from _iter_leaves(entry.path, depth + 1)
+        else:
+            yield entry.name, entry.path, is_dir
+
+
+class StorageLayout:
+    def __init__(self, upload_folder, levels=0, blob_levels=0):
+        self.upload_folder = upload_folder
+        self.levels = levels
+        self.blob_levels = blob_levels
+
+    @classmethod
+    def from_config(cls, config, upload_folder=None):
+        return cls(
+            upload_folder or config["UPLOAD_FOLDER"],
+            config.get("STORAGE_FANOUT_LEVELS", 0),
+            config.get("STORAGE_BLOB_FANOUT_LEVELS", 0),
+        )
+
+    @property
+    def tmp_dir(self):
+        return os.path.join(self.upload_folder, "tmp")
+
+    # 小组目录
+    def group_dir_path(self, group_id):
+        """当前配置下小组目录应在的位置"""
+        return os.path.join(self.upload_folder, *shard_parts(group_id, self.levels), group_id)
+
+    def group_dir_candidates(self, group_id):
+        candidates = [self.group_dir_path(group_id)]
+        legacy = os.path.join(self.upload_folder, group_id)
+        if legacy not in candidates:
+            candidates.append(legacy)
+        return candidates
+
+    def group_dirs(self, group_id):
+        """小组在磁盘上已存在的所有目录（迁移过程中可能同时存在两处）"""
+        return [path for path in self.group_dir_candidates(group_id) if os.path.isdir(path)]
+
+    def group_dir(self, group_id):
+        """小组当前所在的目录，不存在时返回新布局的位置"""
+        existing = self.group_dirs(group_id)
+        return existing[0] if existing else self.group_dir_path(group_id)
+
+    def iter_group_dirs(self):
+        """遍历两种布局下的所有小组目录，返回 (小组ID, 路径)"""
+        for name, path, is_dir in _iter_leaves(self.upload_folder):
+            if is_dir and name != "tmp":
+                yield name, path
+
+    # 存储的文件
+    def new_blob_path(self, group_id, stored_filename):
+        """新文件的存储路径，会创建所需的目录"""
+        directory = os.path.join(
+            self.group_dir(group_id), *shard_parts(stored_filename, self.blob_levels)
+        )
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, stored_filename)
+
+    def blob_path(self, group_id, stored_filename):
+        """查找已存储文件的路径，找不到时返回新布局的位置"""
+        candidates = []
+        for group_dir in self.group_dir_candidates(group_id):
+            for levels in (self.blob_levels, 0):
+                path = os.path.join(group_dir, *shard_parts(stored_filename, levels), stored_filename)
+                if path not in candidates:
+                    candidates.append(path)
+        # 查找第二遍，避免在两次检查之间文件恰好被迁移工具移走
+        for _ in range(2):
+            for path in candidates:
+                if os.path.exists(path):
+                    return path
+        return candidates[0]
+
+    # 分片上传的临时目录
+    def chunk_dir(self, identifier):
+        """上传会话的临时目录，旧布局下已开始的会话继续使用原目录"""
+        legacy = os.path.join(self.tmp_dir, identifier)
+        if self.levels and os.path.isdir(legacy):
+            return legacy
+        return os.path.join(self.tmp_dir, *shard_parts(identifier, self.levels), identifier)
+
+    def iter_chunk_sessions(self):
+        """遍历两种布局下的所有上传会话目录"""
+        for _, path, is_dir in _iter_leaves(self.tmp_dir):
+            if is_dir:
+                yield path
+
+    def migrate(self, logger=None):
+        """
+        把已有的小组文件移动到当前配置的布局，可以在服务运行时执行
+
+        每个文件用 os.rename 原子地移动，读取方通过 blob_path 同时查找新旧位置；
+        迁移期间新上传到旧目录的文件可以通过再次执行迁移处理。进行中的上传会话不移动，
+        它们在旧目录中完成或过期清理。
+
+        Returns:
+            (移动的文件数, 处理的小组数)
+        """
+        moved = 0
+        groups = 0
+        for group_id, group_path in list(self.iter_group_dirs()):
+            groups += 1
+            target_dir = self.group_dir_path(group_id)
+            for name, path, is_dir in list(_iter_leaves(group_path)):
+                if is_dir:
+                    continue
+                target = os.path.join(target_dir, *shard_parts(name, self.blob_levels), name)
+                if path == target or os.path.exists(target):
+                    continue
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.rename(path, target)
+                moved += 1
+            if group_path != target_dir:
+                _remove_empty_dirs(group_path, self.upload_folder)
+            if logger:
+                logger.info("小组 %s 迁移完成", group_id)
+        return moved, groups
+
+
+def _remove_empty_dirs(path, stop):
+    """自底向上删除空目录，直到 stop 为止；目录不为空（如有新上传）时保留"""
+    for root, _, _ in sorted(os.walk(path), key=lambda item: len(item[0]), reverse=True):
+        try:
+            os.rmdir(root)
+        except OSError:
+            pass
+    parent = os.path.dirname(path)
+    while parent != stop and parent.startswith(stop):
+        try:
+            os.rmdir(parent)
+        except OSError:
+            break
+        parent = os.path.dirname(parent)
+
+
+def current_layout():
+    return StorageLayout.from_config(current_app.config)
+
+
+@click.command("migrate-storage")
+@with_appcontext
+def migrate_storage_command():
+    """把上传目录中已有的文件移动到当前配置的分层布局"""
+    layout = current_layout()
+    moved, groups = layout.migrate(current_app.logger)
+    click.echo(f"处理了 {groups} 个小组目录，移动了 {moved} 个文件")
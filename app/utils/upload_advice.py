@@ -0,0 +1,102 @@
+"""
+上传参数建议
+
+根据文件大小、所有worker正在处理的分片数和本进程最近的分片处理耗时，
+为每个文件给出分片大小和并发上传数，前端在开始上传前获取并按文件应用。
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from app.utils.admission import admission
+from app.utils.storage import S3_MIN_PART_SIZE
+
+MB = 1024 * 1024
+
+
+class ChunkLoadTracker:
+    """记录本进程正在处理的分片数和最近的分片处理耗时"""
+
+    def __init__(self, window=200):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=window)
+        self.in_flight = 0
+
+    @contextmanager
+    def track(self):
+        with self._lock:
+            self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.in_flight -= 1
+                self._recent.append(elapsed)
+
+    def current(self):
+        """
+        正在处理的分片数
+
+        启用准入控制时为所有worker持有的分片名额数；否则只能取本进程的计数，
+        同步worker每个进程同时只处理一个请求，这个值最多为1。
+        """
+        shared = admission.chunks_in_flight()
+        return self.in_flight if shared is None else shared
+
+    def snapshot(self):
+        """返回 (正在处理的分片数, 最近分片耗时的p90秒数或None)"""
+        in_flight = self.current()
+        with self._lock:
+            recent = sorted(self._recent)
+        p90 = recent[int(len(recent) * 0.9) - 1] if len(recent) >= 10 else None
+        return in_flight, p90
+
+
+chunk_load = ChunkLoadTracker()
+
+
+def advise_upload(file_size, config, load=None):
+    """
+    计算单个文件的分片大小和并发上传数
+
+    Args:
+        file_size: 文件大小（字节）
+        config: 应用配置
+        load: (正在处理的分片数, 最近分片耗时p90)，默认取 chunk_load 的统计
+
+    Returns:
+        dict: chunkSize 和 simultaneousUploads，键名与Resumable.js的选项一致
+    """
+    max_simultaneous = config["UPLOAD_MAX_SIMULTANEOUS"]
+    if not config["UPLOAD_ADAPTIVE"]:
+        return {"chunkSize": config["CHUNK_SIZE"], "simultaneousUploads": max_simultaneous}
+
+    # 分片大小：让每个文件大约分成 UPLOAD_TARGET_CHUNKS 片，按最小分片大小取整
+    min_chunk = config["UPLOAD_MIN_CHUNK_SIZE"]
+    if config.get("STORAGE_BACKEND") == "s3":
+        # 分片直接作为S3分段上传，除最后一段外不能小于5MB
+        min_chunk = max(min_chunk, S3_MIN_PART_SIZE)
+    max_chunk = max(config["UPLOAD_MAX_CHUNK_SIZE"], min_chunk)
+    chunk_size = -(-file_size // config["UPLOAD_TARGET_CHUNKS"])
+    chunk_size = -(-chunk_size // min_chunk) * min_chunk
+    chunk_size = min(max(chunk_size, min_chunk), max_chunk)
+
+    # 并发数：服务端繁忙或分片处理变慢时减少并发
+    in_flight, p90 = load if load is not None else chunk_load.snapshot()
+    busy_threshold = config["UPLOAD_BUSY_INFLIGHT_CHUNKS"]
+    simultaneous = max_simultaneous
+    if in_flight >= busy_threshold:
+        simultaneous = 1
+    elif in_flight >= busy_threshold / 2:
+        simultaneous = max(simultaneous // 2, 1)
+    if p90 is not None and p90 > config["UPLOAD_SLOW_CHUNK_SECONDS"]:
+        simultaneous = max(simultaneous // 2, 1)
+
+    # Resumable.js 最后一片会并入前一片，分片数按向下取整计算
+    total_chunks = max(file_size // chunk_size, 1)
+    simultaneous = min(simultaneous, total_chunks)
+
+    return {"chunkSize": chunk_size, "simultaneousUploads": simultaneous}
@@ -0,0 +1,244 @@
+"""
+上传会话
+
+每个进行中的上传（Resumable.js分片上传或tus上传）在数据库中有一条 UploadSession 记录，
+保存小组、目标文件、总大小、分片大小、已接收的范围、所属节点和过期时间。
+多个节点共用同一个数据库和 UPLOAD_FOLDER 时，通过这条记录协调同一个上传：
+- 客户端标识只在小组内唯一，不同小组使用相同的 resumableIdentifier 不会冲突
+- 已接收的范围和分段上传的ETag保存在记录中，分片检查不依赖接收分片的节点
+- 所有分片到达后，由原子的 UPDATE 把会话从 uploading 改为 merging，只有一个请求执行合并
+- 每次接收数据时延后过期时间，清理任务按 expires_at 索引查询过期会话，无需遍历临时目录
+
+分片数据仍保存在 UPLOAD_FOLDER/tmp 下以会话ID命名的目录中。
+"""
+import json
+import logging
+import os
+import shutil
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+from sqlalchemy import and_, or_, select
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
+
+from app import db
+from app.models import UploadSession
+from app.utils.storage_layout import current_layout
+
+logger = logging.getLogger(__name__)
+
+# 并发更新同一个会话时的最大重试次数
+MAX_UPDATE_RETRIES = 50
+
+
+def node_owner():
+    """当前节点和进程的标识"""
+    return f"{current_app.config['NODE_ID']}:{os.getpid()}"
+
+
+# 已接收范围，格式为 "1-5,8,10-12"（闭区间，按起点排序且互不相邻）
+def parse_ranges(text):
+    ranges = []
+    for part in (text or "").split(","):
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        ranges.append((int(start), int(end or start)))
+    return ranges
+
+
+def format_ranges(ranges):
+    return ",".join(str(start) if start == end else f"{start}-{end}" for start, end in ranges)
+
+
+def add_range(text, start, end):
+    """把 [start, end] 并入已接收范围"""
+    merged = []
+    for range_start, range_end in sorted(parse_ranges(text) + [(start, end)]):
+        if merged and range_start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], range_end))
+        else:
+            merged.append((range_start, range_end))
+    return format_ranges(merged)
+
+
+def covers(text, start, end):
+    """已接收范围是否包含整个 [start, end]"""
+    return any(
+        range_start <= start and end <= range_end for range_start, range_end in parse_ranges(text)
+    )
+
+
+def session_dir(session_id):
+    """上传会话保存数据的临时目录"""
+    return current_layout().chunk_dir(session_id)
+
+
+def _deadline(now):
+    return now + timedelta(hours=current_app.config["TEMP_FILE_EXPIRATION_HOURS"])
+
+
+def find_session(group_id, protocol, identifier):
+    return UploadSession.query.filter_by(
+        group_id=group_id, protocol=protocol, identifier=identifier
+    ).first()
+
+
+def create_session(group_id, protocol, identifier, storage=None, session_id=None, **fields):
+    """
+    创建上传会话并提交
+
+    storage 支持分段上传时同时创建存储后端的分段上传。多个节点并发创建同一个会话时，
+    唯一约束保证只有一条记录，后到的请求放弃自己创建的分段上传并返回已有的记录。
+    """
+    now = datetime.now(timezone.utc)
+    upload_session = UploadSession(
+        id=session_id or str(uuid.uuid4()),
+        group_id=group_id,
+        protocol=protocol,
+        identifier=identifier,
+        owner=node_owner(),
+        created_at=now,
+        updated_at=now,
+        expires_at=_deadline(now),
+        **fields,
+    )
+    if storage is not None and storage.supports_multipart:
+        safe_extension = secure_filename(os.path.splitext(fields["filename"])[1])
+        upload_session.stored_filename = str(uuid.uuid4()) + safe_extension
+        upload_session.multipart_upload_id = storage.create_multipart(
+            group_id, upload_session.stored_filename
+        )
+        upload_session.parts = "{}"
+
+    db.session.add(upload_session)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        if upload_session.multipart_upload_id:
+            storage.abort_multipart(
+                group_id, upload_session.stored_filename, upload_session.multipart_upload_id
+            )
+        return find_session(group_id, protocol, identifier)
+    return upload_session
+
+
+def record_received(session_id, start, end, nbytes, part=None):
+    """
+    记录接收到 [start, end] 范围（nbytes字节），延后会话的过期时间并提交
+
+    多个分片并发到达时按 revision 乐观锁重试，重复接收的范围不重复计数。
+    part 为 (分片序号, ETag)，保存存储后端分段上传的结果。
+
+    Returns:
+        更新后的已接收范围，会话不存在时返回None
+    """
+    for _ in range(MAX_UPDATE_RETRIES):
+        row = db.session.execute(
+            select(
+                UploadSession.revision,
+                UploadSession.received,
+                UploadSession.parts,
+            ).where(UploadSession.id == session_id)
+        ).first()
+        if row is None:
+            db.session.rollback()
+            return None
+
+        now = datetime.now(timezone.utc)
+        values = {
+            UploadSession.revision: row.revision + 1,
+            UploadSession.updated_at: now,
+            UploadSession.expires_at: _deadline(now),
+        }
+        received = row.received
+        if not covers(received, start, end):
+            received = add_range(received, start, end)
+            values[UploadSession.received] = received
+            values[UploadSession.received_bytes] = UploadSession.received_bytes + nbytes
+        if part is not None:
+            parts = json.loads(row.parts or "{}")
+            parts[str(part[0])] = part[1]
+            values[UploadSession.parts] = json.dumps(parts)
+
+        updated = UploadSession.query.filter_by(id=session_id, revision=row.revision).update(
+            values, synchronize_session=False
+        )
+        db.session.commit()
+        if updated:
+            return received
+    raise RuntimeError(f"更新上传会话冲突次数过多: {session_id}")
+
+
+def claim_session(session_id):
+    """
+    把会话改为 merging，成功时返回True，由当前请求完成上传
+
+    其他节点的合并超过 UPLOAD_MERGE_STALE_SECONDS 未完成时视为中断，可以重新获取。
+    """
+    now = datetime.now(timezone.utc)
+    stale_before = now - timedelta(seconds=current_app.config["UPLOAD_MERGE_STALE_SECONDS"])
+    updated = UploadSession.query.filter(
+        UploadSession.id == session_id,
+        or_(
+            UploadSession.state == "uploading",
+            and_(UploadSession.state == "merging", UploadSession.updated_at < stale_before),
+        ),
+    ).update(
+        {
+            UploadSession.state: "merging",
+            UploadSession.owner: node_owner(),
+            UploadSession.updated_at: now,
+            UploadSession.revision: UploadSession.revision + 1,
+        },
+        synchronize_session=False,
+    )
+    db.session.commit()
+    return updated == 1
+
+
+def release_session(session_id):
+    """合并失败时把会话改回 uploading，客户端重试时可以再次合并"""
+    UploadSession.query.filter_by(id=session_id).update(
+        {
+            UploadSession.state: "uploading",
+            UploadSession.revision: UploadSession.revision + 1,
+        },
+        synchronize_session=False,
+    )
+    db.session.commit()
+
+
+def delete_session(session_id):
+    """上传完成后删除会话记录，需要调用方提交事务（与创建文件记录在同一事务中）"""
+    UploadSession.query.filter_by(id=session_id).delete(synchronize_session=False)
+
+
+def expire_sessions(storage, now=None):
+    """
+    删除过期的上传会话及其临时目录，放弃存储后端中未完成的分段上传
+
+    按 expires_at 索引查询，返回删除的会话数
+    """
+    now = now or datetime.now(timezone.utc)
+    expired = UploadSession.query.filter(UploadSession.expires_at < now).all()
+    for upload_session in expired:
+        if upload_session.multipart_upload_id:
+            try:
+                storage.abort_multipart(
+                    upload_session.group_id,
+                    upload_session.stored_filename,
+                    upload_session.multipart_upload_id,
+                )
+                logger.info("放弃未完成的分段上传: %s", upload_session.multipart_upload_id)
+            except Exception as e:
+                logger.error("放弃分段上传失败 %s: %s", upload_session.multipart_upload_id, e)
+        shutil.rmtree(session_dir(upload_session.id), ignore_errors=True)
+        logger.info("删除过期上传会话: %s (%s)", upload_session.id, upload_session.filename)
+        db.session.delete(upload_session)
+    if expired:
+        db.session.commit()
+    return len(expired)
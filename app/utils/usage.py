@@ -0,0 +1,108 @@
+"""
+小组存储用量
+
+Group.used_bytes / file_count / version_count 记录小组中所有文件版本的大小和数量，
+上传、删除时用 UPDATE ... SET x = x + n 在调用方的事务中更新，查询和配额检查都是O(1)。
+同时递增 Group.generation，小组页面和文件列表据此判断内容是否变化（app/utils/conditional.py）。
+计数可能因异常中断或手工修改数据库而偏离，reconcile_group_usage 按实际记录重新计算。
+"""
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import func
+
+from app import db
+from app.models import Group, File, FileVersion
+
+logger = logging.getLogger(__name__)
+
+
+def record_upload(group_id, size, new_file):
+    """记录一次上传（新文件或新版本），需要调用方提交事务"""
+    values = {
+        Group.used_bytes: Group.used_bytes + size,
+        Group.version_count: Group.version_count + 1,
+        Group.generation: Group.generation + 1,
+        Group.last_upload_at: datetime.now(timezone.utc),
+    }
+    if new_file:
+        values[Group.file_count] = Group.file_count + 1
+    Group.query.filter_by(id=group_id).update(values, synchronize_session=False)
+
+
+def record_delete(group_id, file):
+    """记录删除一个文件及其所有版本，需要调用方提交事务"""
+    Group.query.filter_by(id=group_id).update(
+        {
+            Group.used_bytes: Group.used_bytes - sum(version.size for version in file.versions),
+            Group.file_count: Group.file_count - 1,
+            Group.version_count: Group.version_count - len(file.versions),
+            Group.generation: Group.generation + 1,
+        },
+        synchronize_session=False,
+    )
+
+
+def check_quota(group, incoming_bytes, quota):
+    """检查上传 incoming_bytes 后是否超出小组配额，超出时返回错误信息"""
+    if quota <= 0 or group.used_bytes + incoming_bytes <= quota:
+        return None
+    return (
+        f"超出小组存储配额 ({quota / 1024 / 1024:.1f} MB)，"
+        f"已使用 {group.used_bytes / 1024 / 1024:.1f} MB"
+    )
+
+
+def reconcile_group_usage():
+    """按文件和版本记录重新计算所有小组的用量，返回被校正的小组数"""
+    version_totals = dict(
+        (group_id, (count, total))
+        for group_id, count, total in db.session.query(
+            File.group_id, func.count(FileVersion.id), func.coalesce(func.sum(FileVersion.size), 0)
+        )
+        .join(FileVersion, FileVersion.file_id == File.id)
+        .group_by(File.group_id)
+    )
+    file_counts = dict(
+        db.session.query(File.group_id, func.count(File.id)).group_by(File.group_id)
+    )
+
+    corrections = []
+    for group_id, used_bytes, file_count, version_count in db.session.query(
+        Group.id, Group.used_bytes, Group.file_count, Group.version_count
+    ):
+        actual_versions, actual_bytes = version_totals.get(group_id, (0, 0))
+        actual = (int(actual_bytes), file_counts.get(group_id, 0), actual_versions)
+        if (used_bytes, file_count, version_count) != actual:
+            corrections.append(
+                {
+                    "id": group_id,
+                    "used_bytes": actual[0],
+                    "file_count": actual[1],
+                    "version_count": actual[2],
+                }
+            )
+
+    if corrections:
+        db.session.execute(db.update(Group), corrections)
+        db.session.commit()
+        logger.warning("校正了 %s 个小组的存储用量计数", len(corrections))
+    return len(corrections)
+
+
+def usage_summary(limit=20):
+    """全站用量汇总和用量最多的小组"""
+    total_bytes, file_count, version_count, group_count = db.session.query(
+        func.coalesce(func.sum(Group.used_bytes), 0),
+        func.coalesce(func.sum(Group.file_count), 0),
+        func.coalesce(func.sum(Group.version_count), 0),
+        func.count(Group.id),
+    ).one()
+    top_groups = Group.query.order_by(Group.used_bytes.desc()).limit(limit).all()
+    return {
+        "total_bytes": int(total_bytes),
+        "file_count": int(file_count),
+        "version_count": int(version_count),
+        "group_count": group_count,
+        "top_groups": top_groups,
+    }
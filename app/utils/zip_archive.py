@@ -0,0 +1,406 @@
+"""
+小组ZIP打包和缓存
+
+打包时按成员决定压缩方式：已知的压缩格式以及试压效果差的文件直接存储（ZIP_STORED），
+其他文件按数据块在线程池中并行deflate压缩，再按顺序写入压缩包。
+
+打包结果按小组内容指纹（所有文件版本ID）缓存在 ZIP_CACHE_DIR 中，内容不变时直接发送缓存文件。
+缓存总大小超过 ZIP_CACHE_MAX_MB 时按最近使用时间（文件mtime，命中时更新）淘汰；
+小组文件变化时删除该小组的缓存。同一份压缩包同时被多次请求时，
+通过O_EXCL锁文件只由一个请求打包，其他请求等待打包完成后共用结果（跨进程有效）。
+"""
+import glob
+import hashlib
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+import zipfile
+import zlib
+from collections import deque
+
+from app.utils.codecs import read_blob
+from app.utils.concurrency import cpu_executor
+from app.utils.disk_cache import evict_lru, touch
+from app.utils.metrics import ZIP_BUILD_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# 压缩包内容格式变化时修改，使旧的缓存失效
+ZIP_FORMAT_VERSION = "2"
+# deflate 的回溯窗口大小
+DEFLATE_WINDOW = 32 * 1024
+# 判断是否值得压缩时试压的数据量
+PROBE_BYTES = 64 * 1024
+# 本身已经压缩过的格式，再用deflate压缩几乎没有效果
+COMPRESSED_EXTENSIONS = {
+    # 压缩包和安装包
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".rar", ".zst", ".lz4",
+    ".jar", ".apk", ".whl", ".deb", ".rpm", ".dmg",
+    # 基于ZIP的文档格式
+    ".docx", ".xlsx", ".pptx", ".odt", ".ods", ".odp", ".epub",
+    # 图片
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".heif", ".avif",
+    # 音视频
+    ".mp3", ".aac", ".m4a", ".ogg", ".opus", ".flac",
+    ".mp4", ".m4v", ".mkv", ".mov", ".avi", ".webm", ".wmv",
+}
+
+
+class ZipCacheBusy(Exception):
+    """等待其他请求打包超时"""
+
+
+class ZipStreamCancelled(Exception):
+    """客户端断开，停止打包"""
+
+
+def versioned_filename(file, version):
+    """压缩包中的文件名，带上传时间以区分版本"""
+    timestamp = version.uploaded_at.strftime("%m-%d-%H-%M-%S")
+    return f"v-{timestamp}_{file.original_filename}"
+
+
+def select_members(files, latest_only=False, file_ids=None, since=None, until=None):
+    """
+    按条件选择要打包的文件版本
+
+    Args:
+        files: 小组的文件
+        latest_only: 每个文件只打包（时间范围内的）最新版本，压缩包中使用原文件名
+        file_ids: 只打包这些文件，None表示全部
+        since, until: 只打包上传时间在 [since, until) 内的版本（UTC，不带时区）
+
+    Returns:
+        [(压缩包中的文件名, 版本)]
+    """
+    members = []
+    used_names = set()
+    for file in files:
+        if file_ids is not None and file.id not in file_ids:
+            continue
+        versions = [
+            version
+            for version in file.versions
+            if (since is None or version.uploaded_at >= since)
+            and (until is None or version.uploaded_at < until)
+        ]
+        if not versions:
+            continue
+        if latest_only:
+            version = max(versions, key=lambda v: v.version_number)
+            # 不同文件同名时退回带版本时间的文件名
+            name = file.original_filename
+            if name in used_names:
+                name = versioned_filename(file, version)
+            used_names.add(name)
+            members.append((name, version))
+        else:
+            members.extend((versioned_filename(file, version), version) for version in versions)
+    return members
+
+
+def should_deflate(filename, sample, store_ratio):
+    """
+    判断文件是否值得压缩
+
+    已知为压缩格式的扩展名直接存储；其他文件用快速压缩试压开头的数据，
+    压缩后仍超过原大小的 store_ratio 时存储。
+    """
+    if os.path.splitext(filename)[1].lower() in COMPRESSED_EXTENSIONS:
+        return False
+    if not sample:
+        return False
+    probe = sample[:PROBE_BYTES]
+    return len(zlib.compress(probe, 1)) < len(probe) * store_ratio
+
+
+def _deflate_block(data, zdict, final, level):
+    """
+    把一个数据块压缩为原始deflate数据，在线程池中执行（zlib压缩时释放GIL）
+
+    非最后一块以 Z_SYNC_FLUSH 结束，各块的输出可以直接拼接为一个deflate流；
+    用前一块末尾的32KB作为预设字典，压缩率与整体压缩基本相同。
+    """
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class _PrecompressedFeed:
+    """
+    代替ZIP成员写入对象中的压缩器
+
+    写入原始数据时返回线程池中预先压缩好的对应数据，CRC、大小和文件头仍由zipfile计算和写入。
+    """
+
+    def __init__(self):
+        self.output = b""
+
+    def compress(self, data):
+        output, self.output = self.output, b""
+        return output
+
+    def flush(self):
+        return b""
+
+
+def _iter_with_last(iterable):
+    """返回 (元素, 是否为最后一个)"""
+    iterator = iter(iterable)
+    try:
+        current = next(iterator)
+    except StopIteration:
+        return
+    for following in iterator:
+        yield current, False
+        current = following
+    yield current, True
+
+
+def zip_options(config):
+    """从配置中读取 write_group_zip 的压缩参数"""
+    return {
+        "workers": config["ZIP_COMPRESS_WORKERS"] or os.cpu_count() or 1,
+        "level": config["ZIP_COMPRESS_LEVEL"],
+        "store_ratio": config["ZIP_STORE_RATIO"],
+    }
+
+
+def write_group_zip(target, group_id, members, storage, workers=1, level=6, store_ratio=0.9):
+    """
+    把选择的文件版本写入ZIP
+
+    主线程按顺序读取各成员的数据块，需要压缩的块交给线程池压缩，
+    同时最多有 workers * 4 个块在等待写入，写入顺序与读取顺序一致。
+
+    Args:
+        target: 可写的文件对象，不可定位时zipfile在每个成员后写入数据描述符
+        members: select_members 的返回值
+    """
+    pending = deque()
+    feed = _PrecompressedFeed()
+    member = None
+
+    def write_next():
+        nonlocal member
+        action = pending.popleft()
+        if action[0] == "open":
+            member = zf.open(action[1], "w")
+            if action[1].compress_type == zipfile.ZIP_DEFLATED:
+                member._compressor = feed
+        elif action[0] == "block":
+            _, data, future = action
+            if future is not None:
+                feed.output = future.result()
+            member.write(data)
+        else:
+            member.close()
+            member = None
+
+    # 出错时不关闭zf：有未写完的成员时zipfile关闭会抛出另一个异常，掩盖原来的错误
+    zf = zipfile.ZipFile(target, "w")
+    with ZIP_BUILD_SECONDS.time(), cpu_executor(workers) as pool:
+        max_pending_blocks = workers * 4
+        pending_blocks = 0
+        for arcname, version in members:
+            # 压缩存储的版本解压后打包
+            blocks = _iter_with_last(
+                read_blob(storage, group_id, version.stored_filename, version.codec)
+            )
+            first = next(blocks, (b"", True))
+            deflate = should_deflate(arcname, first[0], store_ratio)
+
+            zinfo = zipfile.ZipInfo(arcname, version.uploaded_at.timetuple()[:6])
+            zinfo.compress_type = zipfile.ZIP_DEFLATED if deflate else zipfile.ZIP_STORED
+            zinfo.external_attr = 0o644 << 16
+            # 预先设置大小，zipfile据此决定是否使用ZIP64
+            zinfo.file_size = version.size
+            pending.append(("open", zinfo))
+
+            previous = None
+            for data, final in itertools.chain([first], blocks):
+                future = None
+                if deflate:
+                    zdict = previous[-DEFLATE_WINDOW:] if previous else None
+                    future = pool.submit(_deflate_block, data, zdict, final, level)
+                pending.append(("block", data, future))
+                pending_blocks += 1
+                previous = data
+                while pending_blocks > max_pending_blocks:
+                    if pending[0][0] == "block":
+                        pending_blocks -= 1
+                    write_next()
+            pending.append(("close",))
+
+        while pending:
+            write_next()
+        zf.close()
+
+
+def group_fingerprint(group_id, members):
+    """压缩包内容指纹：由选择的版本和压缩包中的文件名决定，上传或删除版本都会改变"""
+    digest = hashlib.sha256(f"{ZIP_FORMAT_VERSION}:{group_id}".encode("utf-8"))
+    for arcname, version_id in sorted((arcname, version.id) for arcname, version in members):
+        digest.update(f"\0{version_id}\0{arcname}".encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+class _QueueWriter:
+    """把写入的数据放入队列的只写流，没有tell，zipfile按不可定位的流写入"""
+
+    def __init__(self, chunks, cancelled):
+        self.chunks = chunks
+        self.cancelled = cancelled
+
+    def write(self, data):
+        data = bytes(data)
+        while True:
+            if self.cancelled.is_set():
+                raise ZipStreamCancelled()
+            try:
+                self.chunks.put(data, timeout=1)
+                return len(data)
+            except queue.Full:
+                continue
+
+    def flush(self):
+        pass
+
+
+def stream_zip(build, max_queued_chunks=64):
+    """
+    在后台线程中调用 build(只写流) 打包，以生成器按顺序返回写出的数据
+
+    build 中不能访问数据库会话或请求上下文，需要的数据应提前加载。
+    生成器被关闭（如客户端断开）时后台线程随之停止。
+    """
+    chunks = queue.Queue(maxsize=max_queued_chunks)
+    cancelled = threading.Event()
+    done = object()
+    errors = []
+
+    def run():
+        try:
+            build(_QueueWriter(chunks, cancelled))
+        except Exception as e:
+            if cancelled.is_set():
+                return
+            logger.error("打包ZIP时出错: %s", e)
+            errors.append(e)
+        # 队列已满且生成器已关闭时不再等待
+        while not cancelled.is_set():
+            try:
+                chunks.put(done, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is done:
+                break
+            yield chunk
+        if errors:
+            raise errors[0]
+    finally:
+        cancelled.set()
+
+
+class ZipCache:
+    def __init__(self, cache_dir, max_bytes, build_wait_seconds=300):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.build_wait_seconds = build_wait_seconds
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            config["ZIP_CACHE_DIR"],
+            config["ZIP_CACHE_MAX_MB"],
+            config["ZIP_CACHE_BUILD_WAIT_SECONDS"],
+        )
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def archive_path(self, group_id, fingerprint):
+        return os.path.join(self.cache_dir, f"{group_id}_{fingerprint}.zip")
+
+    def get_or_build(self, group_id, fingerprint, build):
+        """
+        返回缓存的压缩包路径，不存在时调用 build(文件对象) 打包
+
+        Returns:
+            (路径, 是否命中缓存)
+
+        Raises:
+            ZipCacheBusy: 等待其他请求打包超过 build_wait_seconds
+        """
+        path = self.archive_path(group_id, fingerprint)
+        if touch(path):
+            return path, True
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        lock_path = path + ".lock"
+        deadline = time.monotonic() + self.build_wait_seconds
+        while True:
+            try:
+                os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                pass
+            # 另一个请求正在打包，等待它完成
+            if touch(path):
+                return path, True
+            try:
+                if time.time() - os.path.getmtime(lock_path) > self.build_wait_seconds:
+                    # 打包的进程已退出，锁没有释放
+                    os.remove(lock_path)
+                    logger.warning("删除过期的ZIP打包锁: %s", lock_path)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() > deadline:
+                raise ZipCacheBusy(path)
+            time.sleep(0.2)
+
+        try:
+            # 获取锁后再次检查，可能刚好有请求完成了打包
+            if touch(path):
+                return path, True
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    build(f)
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        finally:
+            os.remove(lock_path)
+
+        self.evict(keep=path)
+        return path, False
+
+    def invalidate_group(self, group_id):
+        """删除小组的所有缓存压缩包（正在打包的临时文件不受影响）"""
+        for path in glob.glob(os.path.join(glob.escape(self.cache_dir), f"{glob.escape(group_id)}_*.zip")):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def evict(self, keep=None):
+        """按最近使用时间淘汰缓存，直到总大小不超过 max_bytes，返回删除的文件数"""
+        return evict_lru(self.cache_dir, self.max_bytes, suffixes=(".zip",), keep=keep)
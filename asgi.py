@@ -0,0 +1,12 @@
+"""
+ASGI入口，由uvicorn等异步服务器运行（需要 pip install uvicorn）：
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 2
+
+连接上的I/O在事件循环中进行，慢速的上传和下载不占用线程，见 app/utils/asgi.py。
+"""
+from app import create_app
+from app.utils.asgi import AsgiBridge
+
+flask_app = create_app()
+app = AsgiBridge.from_app(flask_app)
@@ -0,0 +1,114 @@
+"""
+INFO 级别日志下的分片上传延迟基准测试
+
+在同一份应用上依次用以下几种日志模式上传相同数量的分片，比较每个分片请求的延迟：
+    warning       LOG_LEVEL=WARNING，分片日志不输出（基线）
+    sync          LOG_LEVEL=INFO，请求线程直接写 RotatingFileHandler
+    async         LOG_LEVEL=INFO，通过 QueueHandler/QueueListener 在后台线程写文件
+    async-sampled 同 async，且分片日志按 LOG_CHUNK_SAMPLE_RATE 抽样
+
+用法示例：
+    python bench/bench_chunk_logging.py --chunks 500 --chunk-kb 64
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from io import BytesIO
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT_DIR)
+
+MODES = {
+    "warning": {"LOG_LEVEL": "WARNING", "LOG_ASYNC": True, "LOG_CHUNK_SAMPLE_RATE": 1},
+    "sync": {"LOG_LEVEL": "INFO", "LOG_ASYNC": False, "LOG_CHUNK_SAMPLE_RATE": 1},
+    "async": {"LOG_LEVEL": "INFO", "LOG_ASYNC": True, "LOG_CHUNK_SAMPLE_RATE": 1},
+    "async-sampled": {"LOG_LEVEL": "INFO", "LOG_ASYNC": True, "LOG_CHUNK_SAMPLE_RATE": 20},
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="分片上传日志开销基准测试")
+    parser.add_argument("--chunks", type=int, default=300, help="每种模式上传的分片数")
+    parser.add_argument("--chunks-per-file", type=int, default=50, help="每个文件的分片数")
+    parser.add_argument("--chunk-kb", type=int, default=64, help="分片大小（KB）")
+    parser.add_argument("--mode", choices=list(MODES), action="append", help="只运行指定模式")
+    return parser.parse_args()
+
+
+def upload_chunks(client, group_id, args, payload):
+    """上传若干个文件的全部分片，返回每个分片请求的耗时"""
+    latencies = []
+    file_count = max(args.chunks // args.chunks_per_file, 1)
+    for _ in range(file_count):
+        identifier = uuid.uuid4().hex
+        for chunk_number in range(1, args.chunks_per_file + 1):
+            data = {
+                "resumableIdentifier": identifier,
+                "resumableFilename": "bench.bin",
+                "resumableChunkNumber": str(chunk_number),
+                "resumableTotalChunks": str(args.chunks_per_file),
+                "resumableTotalSize": str(len(payload) * args.chunks_per_file),
+                "resumableCurrentChunkSize": str(len(payload)),
+                "file": (BytesIO(payload), "blob"),
+            }
+            start = time.perf_counter()
+            response = client.post(f"/file/upload/{group_id}", data=data)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError(f"分片上传失败: {response.status_code} {response.data[:200]}")
+    return latencies
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="groupbin-bench-")
+    os.environ["DATA_DIR"] = workdir
+    os.environ["TEST_DATA_DIR"] = workdir
+    os.environ["UPLOAD_FOLDER"] = os.path.join(workdir, "data")
+
+    from flask.logging import default_handler
+    from app import create_app, db, setup_logging, stop_log_listener
+    from app.models import Group
+
+    app = create_app("testing")
+    # 只测量文件日志的开销，不向终端输出
+    app.logger.removeHandler(default_handler)
+    app.config["MAX_UPLOAD_SIZE_MB"] = 1024 * 1024 * 1024
+    client = app.test_client()
+    payload = os.urandom(args.chunk_kb * 1024)
+
+    try:
+        with app.app_context():
+            group = Group(name="bench")
+            db.session.add(group)
+            db.session.commit()
+            group_id = group.id
+
+        print(f"{'mode':<16}{'mean(ms)':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'log bytes':>12}")
+        for mode in args.mode or MODES:
+            log_file = os.path.join(workdir, f"{mode}.log")
+            app.config.update(MODES[mode], LOG_FILE=log_file)
+            setup_logging(app)
+
+            latencies = upload_chunks(client, group_id, args, payload)
+            stop_log_listener()  # 写出队列中剩余的日志后再统计文件大小
+
+            latencies_ms = sorted(value * 1000 for value in latencies)
+            p95 = latencies_ms[int(len(latencies_ms) * 0.95) - 1]
+            log_bytes = os.path.getsize(log_file) if os.path.exists(log_file) else 0
+            print(
+                f"{mode:<16}{statistics.mean(latencies_ms):>10.3f}"
+                f"{statistics.median(latencies_ms):>10.3f}{p95:>10.3f}{log_bytes:>12}"
+            )
+    finally:
+        stop_log_listener()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+"""
+清理任务规模基准测试
+
+按给定规模向数据库和文件系统填充合成数据（小组、文件、版本、过期分片目录、
+锁文件、session文件等），然后逐个执行 CleanupTask 的各个清理阶段，
+报告每个阶段的耗时、SQL查询数、文件系统调用数和峰值内存。
+
+用法示例：
+    python bench/bench_cleanup.py --groups 10000 --files-per-group 20 --versions-per-file 5
+    python bench/bench_cleanup.py --groups 200000 --json bench_output.json
+
+各阶段按 _perform_cleanup 中的顺序在同一份数据上依次执行；
+如需隔离某个阶段，使用 --phase 只运行指定阶段。
+数据按当前配置的磁盘布局生成，设置 STORAGE_FANOUT_LEVELS=2 可以比较分层布局的效果。
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT_DIR)
+
+# 与 CleanupTask._perform_cleanup 中的顺序一致
+PHASES = [
+    "_cleanup_expired_groups",
+    "_cleanup_orphaned_files",
+    "_reconcile_group_usage",
+    "_cleanup_orphaned_files_on_disk",
+    "_cleanup_expired_sessions",
+    "_cleanup_group_events",
+]
+# 指向基准测试目录的配置项及其子目录名
+WORKDIR_PATHS = {
+    "UPLOAD_FOLDER": "data",
+    "SESSION_FILE_DIR": "sessions",
+    "METRICS_DIR": "metrics",
+    "PREVIEW_DIR": "previews",
+    "UPLOAD_ADMISSION_DIR": "admission",
+    "ZIP_CACHE_DIR": "zip_cache",
+    "PROFILER_DIR": "profiles",
+}
+
+# 需要统计调用次数的文件系统函数
+COUNTED_OS_FUNCTIONS = [
+    "stat",
+    "lstat",
+    "listdir",
+    "scandir",
+    "open",
+    "remove",
+    "unlink",
+    "rmdir",
+    "rename",
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="CleanupTask 规模基准测试")
+    parser.add_argument("--groups", type=int, default=1000, help="小组数量")
+    parser.add_argument("--files-per-group", type=int, default=10, help="每个小组的文件数")
+    parser.add_argument("--versions-per-file", type=int, default=3, help="每个文件的版本数")
+    parser.add_argument(
+        "--expired-db-ratio", type=float, default=0.1, help="已过期且应从数据库删除的小组比例"
+    )
+    parser.add_argument(
+        "--expired-data-ratio", type=float, default=0.1, help="已过期且应删除数据文件的小组比例"
+    )
+    parser.add_argument("--orphan-files", type=int, default=100, help="不属于任何小组的文件记录数")
+    parser.add_argument("--orphan-dirs", type=int, default=100, help="不属于任何小组的磁盘目录数")
+    parser.add_argument("--loose-files", type=int, default=100, help="上传目录根下的游离文件数")
+    parser.add_argument("--chunk-dirs", type=int, default=1000, help="tmp下的分片目录数")
+    parser.add_argument("--stale-ratio", type=float, default=0.5, help="分片目录/锁文件中过期的比例")
+    parser.add_argument("--chunks-per-dir", type=int, default=3, help="每个分片目录中的分片文件数")
+    parser.add_argument("--lock-files", type=int, default=200, help="tmp下的合并锁文件数")
+    parser.add_argument("--session-files", type=int, default=5000, help="session文件数")
+    parser.add_argument(
+        "--materialize-blobs",
+        action="store_true",
+        help="为每个版本在磁盘上创建空的数据文件（数量大时很慢）",
+    )
+    parser.add_argument("--batch-size", type=int, default=5000, help="批量插入的行数")
+    parser.add_argument("--phase", choices=PHASES, action="append", help="只运行指定阶段，可重复")
+    parser.add_argument("--workdir", help="数据目录（默认使用临时目录，结束后删除）")
+    parser.add_argument("--keep", action="store_true", help="结束后保留数据目录")
+    parser.add_argument("--json", help="将结果以JSON格式写入该文件")
+    return parser.parse_args()
+
+
+def prepare_environment(workdir):
+    """在导入应用之前设置环境变量，使配置指向基准测试目录"""
+    os.environ["DATA_DIR"] = workdir
+    os.environ["TEST_DATA_DIR"] = workdir
+    os.environ["UPLOAD_FOLDER"] = os.path.join(workdir, "data")
+    os.environ["TEST_DATABASE_URI"] = "sqlite:///" + os.path.join(workdir, "bench.db")
+
+
+def _set_mtime(path, timestamp):
+    os.utime(path, (timestamp, timestamp))
+
+
+def populate(app, args):
+    """填充合成数据，返回各类数据的数量"""
+    from app import db
+    from app.models import Group, File, FileVersion
+    from app.utils.storage_layout import StorageLayout
+
+    layout = StorageLayout.from_config(app.config)
+    upload_folder = app.config["UPLOAD_FOLDER"]
+    session_dir = app.config["SESSION_FILE_DIR"]
+    tmp_dir = os.path.join(upload_folder, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    os.makedirs(session_dir, exist_ok=True)
+
+    now = datetime.now(timezone.utc)
+    db_hours = app.config["CLEAN_INTERVAL_HOUR_DELETE_FROM_DB"]
+    data_hours = app.config["CLEAN_INTERVAL_HOUR_DELETE_DATA"]
+    expired_db_count = int(args.groups * args.expired_db_ratio)
+    expired_data_count = int(args.groups * args.expired_data_ratio)
+
+    group_rows, file_rows, version_rows = [], [], []
+
+    def flush(force=False):
+        for model, rows in ((Group, group_rows), (File, file_rows), (FileVersion, version_rows)):
+            if rows and (force or len(rows) >= args.batch_size):
+                db.session.execute(db.insert(model), rows)
+                rows.clear()
+
+    for index in range(args.groups):
+        group_id = str(uuid.uuid4())
+        if index < expired_db_count:
+            expires_at = now - timedelta(hours=db_hours + 1)
+        elif index < expired_db_count + expired_data_count:
+            expires_at = now - timedelta(hours=(db_hours + data_hours) / 2)
+        else:
+            expires_at = now + timedelta(hours=72)
+        group_rows.append(
+            {
+                "id": group_id,
+                "name": f"bench-{index}",
+                "created_at": now,
+                "expires_at": expires_at,
+                "is_readonly": False,
+                "created_duration_hours": 72,
+                "allow_convert_to_readonly": False,
+            }
+        )
+        os.makedirs(layout.group_dir_path(group_id), exist_ok=True)
+
+        for _ in range(args.files_per_group):
+            file_id = str(uuid.uuid4())
+            stored_filename = str(uuid.uuid4()) + ".bin"
+            version_ids = [str(uuid.uuid4()) for _ in range(args.versions_per_file)]
+            file_rows.append(
+                {
+                    "id": file_id,
+                    "group_id": group_id,
+                    "original_filename": "bench.bin",
+                    "stored_filename": stored_filename,
+                    "size": 0,
+                    "uploaded_at": now,
+                    "content_type": "application/octet-stream",
+                    "latest_version_id": version_ids[-1] if version_ids else None,
+                }
+            )
+            for version_index, version_id in enumerate(version_ids):
+                version_filename = (
+                    stored_filename if version_index == 0 else str(uuid.uuid4()) + ".bin"
+                )
+                version_rows.append(
+                    {
+                        "id": version_id,
+                        "file_id": file_id,
+                        "version_number": version_index + 1,
+                        "stored_filename": version_filename,
+                        "uploaded_at": now,
+                        "uploader": "bench",
+                        "size": 0,
+                    }
+                )
+                if args.materialize_blobs:
+                    open(layout.new_blob_path(group_id, version_filename), "wb").close()
+        flush()
+
+    # 不属于任何小组的文件记录
+    for _ in range(args.orphan_files):
+        file_rows.append(
+            {
+                "id": str(uuid.uuid4()),
+                "group_id": str(uuid.uuid4()),
+                "original_filename": "orphan.bin",
+                "stored_filename": str(uuid.uuid4()) + ".bin",
+                "size": 0,
+                "uploaded_at": now,
+                "content_type": "application/octet-stream",
+            }
+        )
+        flush()
+    flush(force=True)
+    db.session.commit()
+
+    # 磁盘上的孤立目录和游离文件
+    for _ in range(args.orphan_dirs):
+        os.makedirs(layout.group_dir_path("orphan-" + str(uuid.uuid4())))
+    for _ in range(args.loose_files):
+        open(os.path.join(upload_folder, str(uuid.uuid4()) + ".bin"), "wb").close()
+
+    # tmp目录中的分片目录和锁文件，按比例设置为过期
+    stale_time = time.time() - (app.config["TEMP_FILE_EXPIRATION_HOURS"] + 1) * 3600
+    stale_chunk_dirs = int(args.chunk_dirs * args.stale_ratio)
+    for index in range(args.chunk_dirs):
+        chunk_dir = layout.chunk_dir(str(uuid.uuid4()))
+        os.makedirs(chunk_dir)
+        for chunk_number in range(1, args.chunks_per_dir + 1):
+            open(os.path.join(chunk_dir, str(chunk_number)), "wb").close()
+        if index < stale_chunk_dirs:
+            _set_mtime(chunk_dir, stale_time)
+    stale_locks = int(args.lock_files * args.stale_ratio)
+    for index in range(args.lock_files):
+        lock_path = os.path.join(tmp_dir, f"127.0.0.1_{uuid.uuid4()}.lock")
+        open(lock_path, "wb").close()
+        if index < stale_locks:
+            _set_mtime(lock_path, stale_time)
+
+    # session文件，一半过期
+    session_stale_time = (
+        time.time() - (app.config["CLEAN_INTERVAL_HOUR_DELETE_CLIENT_SESSION"] + 1) * 3600
+    )
+    for index in range(args.session_files):
+        session_path = os.path.join(session_dir, uuid.uuid4().hex)
+        open(session_path, "wb").close()
+        if index % 2 == 0:
+            _set_mtime(session_path, session_stale_time)
+
+    return {
+        "groups": args.groups,
+        "files": args.groups * args.files_per_group + args.orphan_files,
+        "versions": args.groups * args.files_per_group * args.versions_per_file,
+        "chunk_dirs": args.chunk_dirs,
+        "lock_files": args.lock_files,
+        "session_files": args.session_files,
+    }
+
+
+class QueryCounter:
+    """通过SQLAlchemy事件统计执行的SQL语句数"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args, **kwargs):
+        self.count += 1
+
+    def __enter__(self):
+        from sqlalchemy import event
+
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        from sqlalchemy import event
+
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+
+def _read_proc_io():
+    """读取 /proc/self/io 中的读写系统调用计数（仅Linux）"""
+    try:
+        with open("/proc/self/io") as f:
+            values = dict(line.split(": ") for line in f.read().splitlines())
+        return int(values["syscr"]), int(values["syscw"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+@contextmanager
+def count_fs_calls(counts):
+    """在上下文内包装os模块中的文件系统函数并统计调用次数
+
+    os.path.exists/isdir/getmtime 等内部都会调用 os.stat，
+    shutil.rmtree 也通过 os.scandir/os.unlink/os.rmdir 完成，因此都会被统计。
+    """
+    originals = {}
+
+    def wrap(name, func):
+        def counted(*args, **kwargs):
+            counts[name] = counts.get(name, 0) + 1
+            return func(*args, **kwargs)
+
+        return counted
+
+    for name in COUNTED_OS_FUNCTIONS:
+        func = getattr(os, name, None)
+        if func is not None:
+            originals[name] = func
+            setattr(os, name, wrap(name, func))
+    try:
+        yield counts
+    finally:
+        for name, func in originals.items():
+            setattr(os, name, func)
+
+
+def run_phase(app, cleanup, phase):
+    from app import db
+
+    fs_counts = {}
+    io_before = _read_proc_io()
+    tracemalloc.start()
+    with app.app_context():
+        with QueryCounter(db.engine) as queries, count_fs_calls(fs_counts):
+            start = time.perf_counter()
+            getattr(cleanup, phase)()
+            elapsed = time.perf_counter() - start
+        db.session.remove()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    io_after = _read_proc_io()
+
+    result = {
+        "phase": phase,
+        "wall_seconds": round(elapsed, 4),
+        "queries": queries.count,
+        "fs_calls": sum(fs_counts.values()),
+        "fs_calls_by_function": fs_counts,
+        "peak_python_memory_mb": round(peak / 1024 / 1024, 2),
+    }
+    if io_before and io_after:
+        result["read_syscalls"] = io_after[0] - io_before[0]
+        result["write_syscalls"] = io_after[1] - io_before[1]
+    if resource is not None:
+        # ru_maxrss 在Linux上单位为KB，是整个进程至今的峰值
+        result["process_max_rss_mb"] = round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2
+        )
+    return result
+
+
+def print_report(dataset, results):
+    print("数据规模: " + ", ".join(f"{key}={value}" for key, value in dataset.items()))
+    header = f"{'phase':<34}{'wall(s)':>10}{'queries':>10}{'fs calls':>12}{'py peak(MB)':>13}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        print(
+            f"{result['phase']:<34}{result['wall_seconds']:>10.3f}{result['queries']:>10}"
+            f"{result['fs_calls']:>12}{result['peak_python_memory_mb']:>13.2f}"
+        )
+
+
+def main():
+    args = parse_args()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="groupbin-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    prepare_environment(workdir)
+
+    from app import create_app, db
+    from app.utils.cleanup import CleanupTask
+
+    app = create_app("testing")
+    # 不依赖测试配置读取环境变量的方式，数据一定写入基准测试目录
+    for key, name in WORKDIR_PATHS.items():
+        app.config[key] = os.path.join(workdir, name)
+    try:
+        with app.app_context():
+            db.create_all()
+            populate_start = time.perf_counter()
+            dataset = populate(app, args)
+            db.session.remove()
+        print(f"数据填充耗时 {time.perf_counter() - populate_start:.1f} 秒，目录: {workdir}")
+
+        cleanup = CleanupTask(app)
+        results = [run_phase(app, cleanup, phase) for phase in (args.phase or PHASES)]
+        print_report(dataset, results)
+
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"dataset": dataset, "results": results}, f, indent=2)
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+gevent并发慢速下载负载测试
+
+在替换标准库后的单个进程中用 gevent 的 WSGI 服务器运行应用（与 gunicorn -k gevent 的
+一个 worker 相同），同时发起大量慢速下载：每个客户端每次只读取一小块数据并等待一段时间，
+模拟网速很慢的下载者。下载进行期间反复请求一个轻量接口，测量其他请求的响应时间。
+
+全部下载同时处于进行中且内容完整时返回0，否则返回1。需要 pip install gevent。
+
+用法示例：
+    python bench/bench_gevent_downloads.py
+    python bench/bench_gevent_downloads.py --clients 2000 --size-kb 4096 --read-kb 8 --delay 0.2
+"""
+from gevent import monkey
+
+# 必须在导入其他模块之前替换标准库
+monkey.patch_all()
+
+import argparse  # noqa: E402
+import os  # noqa: E402
+import shutil  # noqa: E402
+import socket  # noqa: E402
+import sys  # noqa: E402
+import tempfile  # noqa: E402
+import time  # noqa: E402
+
+import gevent  # noqa: E402
+from gevent.pool import Pool  # noqa: E402
+from gevent.pywsgi import WSGIServer  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT_DIR)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="gevent并发慢速下载负载测试")
+    parser.add_argument("--clients", type=int, default=1000, help="同时进行的慢速下载数")
+    parser.add_argument("--size-kb", type=int, default=1024, help="下载文件的大小（KB）")
+    parser.add_argument("--read-kb", type=int, default=16, help="客户端每次读取的大小（KB）")
+    parser.add_argument("--delay", type=float, default=0.1, help="客户端每次读取后等待的秒数")
+    parser.add_argument("--probes", type=int, default=50, help="下载期间请求轻量接口的次数")
+    parser.add_argument("--timeout", type=float, default=600, help="整个测试的超时时间（秒）")
+    return parser.parse_args()
+
+
+def prepare_environment(workdir):
+    """在导入应用之前设置环境变量，使配置指向测试目录，并使用文件数据库和连接池"""
+    os.environ["DATA_DIR"] = workdir
+    os.environ["TEST_DATA_DIR"] = workdir
+    os.environ["UPLOAD_FOLDER"] = os.path.join(workdir, "data")
+    os.environ["TEST_DATABASE_URI"] = "sqlite:///" + os.path.join(workdir, "bench.db")
+
+
+def raise_file_limit(needed):
+    """每个下载在服务端和客户端各占一个socket，服务端还要打开文件"""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        target = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        if target < needed:
+            print(f"警告：文件描述符上限 {target} 小于需要的 {needed}")
+
+
+def create_download(app, size):
+    """通过上传接口创建一个文件，返回下载地址"""
+    from app import db
+    from app.models import FileVersion, Group
+
+    with app.app_context():
+        group = Group(name="Bench Group")
+        db.session.add(group)
+        db.session.commit()
+        group_id = group.id
+
+    content = os.urandom(size)
+    client = app.test_client()
+    response = client.post(
+        f"/file/upload_raw/{group_id}",
+        query_string={
+            "resumableIdentifier": "bench-download",
+            "resumableFilename": "bench.bin",
+            "resumableChunkNumber": "1",
+            "resumableTotalChunks": "1",
+            "resumableTotalSize": str(size),
+            "resumableCurrentChunkSize": str(size),
+        },
+        data=content,
+        content_type="application/octet-stream",
+    )
+    assert response.status_code == 200, response.data
+    with app.app_context():
+        version = FileVersion.query.one()
+        return f"/file/{group_id}/{version.file_id}/version/{version.id}"
+
+
+def http_get(port, path, read_size=65536, delay=0):
+    """发送GET请求，按 read_size 读取响应，每次读取后等待 delay 秒，返回 (状态码, 响应体长度)"""
+    sock = socket.create_connection(("127.0.0.1", port))
+    try:
+        sock.sendall(f"GET {path} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n".encode())
+        data = b""
+        while b"\r\n\r\n" not in data:
+            chunk = sock.recv(read_size)
+            if not chunk:
+                break
+            data += chunk
+        head, _, body = data.partition(b"\r\n\r\n")
+        status = int(head.split(b" ", 2)[1])
+        received = len(body)
+        while True:
+            if delay:
+                gevent.sleep(delay)
+            chunk = sock.recv(read_size)
+            if not chunk:
+                break
+            received += len(chunk)
+        return status, received
+    finally:
+        sock.close()
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="groupbin_bench_gevent_")
+    prepare_environment(workdir)
+    raise_file_limit(args.clients * 3 + 256)
+    try:
+        from app import create_app
+
+        app = create_app("testing")
+        size = args.size_kb * 1024
+        path = create_download(app, size)
+
+        server = WSGIServer(("127.0.0.1", 0), app, spawn=Pool(args.clients + 100), log=None)
+        server.start()
+        port = server.server_port
+        print(f"{args.clients} 个客户端并发下载 {args.size_kb} KB，每 {args.delay}s 读取 {args.read_kb} KB")
+
+        state = {"active": 0, "peak": 0, "ok": 0, "failed": 0}
+
+        def slow_client():
+            state["active"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+            try:
+                status, received = http_get(port, path, args.read_kb * 1024, args.delay)
+                if status == 200 and received == size:
+                    state["ok"] += 1
+                else:
+                    state["failed"] += 1
+            except Exception as e:
+                print(f"下载失败: {e}")
+                state["failed"] += 1
+            finally:
+                state["active"] -= 1
+
+        start = time.perf_counter()
+        clients = [gevent.spawn(slow_client) for _ in range(args.clients)]
+
+        # 等所有下载开始后，测量轻量请求的响应时间
+        while state["peak"] < args.clients and time.perf_counter() - start < args.timeout:
+            gevent.sleep(0.1)
+        latencies = []
+        for _ in range(args.probes):
+            if state["active"] == 0:
+                break
+            probe_start = time.perf_counter()
+            http_get(port, "/file/upload_advice?size=1048576")
+            latencies.append(time.perf_counter() - probe_start)
+            gevent.sleep(0.05)
+
+        gevent.joinall(clients, timeout=max(args.timeout - (time.perf_counter() - start), 1))
+        elapsed = time.perf_counter() - start
+        server.stop()
+
+        print(f"{'同时进行的下载峰值':<20}{state['peak']:>10}")
+        print(f"{'完成':<20}{state['ok']:>10}")
+        print(f"{'失败或超时':<20}{args.clients - state['ok']:>10}")
+        print(f"{'总耗时(s)':<20}{elapsed:>10.1f}")
+        if latencies:
+            latencies.sort()
+            p50 = latencies[len(latencies) // 2] * 1000
+            p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000
+            print(f"{'轻量请求 p50(ms)':<20}{p50:>10.1f}")
+            print(f"{'轻量请求 p99(ms)':<20}{p99:>10.1f}")
+        if resource is not None:
+            print(f"{'峰值内存(MB)':<20}{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:>10.1f}")
+
+        passed = state["peak"] == args.clients and state["ok"] == args.clients
+        print("通过" if passed else "未通过")
+        return 0 if passed else 1
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+应用启动耗时基准测试
+
+1. 冷启动：多次在新的Python进程中 create_app('production')，报告进程总耗时和
+   create_app 记录的各阶段耗时（中位数）。第一次启动时数据库为空，之后结构指纹不变，
+   跳过建表和补列。
+2. 预加载：与 gunicorn.conf.py 相同，在一个进程中预加载应用后fork出多个worker，
+   报告从fork到worker处理完第一个请求的耗时。
+
+用法示例：
+    python bench/bench_startup.py
+    python bench/bench_startup.py --runs 10 --workers 4
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+COLD_START = """
+import json, sys
+sys.path.insert(0, {root!r})
+from app import create_app
+app = create_app("production")
+print(json.dumps(app.extensions["boot_timing"]))
+"""
+
+PRELOAD = """
+import json, os, sys, time
+sys.path.insert(0, {root!r})
+from app import create_app, init_worker
+app = create_app("production")
+results = []
+for _ in range({workers}):
+    read_fd, write_fd = os.pipe()
+    started = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        init_worker()
+        status = app.test_client().get("/").status_code
+        os.write(write_fd, json.dumps([time.perf_counter() - started, status]).encode())
+        os._exit(0)
+    os.close(write_fd)
+    os.waitpid(pid, 0)
+    with os.fdopen(read_fd) as pipe:
+        results.append(json.loads(pipe.read()))
+print(json.dumps({{"boot": app.extensions["boot_timing"], "workers": results}}))
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="应用启动耗时基准测试")
+    parser.add_argument("--runs", type=int, default=5, help="冷启动次数")
+    parser.add_argument("--workers", type=int, default=4, help="预加载后fork的worker数")
+    return parser.parse_args()
+
+
+def run_python(code, env):
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", code], env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return time.perf_counter() - started, json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="groupbin_bench_startup_")
+    env = dict(os.environ, DATA_DIR=workdir, LOG_LEVEL="WARNING", PRELOAD_APP="false")
+    env.pop("ENV_FILE", None)
+    try:
+        print(f"{'冷启动':<10}{'进程(ms)':>10}{'create_app(ms)':>16}  各阶段(ms)")
+        phases = {}
+        for run in range(args.runs):
+            wall, timing = run_python(COLD_START.format(root=ROOT_DIR), env)
+            label = "空数据库" if run == 0 else f"第{run + 1}次"
+            detail = ", ".join(f"{name} {ms:.0f}" for name, ms in timing["phases"].items())
+            print(f"{label:<10}{wall * 1000:>10.0f}{timing['total_ms']:>16.0f}  {detail}")
+            if run > 0:
+                for name, ms in timing["phases"].items():
+                    phases.setdefault(name, []).append(ms)
+        if phases:
+            median = ", ".join(f"{name} {statistics.median(v):.0f}" for name, v in phases.items())
+            print(f"数据库已存在时各阶段中位数(ms): {median}")
+
+        if hasattr(os, "fork"):
+            env["PRELOAD_APP"] = "true"
+            wall, result = run_python(
+                PRELOAD.format(root=ROOT_DIR, workers=args.workers), env
+            )
+            ready = [seconds * 1000 for seconds, _ in result["workers"]]
+            print(f"\n预加载: 主进程 create_app {result['boot']['total_ms']:.0f}ms，"
+                  f"{args.workers} 个worker从fork到处理完第一个请求: "
+                  f"中位数 {statistics.median(ready):.1f}ms，最大 {max(ready):.1f}ms")
+            if any(status != 200 for _, status in result["workers"]):
+                print("有worker的第一个请求失败")
+                return 1
+        return 0
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
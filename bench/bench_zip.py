@@ -0,0 +1,128 @@
+"""
+小组ZIP打包基准测试
+
+在临时目录中生成一组合成文件（可压缩的文本、模拟图片和视频的随机数据），
+比较原来的单线程 ZIP_DEFLATED 打包和 write_group_zip（按内容选择是否压缩、多线程压缩）
+的耗时和压缩包大小。
+
+用法示例：
+    python bench/bench_zip.py
+    python bench/bench_zip.py --text-mb 200 --media-mb 800 --workers 1 2 4 8
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT_DIR)
+
+from app.utils.storage import LocalStorage  # noqa: E402
+from app.utils.storage_layout import StorageLayout  # noqa: E402
+from app.utils.zip_archive import select_members, write_group_zip  # noqa: E402
+
+GROUP_ID = "bench-group"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="小组ZIP打包基准测试")
+    parser.add_argument("--text-mb", type=int, default=64, help="可压缩文本文件的总大小（MB）")
+    parser.add_argument("--media-mb", type=int, default=256, help="随机数据（模拟图片、视频）的总大小（MB）")
+    parser.add_argument("--files", type=int, default=16, help="每类文件的数量")
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1], help="压缩线程数"
+    )
+    parser.add_argument("--level", type=int, default=6, help="deflate压缩级别")
+    return parser.parse_args()
+
+
+def make_text(size):
+    line = b"2024-01-01 12:00:00 INFO request handled path=/file/upload status=200 elapsed=%d\n"
+    return b"".join(line % n for n in range(size // len(line) + 1))[:size]
+
+
+def generate_files(storage, args):
+    """生成合成文件，返回与File模型字段一致的对象列表"""
+    files = []
+    uploaded_at = datetime(2024, 1, 1)
+    specs = [
+        # 可压缩的日志文本
+        ("log_{}.txt", args.text_mb, make_text),
+        # 扩展名可以识别的压缩格式
+        ("video_{}.mp4", args.media_mb // 2, os.urandom),
+        # 需要试压才能发现不可压缩的数据
+        ("raw_{}.bin", args.media_mb // 2, os.urandom),
+    ]
+    for pattern, total_mb, make_content in specs:
+        size = total_mb * 1024 * 1024 // args.files
+        for i in range(args.files):
+            stored_filename = f"{pattern.format(i)}.blob"
+            content = make_content(size)
+            with open(storage.layout.new_blob_path(GROUP_ID, stored_filename), "wb") as f:
+                f.write(content)
+            version = SimpleNamespace(
+                id=stored_filename,
+                stored_filename=stored_filename,
+                codec=None,
+                size=len(content),
+                uploaded_at=uploaded_at + timedelta(seconds=len(files)),
+            )
+            files.append(
+                SimpleNamespace(id=stored_filename, original_filename=pattern.format(i), versions=[version])
+            )
+    return files
+
+
+def baseline_zip(target, storage, members, level):
+    """原来的打包方式：所有文件单线程 ZIP_DEFLATED"""
+    with zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED, compresslevel=level) as zf:
+        for arcname, version in members:
+            zf.write(storage.local_path(GROUP_ID, version.stored_filename), arcname)
+
+
+def run(name, build, output_path):
+    start = time.perf_counter()
+    with open(output_path, "wb") as target:
+        build(target)
+    elapsed = time.perf_counter() - start
+    size = os.path.getsize(output_path)
+    print(f"{name:<24}{elapsed:>10.2f}{size / 1024 / 1024:>12.1f}")
+    return elapsed
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="groupbin_bench_zip_")
+    try:
+        storage = LocalStorage(StorageLayout(os.path.join(workdir, "data")))
+        files = generate_files(storage, args)
+        members = select_members(files)
+        output_path = os.path.join(workdir, "out.zip")
+        print(f"{len(files)} 个文件，文本 {args.text_mb} MB，随机数据 {args.media_mb} MB")
+
+        print(f"{'mode':<24}{'time(s)':>10}{'size(MB)':>12}")
+        baseline = run(
+            "deflate single-thread",
+            lambda target: baseline_zip(target, storage, members, args.level),
+            output_path,
+        )
+        for workers in args.workers:
+            elapsed = run(
+                f"content-aware x{workers}",
+                lambda target: write_group_zip(
+                    target, GROUP_ID, members, storage, workers=workers, level=args.level
+                ),
+                output_path,
+            )
+            print(f"{'':<24}加速 {baseline / elapsed:.2f}x")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
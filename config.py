@@ -1,4 +1,6 @@
 import os
+import socket
+import tempfile
 from dotenv import load_dotenv
 from datetime import timedelta
 
@@ -27,13 +29,82 @@ class Config:
     MAX_UPLOAD_SIZE_MB = (
         int(os.getenv("MAX_UPLOAD_SIZE_MB", "10")) * 1024 * 1024
     )  # 从MB转换为字节
+    # 每个小组的存储配额，0表示不限制
+    GROUP_QUOTA_MB = int(os.getenv("GROUP_QUOTA_MB", "0")) * 1024 * 1024  # 从MB转换为字节
+    FILE_LIST_PAGE_SIZE = int(
+        os.getenv("FILE_LIST_PAGE_SIZE", "100")
+    )  # 小组页面每次加载的文件数
     # 分片大小配置
     CHUNK_SIZE = int(os.getenv("CHUNK_SIZE_MB", "5")) * 1024 * 1024  # 从MB转换为字节
+    # 存储后端：local（UPLOAD_FOLDER）或 s3（S3兼容的对象存储，需要安装boto3）
+    STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+    S3_BUCKET = os.getenv("S3_BUCKET")
+    S3_PREFIX = os.getenv("S3_PREFIX", "")
+    S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")  # MinIO等S3兼容服务的地址
+    S3_REGION = os.getenv("S3_REGION")
+    # 未设置时使用boto3默认的凭证查找方式（环境变量、实例角色等）
+    S3_ACCESS_KEY_ID = os.getenv("S3_ACCESS_KEY_ID")
+    S3_SECRET_ACCESS_KEY = os.getenv("S3_SECRET_ACCESS_KEY")
+    # 文件不在本地时，下载是否重定向到预签名链接（否则由服务器转发）
+    DOWNLOAD_PRESIGNED = os.getenv("DOWNLOAD_PRESIGNED", "true").lower() == "true"
+    PRESIGNED_URL_EXPIRES_SECONDS = int(os.getenv("PRESIGNED_URL_EXPIRES_SECONDS", "300"))
+    # 磁盘布局：小组目录和上传临时目录按ID哈希分层的级数（0为平铺），每级256个子目录
+    STORAGE_FANOUT_LEVELS = int(os.getenv("STORAGE_FANOUT_LEVELS", "0"))
+    # 小组目录内存储文件的分层级数
+    STORAGE_BLOB_FANOUT_LEVELS = int(os.getenv("STORAGE_BLOB_FANOUT_LEVELS", "0"))
+    # 按文件大小和服务端负载为每个文件建议分片大小和并发数，关闭时统一使用CHUNK_SIZE
+    UPLOAD_ADAPTIVE = os.getenv("UPLOAD_ADAPTIVE", "true").lower() == "true"
+    UPLOAD_MIN_CHUNK_SIZE = int(os.getenv("UPLOAD_MIN_CHUNK_SIZE_MB", "1")) * 1024 * 1024
+    UPLOAD_MAX_CHUNK_SIZE = int(os.getenv("UPLOAD_MAX_CHUNK_SIZE_MB", "64")) * 1024 * 1024
+    # 每个文件期望的分片数
+    UPLOAD_TARGET_CHUNKS = int(os.getenv("UPLOAD_TARGET_CHUNKS", "100"))
+    # 每个浏览器同时上传的最大分片数
+    UPLOAD_MAX_SIMULTANEOUS = int(os.getenv("UPLOAD_MAX_SIMULTANEOUS", "3"))
+    # 所有worker正在处理的分片数达到该值时视为繁忙，建议串行上传，应小于 UPLOAD_MAX_CONCURRENT_CHUNKS
+    UPLOAD_BUSY_INFLIGHT_CHUNKS = int(os.getenv("UPLOAD_BUSY_INFLIGHT_CHUNKS", "6"))
+    # 最近分片处理耗时的p90超过该值（秒）时减半并发数
+    UPLOAD_SLOW_CHUNK_SECONDS = float(os.getenv("UPLOAD_SLOW_CHUNK_SECONDS", "5"))
+    # 上传准入控制：超出限制的分片请求返回429和Retry-After，限制对所有worker进程生效
+    UPLOAD_ADMISSION_ENABLED = (
+        os.getenv("UPLOAD_ADMISSION_ENABLED", "true").lower() == "true"
+    )
+    UPLOAD_ADMISSION_DIR = os.path.join(DATA_DIR, "admission")  # 准入名额文件目录
+    # 同时写入的分片数上限，应小于 worker 数 × 线程数，为页面访问保留处理能力（0表示不限制）
+    UPLOAD_MAX_CONCURRENT_CHUNKS = int(os.getenv("UPLOAD_MAX_CONCURRENT_CHUNKS", "8"))
+    UPLOAD_MAX_CONCURRENT_MERGES = int(os.getenv("UPLOAD_MAX_CONCURRENT_MERGES", "2"))
+    # 同时写入的tus PATCH数上限，一个PATCH可能持续传完整个文件，单独计数
+    UPLOAD_MAX_CONCURRENT_STREAMS = int(os.getenv("UPLOAD_MAX_CONCURRENT_STREAMS", "4"))
+    # 每个小组、每个客户端正在上传的字节数上限
+    UPLOAD_MAX_GROUP_INFLIGHT_BYTES = (
+        int(os.getenv("UPLOAD_MAX_GROUP_INFLIGHT_MB", "256")) * 1024 * 1024
+    )
+    UPLOAD_MAX_CLIENT_INFLIGHT_BYTES = (
+        int(os.getenv("UPLOAD_MAX_CLIENT_INFLIGHT_MB", "128")) * 1024 * 1024
+    )
+    UPLOAD_RETRY_AFTER_SECONDS = int(os.getenv("UPLOAD_RETRY_AFTER_SECONDS", "2"))
+    # 名额文件超过该时间未释放时视为持有进程已退出
+    UPLOAD_ADMISSION_STALE_SECONDS = int(
+        os.getenv("UPLOAD_ADMISSION_STALE_SECONDS", "600")
+    )
+    # 是否以原始请求体（application/octet-stream）上传分片，避免multipart解析的额外拷贝
+    UPLOAD_RAW_CHUNKS = os.getenv("UPLOAD_RAW_CHUNKS", "true").lower() == "true"
+    # 原始请求体分片写入磁盘时的缓冲区大小
+    UPLOAD_STREAM_BUFFER_SIZE = int(os.getenv("UPLOAD_STREAM_BUFFER_KB", "1024")) * 1024
     # 文件操作最大等待时间（毫秒）
     FILE_MOVE_OPERATION_MAX_WAIT_MS = int(
         os.getenv("FILE_MOVE_OPERATION_MAX_WAIT_MS", "3000")
     )
 
+    # 合并中的上传会话超过该时间（秒）未完成时视为中断，可由其他请求重新合并
+    UPLOAD_MERGE_STALE_SECONDS = int(os.getenv("UPLOAD_MERGE_STALE_SECONDS", "600"))
+    # 节点标识，多个节点共用数据库时记录在上传会话中，默认为主机名
+    NODE_ID = os.getenv("NODE_ID") or socket.gethostname()
+
+    # ASGI服务模式（asgi.py）：执行视图和读取响应数据的线程数
+    ASGI_THREADS = int(os.getenv("ASGI_THREADS", "32"))
+    # 在事件循环中完整接收的请求体大小上限，更大的请求体边接收边交给视图
+    ASGI_BUFFER_MB = int(os.getenv("ASGI_BUFFER_MB", "64")) * 1024 * 1024  # 从MB转换为字节
+
     # 小组配置
     MAX_RECENT_GROUPS = int(os.getenv("MAX_RECENT_GROUPS", "10"))
     DEFAULT_GROUP_DURATION = int(os.getenv("DEFAULT_GROUP_DURATION_HOURS", "72"))
@@ -68,6 +139,12 @@ class Config:
     LOG_FILE_BACKUP_COUNT = int(
         os.getenv("LOG_FILE_BACKUP_COUNT", "5")
     )  # 日志文件备份数量，默认5个
+    LOG_ASYNC = (
+        os.getenv("LOG_ASYNC", "true").lower() == "true"
+    )  # 通过后台线程写日志文件，避免请求线程阻塞在磁盘写入上
+    LOG_CHUNK_SAMPLE_RATE = int(
+        os.getenv("LOG_CHUNK_SAMPLE_RATE", "20")
+    )  # 每个分片的日志每N条输出1条
 
     # 定时清理配置（最小值设置为1分钟，方便测试）
     CLEAN_INTERVAL_HOUR = max(
@@ -86,6 +163,119 @@ class Config:
         float(os.getenv("TEMP_FILE_EXPIRATION_HOURS", "24")), 1 / 60
     )  # 临时文件过期时间（小时），用于清理上传过程中的临时文件
 
+    # 小组ZIP缓存配置
+    ZIP_CACHE_DIR = os.getenv("ZIP_CACHE_DIR", os.path.join(DATA_DIR, "zip_cache"))
+    ZIP_CACHE_MAX_MB = (
+        int(os.getenv("ZIP_CACHE_MAX_MB", "1024")) * 1024 * 1024
+    )  # 缓存总大小上限，从MB转换为字节，0表示不缓存
+    ZIP_CACHE_BUILD_WAIT_SECONDS = int(
+        os.getenv("ZIP_CACHE_BUILD_WAIT_SECONDS", "300")
+    )  # 等待其他请求打包的最长时间，打包锁超过该时间视为过期
+    ZIP_COMPRESS_WORKERS = int(
+        os.getenv("ZIP_COMPRESS_WORKERS", "0")
+    )  # 打包时并行压缩的线程数，0表示使用CPU核数
+    ZIP_COMPRESS_LEVEL = int(os.getenv("ZIP_COMPRESS_LEVEL", "6"))  # deflate压缩级别
+    ZIP_STORE_RATIO = float(
+        os.getenv("ZIP_STORE_RATIO", "0.9")
+    )  # 试压后大小超过原大小的该比例时不压缩，直接存储
+
+    # 文件预览配置
+    PREVIEW_ENABLED = os.getenv("PREVIEW_ENABLED", "true").lower() == "true"
+    PREVIEW_DIR = os.getenv("PREVIEW_DIR", os.path.join(DATA_DIR, "previews"))
+    PREVIEW_MAX_MB = (
+        int(os.getenv("PREVIEW_MAX_MB", "256")) * 1024 * 1024
+    )  # 预览缓存总大小上限，从MB转换为字节
+    PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", "1"))  # 每个进程生成预览的线程数
+    PREVIEW_MAX_PENDING = int(
+        os.getenv("PREVIEW_MAX_PENDING", "200")
+    )  # 每个进程等待生成的预览数上限，超出时丢弃，之后按需生成
+    PREVIEW_TEXT_BYTES = int(os.getenv("PREVIEW_TEXT_BYTES", "1024"))  # 文本预览的字节数
+    PREVIEW_THUMBNAIL_SIZE = int(os.getenv("PREVIEW_THUMBNAIL_SIZE", "256"))  # 缩略图最大边长（像素）
+    PREVIEW_ARCHIVE_ENTRIES = int(
+        os.getenv("PREVIEW_ARCHIVE_ENTRIES", "100")
+    )  # 压缩包预览列出的条目数
+    PREVIEW_MAX_SOURCE_MB = (
+        int(os.getenv("PREVIEW_MAX_SOURCE_MB", "50")) * 1024 * 1024
+    )  # 需要整个读入的文件（图片、对象存储中的zip）超过该大小时不生成预览
+
+    # 小组变化通知配置
+    GROUP_EVENTS_MODE = os.getenv(
+        "GROUP_EVENTS_MODE", "auto"
+    ).lower()  # stream（保持连接推送）、poll（浏览器定期重连）、off，auto 在协程worker中推送
+    GROUP_EVENTS_POLL_SECONDS = float(
+        os.getenv("GROUP_EVENTS_POLL_SECONDS", "1")
+    )  # 推送模式下每个worker查询新事件的间隔
+    GROUP_EVENTS_RETRY_SECONDS = int(
+        os.getenv("GROUP_EVENTS_RETRY_SECONDS", "10")
+    )  # 轮询模式下浏览器重连的间隔
+    GROUP_EVENTS_STREAM_SECONDS = int(
+        os.getenv("GROUP_EVENTS_STREAM_SECONDS", "300")
+    )  # 推送连接的最长时间，之后由浏览器重连
+    GROUP_EVENTS_RETENTION_MINUTES = int(
+        os.getenv("GROUP_EVENTS_RETENTION_MINUTES", "60")
+    )  # 事件的保留时间，由定时清理任务删除
+
+    # 存储压缩配置
+    STORAGE_CODEC = os.getenv(
+        "STORAGE_CODEC", "off"
+    ).lower()  # 上传后在后台压缩存储的文件：auto（zstd，未安装zstandard时gzip）、zstd、gzip、off
+    STORAGE_CODEC_LEVEL = int(os.getenv("STORAGE_CODEC_LEVEL", "0"))  # 压缩级别，0表示使用编码的默认级别
+    STORAGE_CODEC_MIN_BYTES = int(
+        os.getenv("STORAGE_CODEC_MIN_KB", "64")
+    ) * 1024  # 小于该大小的文件不压缩，从KB转换为字节
+    STORAGE_CODEC_MAX_RATIO = float(
+        os.getenv("STORAGE_CODEC_MAX_RATIO", "0.8")
+    )  # 试压和压缩后的大小超过原大小的该比例时保留原文件
+    STORAGE_CODEC_WORKERS = int(os.getenv("STORAGE_CODEC_WORKERS", "1"))  # 每个进程压缩文件的线程数
+
+    # 删除文件配置
+    BATCH_DELETE_MAX_FILES = int(
+        os.getenv("BATCH_DELETE_MAX_FILES", "1000")
+    )  # 批量删除接口一次最多删除的文件数
+    BLOB_REAPER_INTERVAL_SECONDS = int(
+        os.getenv("BLOB_REAPER_INTERVAL_SECONDS", "30")
+    )  # 后台删除存储文件的检查间隔，0表示不启动后台删除线程
+    BLOB_REAPER_BATCH_SIZE = int(
+        os.getenv("BLOB_REAPER_BATCH_SIZE", "100")
+    )  # 每批领取的待删除文件数
+    BLOB_REAPER_DELETES_PER_SECOND = float(
+        os.getenv("BLOB_REAPER_DELETES_PER_SECOND", "50")
+    )  # 每个worker每秒最多删除的文件数，0表示不限制
+    BLOB_REAPER_MAX_ATTEMPTS = int(
+        os.getenv("BLOB_REAPER_MAX_ATTEMPTS", "10")
+    )  # 删除失败的最多尝试次数
+
+    # 运行指标配置
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    METRICS_DIR = os.path.join(DATA_DIR, "metrics")  # 各worker进程的指标快照目录
+    METRICS_FLUSH_INTERVAL_SECONDS = float(
+        os.getenv("METRICS_FLUSH_INTERVAL_SECONDS", "1")
+    )  # 指标快照写入间隔（秒）
+
+    # 管理页面密码，未设置时管理页面不可访问
+    ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
+
+    # 请求剖析配置（默认关闭）
+    PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() == "true"
+    PROFILER_SAMPLE_RATE = float(
+        os.getenv("PROFILER_SAMPLE_RATE", "0.01")
+    )  # 使用cProfile剖析的请求比例
+    PROFILER_SLOW_REQUEST_MS = int(
+        os.getenv("PROFILER_SLOW_REQUEST_MS", "1000")
+    )  # 超过该耗时的请求总会被记录（毫秒）
+    PROFILER_MAX_ENTRIES = int(
+        os.getenv("PROFILER_MAX_ENTRIES", "200")
+    )  # 最多保留的剖析记录数
+    PROFILER_DIR = os.path.join(DATA_DIR, "profiles")  # 剖析记录存储目录
+
+    # 启动配置
+    PRELOAD_APP = (
+        os.getenv("PRELOAD_APP", "false").lower() == "true"
+    )  # 应用在gunicorn主进程中预加载（由 gunicorn.conf.py 设置），后台任务在worker中启动
+    JINJA_CACHE_DIR = os.getenv(
+        "JINJA_CACHE_DIR", os.path.join(DATA_DIR, "jinja_cache")
+    )  # 模板字节码缓存目录，设为空字符串时不缓存
+
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -99,8 +289,34 @@ class ProductionConfig(Config):
     LOG_LEVEL = "WARNING"
 
 
+class TestingConfig(Config):
+    DEBUG = False
+    TESTING = True
+    LOG_LEVEL = "WARNING"
+    LOG_FILE = None  # 测试时不写日志文件
+    WTF_CSRF_ENABLED = False
+    # 默认使用内存数据库，基准测试等场景可通过环境变量指定文件数据库
+    SQLALCHEMY_DATABASE_URI = os.getenv("TEST_DATABASE_URI", "sqlite://")
+    CLEAN_INTERVAL_HOUR = 0  # 测试时不启动后台清理线程
+    BLOB_REAPER_INTERVAL_SECONDS = 0  # 测试时不启动后台删除线程，由测试调用 run_once
+    JINJA_CACHE_DIR = None  # 测试时不缓存模板
+    # 测试产生的文件写入本次运行的临时目录（测试的 tearDown 中删除），不留在工作目录的 data/ 中。
+    # .env 中的 DATA_DIR 总会被加载，因此基准测试等场景通过 TEST_DATA_DIR 指定目录
+    TEST_DATA_DIR = os.getenv("TEST_DATA_DIR") or os.path.join(
+        tempfile.gettempdir(), f"groupbin-test-{os.getpid()}"
+    )
+    UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", os.path.join(TEST_DATA_DIR, "data"))
+    SESSION_FILE_DIR = os.path.join(TEST_DATA_DIR, "sessions")
+    METRICS_DIR = os.path.join(TEST_DATA_DIR, "metrics")
+    PREVIEW_DIR = os.path.join(TEST_DATA_DIR, "previews")
+    UPLOAD_ADMISSION_DIR = os.path.join(TEST_DATA_DIR, "admission")
+    ZIP_CACHE_DIR = os.path.join(TEST_DATA_DIR, "zip_cache")
+    PROFILER_DIR = os.path.join(TEST_DATA_DIR, "profiles")
+
+
 config = {
     "development": DevelopmentConfig,
     "production": ProductionConfig,
+    "testing": TestingConfig,
     "default": DevelopmentConfig,
 }
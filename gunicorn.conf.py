@@ -0,0 +1,32 @@
+"""
+gunicorn配置，Docker镜像默认使用：
+
+    gunicorn -c gunicorn.conf.py run:app
+
+preload_app 在主进程中创建一次应用（导入模块、检查数据库结构、编译模板），worker由主进程
+fork得到，启动时不再重复这些工作；post_fork 在每个worker中重启日志线程和定时清理任务。
+worker类型需要通过 GUNICORN_WORKER_CLASS 指定，而不是 -k 参数：使用gevent时需要在预加载
+之前替换标准库。
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "sync")
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+preload_app = os.getenv("PRELOAD_APP", "true").lower() == "true"
+
+if preload_app:
+    # 告诉 create_app 推迟启动后台任务
+    os.environ["PRELOAD_APP"] = "true"
+    if worker_class == "gevent":
+        from gevent import monkey
+
+        monkey.patch_all()
+
+
+def post_fork(server, worker):
+    from app import init_worker
+
+    init_worker()
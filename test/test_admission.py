@@ -0,0 +1,205 @@
+import unittest
+import tempfile
+import os
+import time
+import shutil
+import base64
+import io
+from unittest import mock
+from flask import Request
+from app import create_app, db
+from app.models import Group, File
+from app.utils.admission import admission
+from app.utils.upload_advice import chunk_load
+
+
+class AdmissionTestCase(unittest.TestCase):
+    def setUp(self):
+        """在每个测试前设置环境"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        # 创建临时目录用于测试
+        self.test_upload_dir = tempfile.mkdtemp()
+        self.admission_dir = tempfile.mkdtemp()
+        self.app.config['UPLOAD_FOLDER'] = self.test_upload_dir
+        admission.admission_dir = self.admission_dir
+        admission.max_chunks = 1
+        admission.max_merges = 1
+        self.client = self.app.test_client()
+
+        group = Group(name="Admission Group")
+        db.session.add(group)
+        db.session.commit()
+        self.group_id = group.id
+
+    def tearDown(self):
+        """在每个测试后清理环境"""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.app.config['TEST_DATA_DIR'], ignore_errors=True)
+        shutil.rmtree(self.test_upload_dir, ignore_errors=True)
+        shutil.rmtree(self.admission_dir, ignore_errors=True)
+
+    def hold(self, *parts):
+        """模拟其他worker进程持有的名额"""
+        path = os.path.join(self.admission_dir, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'w').close()
+        return path
+
+    def upload_single_chunk(self, content=b"x" * 1000):
+        params = {
+            "resumableIdentifier": "admission-upload",
+            "resumableFilename": "test.txt",
+            "resumableChunkNumber": "1",
+            "resumableTotalChunks": "1",
+            "resumableTotalSize": str(len(content)),
+            "resumableCurrentChunkSize": str(len(content)),
+        }
+        return self.client.post(
+            f"/file/upload_raw/{self.group_id}",
+            query_string=params,
+            data=content,
+            content_type="application/octet-stream",
+        )
+
+    def test_chunk_slots_exhausted(self):
+        """测试分片并发数达到上限时返回429，名额释放后可以上传"""
+        slot = self.hold("chunks", "0.slot")
+        response = self.upload_single_chunk()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Retry-After"], str(admission.retry_after))
+        self.assertFalse(os.path.exists(os.path.join(self.test_upload_dir, "tmp", "admission-upload")))
+
+        os.remove(slot)
+        response = self.upload_single_chunk()
+        self.assertEqual(response.status_code, 200)
+        # 请求结束后释放名额
+        self.assertEqual(os.listdir(os.path.join(self.admission_dir, "chunks")), [])
+
+    def test_multipart_rejected_before_parsing(self):
+        """测试multipart分片在解析表单之前被拒绝"""
+        self.hold("chunks", "0.slot")
+        content = b"x" * 1000
+        params = {
+            "resumableIdentifier": "multipart-upload",
+            "resumableFilename": "test.txt",
+            "resumableChunkNumber": "1",
+            "resumableTotalChunks": "1",
+            "resumableTotalSize": str(len(content)),
+            "resumableCurrentChunkSize": str(len(content)),
+        }
+        with mock.patch.object(Request, "_load_form_data", autospec=True) as load_form:
+            response = self.client.post(
+                f"/file/upload/{self.group_id}",
+                query_string=params,
+                data=dict(params, file=(io.BytesIO(content), "test.txt")),
+                content_type="multipart/form-data",
+            )
+        self.assertEqual(response.status_code, 429)
+        load_form.assert_not_called()
+
+    def test_stale_slot_reclaimed(self):
+        """测试异常退出的进程遗留的名额会被回收"""
+        slot = self.hold("chunks", "0.slot")
+        old = time.time() - admission.stale_seconds - 10
+        os.utime(slot, (old, old))
+        self.assertEqual(self.upload_single_chunk().status_code, 200)
+
+    def test_client_inflight_bytes(self):
+        """测试客户端正在上传的字节数超出限制时返回429"""
+        admission.max_client_bytes = 1500
+        self.hold("bytes", "client_127.0.0.1", "other_1000")
+        response = self.upload_single_chunk()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.get_json()["reason"], "client_bytes")
+
+    def test_merge_slots_exhausted(self):
+        """测试合并名额不足时返回429，重传最后一个分片后完成合并"""
+        slot = self.hold("merges", "0.slot")
+        self.assertEqual(self.upload_single_chunk().status_code, 429)
+        self.assertEqual(File.query.count(), 0)
+
+        os.remove(slot)
+        response = self.upload_single_chunk()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(File.query.count(), 1)
+
+    def test_load_counts_all_workers(self):
+        """测试上传建议和后台任务按所有worker持有的分片名额判断负载"""
+        admission.max_chunks = 8
+        for index in range(self.app.config["UPLOAD_BUSY_INFLIGHT_CHUNKS"]):
+            self.hold("chunks", f"{index}.slot")
+        stale = self.hold("chunks", "7.slot")
+        old = time.time() - admission.stale_seconds - 10
+        os.utime(stale, (old, old))
+        self.assertEqual(chunk_load.current(), self.app.config["UPLOAD_BUSY_INFLIGHT_CHUNKS"])
+
+        response = self.client.get("/file/upload_advice", query_string={"size": 1000 * 1024 * 1024})
+        self.assertEqual(response.get_json()["files"][0]["simultaneousUploads"], 1)
+
+    def test_tus_patch(self):
+        """测试tus的PATCH使用单独的名额，完成时合并名额不足的上传在HEAD时完成"""
+        headers = {"Tus-Resumable": "1.0.0"}
+        response = self.client.post(
+            f"/file/tus/{self.group_id}",
+            headers=dict(headers, **{
+                "Upload-Length": "1000",
+                "Upload-Metadata": "filename " + base64.b64encode(b"tus.bin").decode(),
+            }),
+        )
+        location = response.headers["Location"]
+
+        def patch(data, offset=0):
+            return self.client.patch(
+                location,
+                data=data,
+                headers=dict(headers, **{"Upload-Offset": str(offset)}),
+                content_type="application/offset+octet-stream",
+            )
+
+        # 分片名额占满时不影响tus
+        self.hold("chunks", "0.slot")
+        admission.max_streams = 1
+        slot = self.hold("streams", "0.slot")
+        response = patch(b"x" * 500)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Tus-Resumable"], "1.0.0")
+        self.assertEqual(response.headers["Retry-After"], str(admission.retry_after))
+        os.remove(slot)
+        self.assertEqual(patch(b"x" * 500).status_code, 204)
+
+        slot = self.hold("merges", "0.slot")
+        self.assertEqual(patch(b"x" * 500, offset=500).status_code, 429)
+        self.assertEqual(File.query.count(), 0)
+        self.assertEqual(self.client.head(location, headers=headers).status_code, 429)
+        os.remove(slot)
+
+        response = self.client.head(location, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Upload-Offset"], "1000")
+        self.assertEqual(File.query.count(), 1)
+        self.assertEqual(os.listdir(os.path.join(self.admission_dir, "merges")), [])
+        self.assertEqual(os.listdir(os.path.join(self.admission_dir, "streams")), [])
+
+    def test_reclaimed_slot_kept(self):
+        """测试名额被当作失效回收后，原持有者结束时不删除其他请求的名额，续期后不会被回收"""
+        with self.app.test_request_context():
+            admission.acquire_merge()
+            slot = os.path.join(self.admission_dir, "merges", "0.slot")
+            old = time.time() - admission.stale_seconds - 10
+            os.utime(slot, (old, old))
+            admission.refresh()
+            self.assertGreater(os.path.getmtime(slot), old)
+
+            with open(slot, "w") as f:
+                f.write("other-request")
+        self.assertTrue(os.path.exists(slot))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+import unittest
+import asyncio
+import tempfile
+import os
+import shutil
+import base64
+from app import create_app, db
+from app.models import Group, File, FileVersion
+from app.utils.asgi import AsgiBridge
+
+
+async def asgi_request(bridge, method, path, query="", headers=(), body_parts=(b"",), on_body=None):
+    """以ASGI协议发送一个请求，返回 (状态码, 响应头, 响应体)"""
+    parts = list(body_parts)
+    sent = []
+    finished = asyncio.Event()
+
+    async def receive():
+        if parts:
+            data = parts.pop(0)
+            return {"type": "http.request", "body": data, "more_body": bool(parts)}
+        # 请求体发送完后，等到响应结束才断开
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+        if message["type"] == "http.response.body":
+            if on_body is not None:
+                await on_body(message)
+            if not message.get("more_body", False):
+                finished.set()
+
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "root_path": "",
+        "query_string": query.encode("latin-1"),
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers],
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80),
+    }
+    await bridge(scope, receive, send)
+    finished.set()
+    start = sent[0]
+    body = b"".join(message.get("body", b"") for message in sent[1:])
+    return start["status"], dict((k.decode(), v.decode()) for k, v in start["headers"]), body
+
+
+class AsgiBridgeTestCase(unittest.TestCase):
+    def setUp(self):
+        """在每个测试前设置环境"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        # 创建临时目录用于测试
+        self.test_upload_dir = tempfile.mkdtemp()
+        self.app.config['UPLOAD_FOLDER'] = self.test_upload_dir
+
+        group = Group(name="ASGI Group")
+        db.session.add(group)
+        db.session.commit()
+        self.group_id = group.id
+
+    def tearDown(self):
+        """在每个测试后清理环境"""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.app.config['TEST_DATA_DIR'], ignore_errors=True)
+        shutil.rmtree(self.test_upload_dir, ignore_errors=True)
+
+    def upload(self, bridge, content, identifier="asgi-upload"):
+        query = (
+            f"resumableIdentifier={identifier}&resumableFilename=asgi.bin&resumableChunkNumber=1"
+            f"&resumableTotalChunks=1&resumableTotalSize={len(content)}"
+            f"&resumableCurrentChunkSize={len(content)}"
+        )
+        # 请求体分多次到达，模拟慢速上传
+        parts = [content[i:i + 1000] for i in range(0, len(content), 1000)]
+        return asyncio.run(
+            asgi_request(
+                bridge,
+                "POST",
+                f"/file/upload_raw/{self.group_id}",
+                query,
+                [("Content-Type", "application/octet-stream"), ("Content-Length", str(len(content)))],
+                parts,
+            )
+        )
+
+    def test_chunk_upload_and_range_download(self):
+        """测试通过ASGI上传分片并按Range下载"""
+        bridge = AsgiBridge(self.app, threads=2)
+        content = os.urandom(5000)
+        status, _, _ = self.upload(bridge, content)
+        self.assertEqual(status, 200)
+
+        version = FileVersion.query.one()
+        url = f"/file/{self.group_id}/{version.file_id}/version/{version.id}"
+        status, headers, body = asyncio.run(
+            asgi_request(bridge, "GET", url, headers=[("Range", "bytes=100-199")])
+        )
+        self.assertEqual(status, 206)
+        self.assertEqual(headers["content-range"], "bytes 100-199/5000")
+        self.assertEqual(body, content[100:200])
+
+    def test_slow_download_does_not_hold_thread(self):
+        """测试只有一个线程时，慢速下载等待发送期间其他请求仍能完成"""
+        bridge = AsgiBridge(self.app, threads=1)
+        content = os.urandom(600 * 1024)
+        self.assertEqual(self.upload(bridge, content)[0], 200)
+        version = FileVersion.query.one()
+        url = f"/file/{self.group_id}/{version.file_id}/version/{version.id}"
+
+        async def scenario():
+            release = asyncio.Event()
+            blocked = asyncio.Event()
+
+            async def slow_client(message):
+                if message.get("more_body"):
+                    blocked.set()
+                    await release.wait()
+
+            slow = asyncio.ensure_future(asgi_request(bridge, "GET", url, on_body=slow_client))
+            await blocked.wait()
+            # 慢速下载停在发送数据上，唯一的线程是空闲的
+            fast = await asyncio.wait_for(asgi_request(bridge, "GET", url), timeout=10)
+            release.set()
+            return await slow, fast
+
+        (slow_status, _, slow_body), (fast_status, _, fast_body) = asyncio.run(scenario())
+        self.assertEqual((slow_status, fast_status), (200, 200))
+        self.assertEqual(slow_body, content)
+        self.assertEqual(fast_body, content)
+
+    def test_large_body_streams_to_view(self):
+        """测试超过缓冲上限的请求体（tus的PATCH）边接收边交给视图"""
+        bridge = AsgiBridge(self.app, threads=2, buffer_bytes=1000)
+        content = os.urandom(4000)
+        metadata = "filename " + base64.b64encode(b"tus.bin").decode()
+        tus_headers = [("Tus-Resumable", "1.0.0")]
+        status, headers, _ = asyncio.run(
+            asgi_request(
+                bridge,
+                "POST",
+                f"/file/tus/{self.group_id}",
+                headers=tus_headers + [("Upload-Length", "4000"), ("Upload-Metadata", metadata)],
+            )
+        )
+        self.assertEqual(status, 201)
+
+        status, headers, _ = asyncio.run(
+            asgi_request(
+                bridge,
+                "PATCH",
+                headers["location"],
+                headers=tus_headers
+                + [
+                    ("Upload-Offset", "0"),
+                    ("Content-Type", "application/offset+octet-stream"),
+                    ("Content-Length", "4000"),
+                ],
+                body_parts=[content[i:i + 500] for i in range(0, 4000, 500)],
+            )
+        )
+        self.assertEqual(status, 204)
+        self.assertEqual(File.query.get(headers["x-groupbin-file-id"]).size, 4000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,7 +4,7 @@ import os
 import shutil
 from datetime import datetime, timedelta, timezone
 from app import create_app, db
-from app.models import Group, File, FileVersion
+from app.models import Group, File, FileVersion, UploadSession
 from app.utils.cleanup import CleanupTask
 
 
@@ -26,6 +26,7 @@ class CleanupTestCase(unittest.TestCase):
         db.session.remove()
         db.drop_all()
         self.app_context.pop()
+        shutil.rmtree(self.app.config['TEST_DATA_DIR'], ignore_errors=True)
         
         # 清理临时目录
         if os.path.exists(self.test_upload_dir):
@@ -126,6 +127,33 @@ class CleanupTestCase(unittest.TestCase):
         self.assertFalse(os.path.exists(orphaned_dir))    # 孤立目录应被删除
         self.assertFalse(os.path.exists(orphaned_file))   # 孤立文件应被删除
 
+    def test_cleanup_expired_upload_sessions(self):
+        """测试按过期时间清理上传会话，进行中的会话目录即使修改时间很早也会保留"""
+        group = Group(name="Upload Group")
+        db.session.add(group)
+        db.session.commit()
+        now = datetime.now(timezone.utc)
+        expired = UploadSession(
+            group_id=group.id, protocol="resumable", identifier="expired", filename="a.bin",
+            total_size=10, expires_at=now - timedelta(hours=1),
+        )
+        active = UploadSession(
+            group_id=group.id, protocol="resumable", identifier="active", filename="b.bin",
+            total_size=10, expires_at=now + timedelta(hours=1),
+        )
+        db.session.add_all([expired, active])
+        db.session.commit()
+        tmp_dir = os.path.join(self.test_upload_dir, "tmp")
+        old = now.timestamp() - (self.app.config['TEMP_FILE_EXPIRATION_HOURS'] + 1) * 3600
+        for session_id in (expired.id, active.id):
+            os.makedirs(os.path.join(tmp_dir, session_id))
+            os.utime(os.path.join(tmp_dir, session_id), (old, old))
+
+        CleanupTask(self.app)._cleanup_expired_temp_files(tmp_dir)
+
+        self.assertEqual([s.identifier for s in UploadSession.query.all()], ["active"])
+        self.assertEqual(os.listdir(tmp_dir), [active.id])
+
     def test_cleanup_orphaned_files_from_db(self):
         """测试清理数据库中的孤立文件记录"""
         # 创建一个小组
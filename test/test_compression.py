@@ -0,0 +1,168 @@
+import unittest
+import tempfile
+import os
+import io
+import gzip
+import shutil
+import zipfile
+from datetime import datetime, timezone
+from app import create_app, db
+from app.models import Group, File, FileVersion, DeletedBlob
+from app.utils.compression import compressor
+from app.utils.previews import previews, preview_target
+from app.utils.storage import get_storage
+
+LOG_CONTENT = b"".join(
+    f"2024-01-02 03:04:{i % 60:02d} INFO request {i} finished in {i % 97} ms\n".encode()
+    for i in range(5000)
+)
+
+
+class CompressionTestCase(unittest.TestCase):
+    def setUp(self):
+        """在每个测试前设置环境"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        # 创建临时目录用于测试
+        self.test_upload_dir = tempfile.mkdtemp()
+        self.app.config['UPLOAD_FOLDER'] = self.test_upload_dir
+        self.app.config['PREVIEW_DIR'] = os.path.join(self.test_upload_dir, "previews")
+        self.app.config['PREVIEW_ENABLED'] = False
+        self.app.config['ZIP_CACHE_MAX_MB'] = 0
+        self.app.config['STORAGE_CODEC'] = "gzip"
+        self.app.config['STORAGE_CODEC_MIN_BYTES'] = 1024
+        self.client = self.app.test_client()
+
+        group = Group(name="Compression Group")
+        db.session.add(group)
+        db.session.commit()
+        self.group_id = group.id
+
+    def tearDown(self):
+        """在每个测试后清理环境"""
+        compressor.wait()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.app.config['TEST_DATA_DIR'], ignore_errors=True)
+
+        # 清理临时目录
+        if os.path.exists(self.test_upload_dir):
+            shutil.rmtree(self.test_upload_dir)
+
+    def upload(self, content, filename):
+        """以原始请求体方式上传一个单分片文件，等待后台压缩完成后返回版本"""
+        response = self.client.post(
+            f"/file/upload_raw/{self.group_id}",
+            query_string={
+                "resumableIdentifier": filename,
+                "resumableFilename": filename,
+                "resumableChunkNumber": "1",
+                "resumableTotalChunks": "1",
+                "resumableTotalSize": str(len(content)),
+                "resumableCurrentChunkSize": str(len(content)),
+            },
+            data=content,
+            content_type="application/octet-stream",
+        )
+        self.assertEqual(response.status_code, 200)
+        compressor.wait()
+        db.session.expire_all()
+        file = File.query.filter_by(group_id=self.group_id, original_filename=filename).one()
+        return file.latest_version
+
+    def download_url(self, version):
+        return f"/file/{self.group_id}/{version.file_id}/version/{version.id}"
+
+    def test_compress_after_upload(self):
+        """测试上传后在后台压缩，原文件延迟删除"""
+        storage = get_storage(self.app)
+        version = self.upload(LOG_CONTENT, "app.log")
+        self.assertEqual(version.codec, "gzip")
+        self.assertEqual(version.size, len(LOG_CONTENT))
+        self.assertLess(version.stored_size, len(LOG_CONTENT) / 5)
+        self.assertTrue(version.stored_filename.endswith(".gz"))
+        self.assertEqual(version.file.stored_filename, version.stored_filename)
+        with storage.open(self.group_id, version.stored_filename) as f:
+            self.assertEqual(gzip.decompress(f.read()), LOG_CONTENT)
+
+        # 原文件由 blob_reaper 在宽限时间后删除，不删除预览
+        blob = DeletedBlob.query.one()
+        self.assertIsNone(blob.version_id)
+        self.assertTrue(storage.exists(self.group_id, blob.stored_filename))
+        self.assertGreater(blob.next_attempt_at.replace(tzinfo=timezone.utc), datetime.now(timezone.utc))
+
+    def test_download(self):
+        """测试下载压缩存储的文件：按需解压、直接发送压缩数据和Range请求"""
+        version = self.upload(LOG_CONTENT, "app.log")
+        url = self.download_url(version)
+
+        response = self.client.get(url)
+        self.assertEqual(response.data, LOG_CONTENT)
+        self.assertEqual(response.headers["Content-Length"], str(len(LOG_CONTENT)))
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+
+        response = self.client.get(url, headers={"Accept-Encoding": "gzip, deflate"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.headers["Content-Length"], str(version.stored_size))
+        self.assertEqual(gzip.decompress(response.data), LOG_CONTENT)
+        self.assertIn("attachment", response.headers["Content-Disposition"])
+
+        # Range 的范围是解压后的内容
+        response = self.client.get(
+            url, headers={"Accept-Encoding": "gzip", "Range": "bytes=100000-100099"}
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.data, LOG_CONTENT[100000:100100])
+        self.assertEqual(
+            response.headers["Content-Range"], f"bytes 100000-100099/{len(LOG_CONTENT)}"
+        )
+
+    def test_zip_and_preview(self):
+        """测试ZIP打包和预览读取解压后的内容"""
+        version = self.upload(LOG_CONTENT, "app.log")
+        self.assertEqual(version.codec, "gzip")
+
+        response = self.client.get(f"/file/zip/{self.group_id}", query_string={"versions": "latest"})
+        with zipfile.ZipFile(io.BytesIO(response.data)) as zf:
+            self.assertEqual(zf.read("app.log"), LOG_CONTENT)
+
+        self.app.config['PREVIEW_ENABLED'] = True
+        previews.generate(preview_target(self.group_id, version, "app.log"))
+        response = self.client.get(f"/file/preview/{self.group_id}/{version.id}")
+        preview = response.get_json()
+        self.assertEqual(preview["kind"], "text")
+        self.assertTrue(LOG_CONTENT.decode().startswith(preview["text"]))
+
+    def test_skip_incompressible(self):
+        """测试不压缩已压缩的格式、试压效果差和过小的文件"""
+        self.assertIsNone(self.upload(os.urandom(64 * 1024), "random.bin").codec)
+        self.assertIsNone(self.upload(LOG_CONTENT, "app.log.gz").codec)
+        self.assertIsNone(self.upload(b"small", "small.txt").codec)
+        self.app.config['STORAGE_CODEC'] = "off"
+        self.assertIsNone(self.upload(LOG_CONTENT, "other.log").codec)
+        self.assertEqual(DeletedBlob.query.count(), 0)
+        self.assertEqual(len(get_storage(self.app).list(self.group_id)), 4)
+
+    def test_version_deleted_while_compressing(self):
+        """测试压缩期间版本被删除时丢弃压缩结果"""
+        self.app.config['STORAGE_CODEC'] = "off"
+        version = self.upload(LOG_CONTENT, "app.log")
+        target = preview_target(self.group_id, version, "app.log")
+        # 删除后原文件等待 blob_reaper 删除，压缩仍能读取
+        self.client.post(f"/file/delete/{self.group_id}/{version.file_id}")
+
+        self.app.config['STORAGE_CODEC'] = "gzip"
+        self.assertIsNone(compressor.compress(target))
+        self.assertEqual(get_storage(self.app).list(self.group_id), [target.stored_filename])
+        self.assertIsNone(db.session.get(FileVersion, target.version_id))
+        self.assertEqual(DeletedBlob.query.count(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import unittest
+import tempfile
+import os
+import shutil
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+from app import create_app, db
+from app.models import Group, File, FileVersion, DeletedBlob
+from app.utils.blob_reaper import blob_reaper
+from app.utils.storage import LocalStorage, get_storage
+
+
+class FileDeletionTestCase(unittest.TestCase):
+    def setUp(self):
+        """在每个测试前设置环境"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        # 创建临时目录用于测试
+        self.test_upload_dir = tempfile.mkdtemp()
+        self.app.config['UPLOAD_FOLDER'] = self.test_upload_dir
+        self.app.config['BLOB_REAPER_DELETES_PER_SECOND'] = 0
+        self.client = self.app.test_client()
+
+        group = Group(name="Deletion Group")
+        db.session.add(group)
+        db.session.commit()
+        self.group_id = group.id
+
+    def tearDown(self):
+        """在每个测试后清理环境"""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.app.config['TEST_DATA_DIR'], ignore_errors=True)
+
+        # 清理临时目录
+        if os.path.exists(self.test_upload_dir):
+            shutil.rmtree(self.test_upload_dir)
+
+    def upload(self, content, filename, group_id=None, file_id=None):
+        """以原始请求体方式上传一个单分片文件（指定 file_id 时上传新版本），返回文件ID"""
+        group_id = group_id or self.group_id
+        url = f"/file/upload_version_raw/{group_id}/{file_id}" if file_id else f"/file/upload_raw/{group_id}"
+        response = self.client.post(
+            url,
+            query_string={
+                "resumableIdentifier": f"{filename}-{len(content)}",
+                "resumableFilename": filename,
+                "resumableChunkNumber": "1",
+                "resumableTotalChunks": "1",
+                "resumableTotalSize": str(len(content)),
+                "resumableCurrentChunkSize": str(len(content)),
+            },
+            data=content,
+            content_type="application/octet-stream",
+        )
+        self.assertEqual(response.status_code, 200)
+        return file_id or File.query.filter_by(group_id=group_id, original_filename=filename).one().id
+
+    def blob_paths(self, file_id):
+        storage = get_storage(self.app)
+        return [
+            storage.local_path(self.group_id, version.stored_filename)
+            for version in FileVersion.query.filter_by(file_id=file_id)
+        ]
+
+    def test_batch_delete_deferred(self):
+        """测试批量删除立即删除记录，存储中的文件由后台删除"""
+        first = self.upload(b"first", "first.txt")
+        self.upload(b"first v2", "first.txt", file_id=first)
+        second = self.upload(b"second", "second.txt")
+        kept = self.upload(b"kept", "kept.txt")
+        other_group = Group(name="Other")
+        db.session.add(other_group)
+        db.session.commit()
+        other = self.upload(b"other", "other.txt", group_id=other_group.id)
+        paths = self.blob_paths(first) + self.blob_paths(second)
+        self.assertEqual(len(paths), 3)
+
+        response = self.client.post(
+            f"/file/delete_batch/{self.group_id}",
+            json={"file_ids": [first, second, "missing", other, first]},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {"deleted": [first, second], "not_found": ["missing", other]})
+
+        self.assertEqual([file.id for file in File.query.filter_by(group_id=self.group_id)], [kept])
+        self.assertIsNotNone(db.session.get(File, other))
+        group = db.session.get(Group, self.group_id)
+        db.session.refresh(group)
+        self.assertEqual((group.file_count, group.version_count, group.used_bytes), (1, 1, 4))
+        # 请求返回时存储中的文件还在，由后台删除
+        self.assertEqual(DeletedBlob.query.count(), 3)
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+
+        self.assertEqual(blob_reaper.run_once(), 3)
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+        self.assertEqual(DeletedBlob.query.count(), 0)
+        self.assertEqual(blob_reaper.run_once(), 0)
+
+    def test_reaper_retries_failures(self):
+        """测试删除失败时按退避时间重试，超过最多尝试次数后放弃"""
+        file_id = self.upload(b"data", "data.txt")
+        path = self.blob_paths(file_id)[0]
+        self.client.post(f"/file/delete/{self.group_id}/{file_id}")
+        self.assertTrue(os.path.exists(path))
+
+        with mock.patch.object(LocalStorage, "delete", side_effect=OSError("disk busy")):
+            self.assertEqual(blob_reaper.run_once(), 1)
+        blob = DeletedBlob.query.one()
+        self.assertEqual((blob.attempts, blob.last_error), (1, "disk busy"))
+        # 还没到重试时间
+        self.assertEqual(blob_reaper.run_once(), 0)
+
+        blob.next_attempt_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+        db.session.commit()
+        self.assertEqual(blob_reaper.run_once(), 1)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(DeletedBlob.query.count(), 0)
+
+        # 超过最多尝试次数后放弃
+        file_id = self.upload(b"more", "more.txt")
+        self.client.post(f"/file/delete/{self.group_id}/{file_id}")
+        self.app.config["BLOB_REAPER_MAX_ATTEMPTS"] = 1
+        with mock.patch.object(LocalStorage, "delete", side_effect=OSError("disk busy")):
+            self.assertEqual(blob_reaper.run_once(), 1)
+        self.assertEqual(DeletedBlob.query.count(), 0)
+
+    def test_batch_delete_rejected(self):
+        """测试只读小组、文件数超出上限和参数无效时拒绝删除"""
+        url = f"/file/delete_batch/{self.group_id}"
+        self.app.config["BATCH_DELETE_MAX_FILES"] = 2
+        self.assertEqual(self.client.post(url, json={"file_ids": ["a", "b", "c"]}).status_code, 400)
+        self.assertEqual(self.client.post(url, json={"file_ids": "a"}).status_code, 400)
+        self.assertEqual(self.client.post(url, data={"file_ids": ["a", "b"]}).get_json()["not_found"], ["a", "b"])
+
+        group = db.session.get(Group, self.group_id)
+        group.is_readonly = True
+        db.session.commit()
+        self.assertEqual(self.client.post(url, json={"file_ids": ["a"]}).status_code, 403)
+
+    def test_delete_file_checks_group(self):
+        """测试单个删除只能删除该小组中的文件"""
+        file_id = self.upload(b"data", "data.txt")
+        other_group = Group(name="Other")
+        db.session.add(other_group)
+        db.session.commit()
+        response = self.client.post(f"/file/delete/{other_group.id}/{file_id}")
+        self.assertEqual(response.status_code, 404)
+        self.assertIsNotNone(db.session.get(File, file_id))
+
+
+if __name__ == '__main__':
+    unittest.main()
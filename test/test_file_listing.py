@@ -0,0 +1,179 @@
+import unittest
+import uuid
+import shutil
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from app import create_app, db
+from app.models import Group, File, FileVersion
+from app.utils.usage import record_upload
+
+
+class FileListingTestCase(unittest.TestCase):
+    def setUp(self):
+        """在每个测试前设置环境"""
+        self.app = create_app('testing')
+        self.app.config["UNIFIED_PUBLIC_PASSWORD"] = None
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        group = Group(name="Listing Group")
+        db.session.add(group)
+        db.session.commit()
+        self.group_id = group.id
+        self.base_time = datetime(2024, 1, 1)
+
+    def tearDown(self):
+        """在每个测试后清理环境"""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.app.config['TEST_DATA_DIR'], ignore_errors=True)
+
+    def add_file(self, name, sizes, minutes):
+        """直接写入一个文件及其版本，sizes 和 minutes 为各版本的大小和上传时间（分钟）"""
+        file = File(
+            id=str(uuid.uuid4()),
+            group_id=self.group_id,
+            original_filename=name,
+            stored_filename=name,
+            size=sizes[0],
+            content_type="text/plain",
+            uploaded_at=self.base_time + timedelta(minutes=minutes[0]),
+        )
+        db.session.add(file)
+        for number, (size, minute) in enumerate(zip(sizes, minutes), start=1):
+            version = FileVersion(
+                id=str(uuid.uuid4()),
+                file_id=file.id,
+                version_number=number,
+                stored_filename=f"{name}.{number}",
+                size=size,
+                uploaded_at=self.base_time + timedelta(minutes=minute),
+            )
+            db.session.add(version)
+            file.latest_version_id = version.id
+            record_upload(self.group_id, size, new_file=number == 1)
+        db.session.commit()
+        return file.id
+
+    def list_all(self, **params):
+        """按游标翻完所有页，返回文件名列表和页数"""
+        names = []
+        pages = 0
+        cursor = None
+        while True:
+            query = dict(params, **({"cursor": cursor} if cursor else {}))
+            response = self.client.get(f"/group/{self.group_id}/files", query_string=query)
+            self.assertEqual(response.status_code, 200)
+            data = response.get_json()
+            names.extend(item["name"] for item in data["files"])
+            pages += 1
+            cursor = data["next_cursor"]
+            if not cursor:
+                return names, pages
+
+    def test_keyset_pagination(self):
+        """测试按文件名、大小和最新版本时间分页，排序值相同时不重复也不遗漏"""
+        for index in range(10):
+            # 大小只有两种，分页边界会落在相同的排序值上
+            self.add_file(f"file-{index:02d}.txt", [100 * (index % 2)], [index])
+        expected = [f"file-{index:02d}.txt" for index in range(10)]
+
+        names, pages = self.list_all(sort="name", limit=3)
+        self.assertEqual((names, pages), (expected, 4))
+        names, _ = self.list_all(sort="name", order="desc", limit=4)
+        self.assertEqual(names, expected[::-1])
+
+        names, _ = self.list_all(sort="size", order="desc", limit=3)
+        self.assertEqual(sorted(names), expected)
+        self.assertEqual(set(names[:5]), set(expected[1::2]))
+
+        names, _ = self.list_all(sort="uploaded_at", limit=3)
+        self.assertEqual(names, expected)
+
+    def test_latest_version_fields(self):
+        """测试按最新版本的时间和大小排序，只返回最新版本的信息"""
+        old = self.add_file("old.txt", [10, 500], [0, 30])
+        self.add_file("new.txt", [200], [20])
+
+        names, _ = self.list_all(sort="uploaded_at")
+        self.assertEqual(names, ["new.txt", "old.txt"])
+        names, _ = self.list_all(sort="size", order="desc")
+        self.assertEqual(names, ["old.txt", "new.txt"])
+
+        data = self.client.get(f"/group/{self.group_id}/files", query_string={"q": "old"}).get_json()
+        self.assertEqual(len(data["files"]), 1)
+        item = data["files"][0]
+        self.assertEqual((item["id"], item["size"], item["version_count"]), (old, 500, 2))
+        self.assertEqual(item["uploaded_at"], "2024-01-01T00:30:00+00:00")
+
+    def test_search_and_invalid_parameters(self):
+        """测试按文件名筛选（通配符按字面匹配）和无效参数"""
+        self.add_file("100%_done.txt", [1], [0])
+        self.add_file("1000_done.txt", [1], [1])
+        names, _ = self.list_all(q="0%_")
+        self.assertEqual(names, ["100%_done.txt"])
+
+        url = f"/group/{self.group_id}/files"
+        self.assertEqual(self.client.get(url, query_string={"sort": "owner"}).status_code, 400)
+        self.assertEqual(self.client.get(url, query_string={"cursor": "bad"}).status_code, 400)
+        cursor = self.client.get(url, query_string={"sort": "name", "limit": 1}).get_json()["next_cursor"]
+        response = self.client.get(url, query_string={"sort": "size", "cursor": cursor})
+        self.assertEqual(response.status_code, 400)
+
+    def test_password_protected_group(self):
+        """测试未通过小组密码验证时不能列出文件"""
+        group = db.session.get(Group, self.group_id)
+        group.set_password("secret")
+        db.session.commit()
+        response = self.client.get(f"/group/{self.group_id}/files")
+        self.assertEqual(response.status_code, 403)
+
+        with self.client.session_transaction() as session:
+            session["authenticated_groups"] = [self.group_id]
+        response = self.client.get(f"/group/{self.group_id}/files")
+        self.assertEqual(response.status_code, 200)
+
+    def test_conditional_get(self):
+        """测试内容未变化时返回304且不查询文件，上传和删除后ETag变化"""
+        file_id = self.add_file("a.txt", [1], [0])
+        page_url = f"/group/{self.group_id}"
+        list_url = f"/group/{self.group_id}/files?sort=name"
+
+        page = self.client.get(page_url)
+        listing = self.client.get(list_url)
+        for response in (page, listing):
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.headers["ETag"].startswith('W/"'))
+            self.assertIn("no-cache", response.headers["Cache-Control"])
+
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, "before_cursor_execute", listener)
+        try:
+            for url, response in ((page_url, page), (list_url, listing)):
+                cached = self.client.get(url, headers={"If-None-Match": response.headers["ETag"]})
+                self.assertEqual(cached.status_code, 304)
+                self.assertEqual(cached.data, b"")
+        finally:
+            event.remove(db.engine, "before_cursor_execute", listener)
+        self.assertTrue(statements)
+        self.assertFalse([s for s in statements if "FROM file" in s])
+
+        # 上传新文件后不再匹配
+        self.add_file("b.txt", [2], [1])
+        response = self.client.get(list_url, headers={"If-None-Match": listing.headers["ETag"]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()["files"]), 2)
+
+        # 删除文件后不再匹配
+        etag = self.client.get(page_url).headers["ETag"]
+        self.client.post(f"/file/delete/{self.group_id}/{file_id}")
+        response = self.client.get(page_url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import unittest
+import tempfile
+import os
+import shutil
+import json
+from datetime import datetime, timedelta, timezone
+from app import create_app, db
+from app.models import Group, GroupEvent
+from app.utils.group_events import group_events, publish, purge_events
+
+
+def parse_events(body):
+    """把SSE响应体解析为 [(id, 事件名, 数据)]，忽略注释和 retry 字段"""
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if "event" in fields:
+            event_id = int(fields["id"]) if "id" in fields else None
+            events.append((event_id, fields["event"], json.loads(fields["data"])))
+    return events
+
+
+class GroupEventsTestCase(unittest.TestCase):
+    def setUp(self):
+        """在每个测试前设置环境"""
+        self.app = create_app('testing')
+        self.app.config["UNIFIED_PUBLIC_PASSWORD"] = None
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        # 创建临时目录用于测试
+        self.test_upload_dir = tempfile.mkdtemp()
+        self.app.config['UPLOAD_FOLDER'] = self.test_upload_dir
+        self.client = self.app.test_client()
+
+        group = Group(name="Events Group", allow_convert_to_readonly=True)
+        db.session.add(group)
+        db.session.commit()
+        self.group_id = group.id
+        self.events_url = f"/group/{self.group_id}/events"
+
+    def tearDown(self):
+        """在每个测试后清理环境"""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.app.config['TEST_DATA_DIR'], ignore_errors=True)
+
+        # 清理临时目录
+        if os.path.exists(self.test_upload_dir):
+            shutil.rmtree(self.test_upload_dir)
+
+    def upload(self, content, filename):
+        """以原始请求体方式上传一个单分片文件"""
+        response = self.client.post(
+            f"/file/upload_raw/{self.group_id}",
+            query_string={
+                "resumableIdentifier": filename,
+                "resumableFilename": filename,
+                "resumableChunkNumber": "1",
+                "resumableTotalChunks": "1",
+                "resumableTotalSize": str(len(content)),
+                "resumableCurrentChunkSize": str(len(content)),
+            },
+            data=content,
+            content_type="application/octet-stream",
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_poll_mode(self):
+        """测试轮询模式：按 Last-Event-ID 返回之后的事件并设置重连间隔"""
+        self.assertEqual(group_events.mode, "poll")
+        page = self.client.get(f"/group/{self.group_id}")
+        self.assertIn(f'{self.events_url}?after=0'.encode(), page.data)
+
+        self.upload(b"hello", "a.txt")
+        response = self.client.get(self.events_url, query_string={"after": 0})
+        self.assertEqual(response.mimetype, "text/event-stream")
+        self.assertIn("retry: 10000", response.get_data(as_text=True))
+        events = parse_events(response.get_data(as_text=True))
+        self.assertEqual([kind for _, kind, _ in events], ["file_added"])
+        last_id, _, data = events[0]
+        self.assertEqual((data["file"]["name"], data["file"]["size"]), ("a.txt", 5))
+        self.assertEqual(data["file"]["version_count"], 1)
+        self.assertIn("/file/download/", page.data.decode())
+
+        # 其他小组的事件不会发送
+        publish("other-group", "group_readonly")
+        db.session.commit()
+        response = self.client.get(self.events_url, headers={"Last-Event-ID": str(last_id)})
+        self.assertEqual(parse_events(response.get_data(as_text=True)), [])
+
+        file_id = data["file"]["id"]
+        self.client.post(f"/file/delete/{self.group_id}/{file_id}")
+        self.client.post(f"/group/{self.group_id}/convert-to-readonly")
+        response = self.client.get(
+            self.events_url, query_string={"after": 0}, headers={"Last-Event-ID": str(last_id)}
+        )
+        events = parse_events(response.get_data(as_text=True))
+        self.assertEqual([kind for _, kind, _ in events], ["file_deleted", "group_readonly"])
+        self.assertEqual(events[0][2], {"file_id": file_id, "size": 5})
+
+    def test_missed_events_reset(self):
+        """测试需要的事件已被清理时发送 reset 事件"""
+        for _ in range(3):
+            publish(self.group_id, "group_readonly")
+        db.session.commit()
+        GroupEvent.query.update({GroupEvent.created_at: datetime.now(timezone.utc) - timedelta(hours=2)})
+        db.session.commit()
+        self.assertEqual(purge_events(60), 3)
+
+        # 删除所有事件后ID也不会重用
+        publish(self.group_id, "group_readonly")
+        db.session.commit()
+        events = parse_events(self.client.get(self.events_url, query_string={"after": 1}).get_data(as_text=True))
+        self.assertEqual([(event_id, kind) for event_id, kind, _ in events], [(4, "reset")])
+        events = parse_events(self.client.get(self.events_url, query_string={"after": 3}).get_data(as_text=True))
+        self.assertEqual([(event_id, kind) for event_id, kind, _ in events], [(4, "group_readonly")])
+
+    def test_stream_mode(self):
+        """测试推送模式：后台线程查询到事件后推送给连接，连接关闭后取消订阅"""
+        self.app.config["GROUP_EVENTS_MODE"] = "stream"
+        self.app.config["GROUP_EVENTS_POLL_SECONDS"] = 0.05
+        self.app.config["GROUP_EVENTS_STREAM_SECONDS"] = 5
+        self.upload(b"stream", "b.txt")
+
+        response = self.client.get(self.events_url, query_string={"after": 0})
+        chunks = iter(response.response)
+        try:
+            body = next(chunks).decode()
+            self.assertEqual(parse_events(body)[0][1], "file_added")
+            self.assertEqual(len(group_events._subscriptions), 1)
+        finally:
+            response.close()
+        self.assertEqual(len(group_events._subscriptions), 0)
+
+    def test_unauthorized(self):
+        """测试未通过小组密码验证时不能订阅"""
+        group = db.session.get(Group, self.group_id)
+        group.set_password("secret")
+        db.session.commit()
+        self.assertEqual(self.client.get(self.events_url).status_code, 403)
+
+
+if __name__ == '__main__':
+    unittest.main()
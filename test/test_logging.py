@@ -0,0 +1,78 @@
+import unittest
+import tempfile
+import os
+import shutil
+import logging
+from app import create_app, setup_logging, stop_log_listener
+
+
+class LoggingTestCase(unittest.TestCase):
+    def setUp(self):
+        """在每个测试前设置环境"""
+        self.app = create_app('testing')
+        self.log_dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.log_dir, 'groupbin.log')
+        self.app.config.update(LOG_LEVEL='INFO', LOG_FILE=self.log_file)
+
+    def tearDown(self):
+        """在每个测试后清理环境"""
+        self.app.config['LOG_FILE'] = None
+        setup_logging(self.app)
+        shutil.rmtree(self.log_dir, ignore_errors=True)
+        shutil.rmtree(self.app.config['TEST_DATA_DIR'], ignore_errors=True)
+
+    def _read_log(self):
+        stop_log_listener()  # 写出队列中剩余的日志
+        with open(self.log_file, encoding='utf-8') as f:
+            return f.read()
+
+    def test_log_written_once(self):
+        """测试重复配置日志后，每条日志只写入文件一次"""
+        setup_logging(self.app)
+        setup_logging(self.app)
+        groupbin_handlers = [
+            handler for handler in logging.getLogger().handlers
+            if getattr(handler, '_groupbin_handler', False)
+        ]
+        self.assertEqual(len(groupbin_handlers), 1)
+
+        self.app.logger.info('unique-log-line')
+        self.assertEqual(self._read_log().count('unique-log-line'), 1)
+
+    def test_chunk_log_sampling(self):
+        """测试分片日志按比例抽样输出"""
+        self.app.config['LOG_CHUNK_SAMPLE_RATE'] = 5
+        setup_logging(self.app)
+        for _ in range(10):
+            self.app.logger.info('sampled-chunk-line', extra={'sampled': True})
+        self.app.logger.info('normal-line')
+
+        content = self._read_log()
+        self.assertEqual(content.count('sampled-chunk-line'), 2)
+        self.assertEqual(content.count('normal-line'), 1)
+
+    def test_request_id(self):
+        """测试每个请求的ID写入日志和响应头，合法的X-Request-ID原样使用"""
+        setup_logging(self.app)
+
+        @self.app.route('/_log_request_id')
+        def log_request_id():
+            self.app.logger.warning('request-line')
+            return 'ok'
+
+        client = self.app.test_client()
+        response = client.get('/_log_request_id', headers={'X-Request-ID': 'upstream-42'})
+        self.assertEqual(response.headers['X-Request-ID'], 'upstream-42')
+        generated = client.get('/_log_request_id', headers={'X-Request-ID': 'bad id'})
+        request_id = generated.headers['X-Request-ID']
+        self.assertRegex(request_id, r'^[0-9a-f]{16}$')
+
+        self.app.logger.warning('outside-line')
+        content = self._read_log()
+        self.assertIn('[upstream-42]: request-line', content)
+        self.assertIn(f'[{request_id}]: request-line', content)
+        self.assertIn('[-]: outside-line', content)
+
+
+if __name__ == '__main__':
+    unittest.main()
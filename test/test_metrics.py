@@ -0,0 +1,113 @@
+import unittest
+import tempfile
+import os
+import json
+import shutil
+import subprocess
+import sys
+from app import create_app, db
+from app.models import Group
+from app.utils.upload_sessions import create_session, record_received
+from app.utils.metrics import metrics, CHUNK_MERGE_SECONDS, CLEANUP_PHASE_SECONDS
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        """在每个测试前设置环境"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        # 使用独立的指标目录，避免受其他进程快照影响
+        self.metrics_dir = tempfile.mkdtemp()
+        self.test_upload_dir = tempfile.mkdtemp()
+        self.app.config['UPLOAD_FOLDER'] = self.test_upload_dir
+        metrics.metrics_dir = self.metrics_dir
+        metrics._load_own_snapshot()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        """在每个测试后清理环境"""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.app.config['TEST_DATA_DIR'], ignore_errors=True)
+        shutil.rmtree(self.metrics_dir, ignore_errors=True)
+        shutil.rmtree(self.test_upload_dir, ignore_errors=True)
+
+    def test_histogram_rendering(self):
+        """测试直方图按Prometheus格式输出累计桶"""
+        CHUNK_MERGE_SECONDS.observe(0.02)
+        CHUNK_MERGE_SECONDS.observe(3)
+        text = metrics.render()
+
+        self.assertIn('# TYPE groupbin_chunk_merge_seconds histogram', text)
+        self.assertIn('groupbin_chunk_merge_seconds_bucket{le="0.025"} 1', text)
+        self.assertIn('groupbin_chunk_merge_seconds_bucket{le="5"} 2', text)
+        self.assertIn('groupbin_chunk_merge_seconds_bucket{le="+Inf"} 2', text)
+        self.assertIn('groupbin_chunk_merge_seconds_count 2', text)
+
+    def test_aggregates_across_processes(self):
+        """测试汇总其他worker进程写入的快照"""
+        CLEANUP_PHASE_SECONDS.observe(1, phase="expired_groups")
+
+        # 模拟另一个worker进程的快照文件
+        other_snapshot = [{
+            "name": "groupbin_cleanup_phase_seconds",
+            "labels": [["phase", "expired_groups"]],
+            "buckets": [0] * len(CLEANUP_PHASE_SECONDS.buckets),
+            "sum": 100.0,
+            "count": 1,
+        }]
+        with open(os.path.join(self.metrics_dir, 'metrics_999999.json'), 'w') as f:
+            json.dump(other_snapshot, f)
+
+        text = metrics.render()
+        self.assertIn('groupbin_cleanup_phase_seconds_count{phase="expired_groups"} 2', text)
+        self.assertIn('groupbin_cleanup_phase_seconds_sum{phase="expired_groups"} 101.0', text)
+
+    def test_dead_process_snapshots_folded(self):
+        """测试已退出进程的快照并入汇总文件后删除，汇总值不变"""
+        process = subprocess.Popen([sys.executable, "-c", "pass"])
+        process.wait()
+        snapshot = [{
+            "name": "groupbin_cleanup_phase_seconds",
+            "labels": [["phase", "expired_groups"]],
+            "buckets": [0] * len(CLEANUP_PHASE_SECONDS.buckets),
+            "sum": 5.0,
+            "count": 1,
+        }]
+        for name in (f'metrics_{process.pid}.json', 'metrics_dead.json'):
+            with open(os.path.join(self.metrics_dir, name), 'w') as f:
+                json.dump(snapshot, f)
+
+        for _ in range(2):
+            text = metrics.render()
+            self.assertIn('groupbin_cleanup_phase_seconds_count{phase="expired_groups"} 2', text)
+            self.assertIn('groupbin_cleanup_phase_seconds_sum{phase="expired_groups"} 10.0', text)
+        self.assertFalse(os.path.exists(os.path.join(self.metrics_dir, f'metrics_{process.pid}.json')))
+
+    def test_metrics_endpoint(self):
+        """测试/metrics接口输出请求查询数和上传会话指标"""
+        group = Group(name="Metrics Group")
+        db.session.add(group)
+        db.session.commit()
+        upload_session = create_session(
+            group.id, "resumable", "upload-1", filename="a.txt", total_size=100
+        )
+        record_received(upload_session.id, 1, 1, 10)
+
+        self.client.get('/')
+        response = self.client.get('/metrics')
+        text = response.get_data(as_text=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        self.assertIn('groupbin_db_queries_per_request_count{endpoint="main.index"} 1', text)
+        self.assertIn('groupbin_upload_sessions_active 1', text)
+        self.assertIn('groupbin_upload_received_bytes 10', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import unittest
+import tempfile
+import os
+import io
+import shutil
+import tarfile
+import zipfile
+from app import create_app, db
+from app.models import Group, FileVersion
+from app.utils.previews import previews
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class PreviewTestCase(unittest.TestCase):
+    def setUp(self):
+        """在每个测试前设置环境"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        # 创建临时目录用于测试
+        self.test_upload_dir = tempfile.mkdtemp()
+        self.app.config['UPLOAD_FOLDER'] = self.test_upload_dir
+        self.app.config['PREVIEW_DIR'] = os.path.join(self.test_upload_dir, "previews")
+        self.app.config['PREVIEW_ENABLED'] = True
+        self.client = self.app.test_client()
+
+        group = Group(name="Preview Group")
+        db.session.add(group)
+        db.session.commit()
+        self.group_id = group.id
+
+    def tearDown(self):
+        """在每个测试后清理环境"""
+        previews.wait(timeout=10)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.app.config['TEST_DATA_DIR'], ignore_errors=True)
+        shutil.rmtree(self.test_upload_dir, ignore_errors=True)
+
+    def upload(self, content, filename):
+        response = self.client.post(
+            f"/file/upload_raw/{self.group_id}",
+            query_string={
+                "resumableIdentifier": filename,
+                "resumableFilename": filename,
+                "resumableChunkNumber": "1",
+                "resumableTotalChunks": "1",
+                "resumableTotalSize": str(len(content)),
+                "resumableCurrentChunkSize": str(len(content)),
+            },
+            data=content,
+            content_type="application/octet-stream",
+        )
+        return FileVersion.query.filter_by(file_id=response.get_json()["file_id"]).one()
+
+    def get_preview(self, version):
+        previews.wait(timeout=10)
+        response = self.client.get(f"/file/preview/{self.group_id}/{version.id}")
+        data = response.get_json()
+        response.close()
+        return response.status_code, data
+
+    def test_previews_generated_after_upload(self):
+        """测试上传提交后在后台生成文本、压缩包预览"""
+        text = "第一行\n" + "x" * 2000
+        status, preview = self.get_preview(self.upload(text.encode("utf-8"), "readme.txt"))
+        self.assertEqual(status, 200)
+        self.assertEqual(preview["kind"], "text")
+        self.assertTrue(preview["truncated"])
+        self.assertTrue(preview["text"].startswith("第一行"))
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as zf:
+            zf.writestr("a.txt", "a")
+            zf.writestr("dir/b.txt", "bb")
+        status, preview = self.get_preview(self.upload(buffer.getvalue(), "bundle.zip"))
+        self.assertEqual(preview["kind"], "archive")
+        self.assertEqual([entry["name"] for entry in preview["entries"]], ["a.txt", "dir/b.txt"])
+
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w:gz") as tf:
+            info = tarfile.TarInfo("data.csv")
+            info.size = 3
+            tf.addfile(info, io.BytesIO(b"1,2"))
+        status, preview = self.get_preview(self.upload(buffer.getvalue(), "data.tar.gz"))
+        self.assertEqual(preview["entries"], [{"name": "data.csv", "size": 3}])
+
+        status, preview = self.get_preview(self.upload(b"\x00\x01\x02binary", "blob.bin"))
+        self.assertEqual(preview, {"kind": "none"})
+
+    @unittest.skipIf(Image is None, "需要安装Pillow")
+    def test_image_thumbnail(self):
+        """测试为图片生成缩略图"""
+        buffer = io.BytesIO()
+        Image.new("RGB", (1024, 512), "red").save(buffer, "JPEG")
+        version = self.upload(buffer.getvalue(), "photo.jpg")
+        status, preview = self.get_preview(version)
+        self.assertEqual(preview["kind"], "image")
+
+        response = self.client.get(preview["url"])
+        with Image.open(io.BytesIO(response.get_data())) as thumbnail:
+            self.assertEqual(thumbnail.size, (256, 128))
+        response.close()
+
+    def test_generated_on_demand(self):
+        """测试没有预览时（被淘汰或启用前上传）请求预览会按需生成"""
+        version = self.upload(b"hello", "hello.txt")
+        previews.wait(timeout=10)
+        previews.delete([version.id])
+
+        response = self.client.get(f"/file/preview/{self.group_id}/{version.id}")
+        self.assertEqual(response.status_code, 202)
+        status, preview = self.get_preview(version)
+        self.assertEqual((status, preview["text"]), (200, "hello"))
+
+        response = self.client.get(f"/file/preview/other-group/{version.id}")
+        self.assertEqual(response.status_code, 404)
+
+    def test_lru_eviction(self):
+        """测试预览目录超过大小上限时淘汰最久未使用的预览"""
+        self.app.config['PREVIEW_MAX_MB'] = 150
+        first = self.upload(b"a" * 100, "a.txt")
+        previews.wait(timeout=10)
+        second = self.upload(b"b" * 100, "b.txt")
+        previews.wait(timeout=10)
+        self.assertIsNone(previews.find(first.id))
+        self.assertIsNotNone(previews.find(second.id))
+
+    def test_rollback_does_not_schedule(self):
+        """测试上传事务回滚时不生成预览"""
+        from app.utils.file_handling import handle_file_upload, UploadedFile
+
+        path = os.path.join(self.test_upload_dir, "upload.txt")
+        with open(path, "wb") as f:
+            f.write(b"rolled back")
+        version_id = handle_file_upload(
+            self.group_id, UploadedFile(path, "upload.txt"), self.test_upload_dir
+        ).versions[0].id
+        db.session.rollback()
+        previews.wait(timeout=10)
+        self.assertIsNone(previews.find(version_id))
+
+
+if __name__ == '__main__':
+    unittest.main()
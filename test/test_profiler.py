@@ -0,0 +1,78 @@
+import unittest
+import tempfile
+import shutil
+from app import create_app, db
+from app.models import Group
+from app.utils.profiler import profiler
+
+
+class ProfilerTestCase(unittest.TestCase):
+    def setUp(self):
+        """在每个测试前设置环境"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        # 启用剖析并使用临时目录，所有请求都会被抽样
+        self.profile_dir = tempfile.mkdtemp()
+        self.app.config.update(
+            PROFILER_ENABLED=True,
+            PROFILER_SAMPLE_RATE=1.0,
+            PROFILER_DIR=self.profile_dir,
+            PROFILER_MAX_ENTRIES=3,
+            ADMIN_PASSWORD='admin-psw',
+        )
+        profiler.init_app(self.app)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        """在每个测试后清理环境"""
+        profiler.enabled = False
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.app.config['TEST_DATA_DIR'], ignore_errors=True)
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+    def test_sampled_request_is_recorded(self):
+        """测试抽样请求记录了分阶段耗时、SQL和cProfile摘要"""
+        group = Group(name="Profiled Group")
+        db.session.add(group)
+        db.session.commit()
+        group_id = group.id
+        db.session.remove()
+
+        self.client.get(f'/group/{group_id}')
+
+        entry_ids = profiler.list_entry_ids()
+        self.assertEqual(len(entry_ids), 1)
+        entry = profiler.load_entry(entry_ids[0])
+        self.assertTrue(entry['sampled'])
+        self.assertEqual(entry['endpoint'], 'group.view')
+        self.assertIn('db', entry['phases_ms'])
+        self.assertIn('template', entry['phases_ms'])
+        self.assertGreater(entry['statement_count'], 0)
+        self.assertIn('function calls', entry['summary'])
+
+    def test_ring_is_bounded(self):
+        """测试记录数不超过PROFILER_MAX_ENTRIES"""
+        for _ in range(5):
+            self.client.get('/')
+        self.assertEqual(len(profiler.list_entry_ids()), 3)
+
+    def test_admin_listing_requires_password(self):
+        """测试管理页面需要密码验证"""
+        self.client.get('/')
+        response = self.client.get('/admin/profiles')
+        self.assertIn('管理员验证', response.get_data(as_text=True))
+
+        response = self.client.post(
+            '/admin/profiles', data={'password': 'admin-psw'}, follow_redirects=True
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('请求剖析记录', response.get_data(as_text=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import tempfile
+import os
+import shutil
+from unittest import mock
+from sqlalchemy import create_engine, text
+import app as app_module
+from app import create_app, db, init_worker
+from config import TestingConfig
+from app.utils.schema import ensure_schema, stamp_schema
+
+
+class StartupTestCase(unittest.TestCase):
+    def setUp(self):
+        """在每个测试前设置环境"""
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """在每个测试后清理环境"""
+        app_module.preloaded_app = None
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+        shutil.rmtree(TestingConfig.TEST_DATA_DIR, ignore_errors=True)
+
+    def test_schema_checked_once(self):
+        """测试模型结构没有变化时跳过建表和补列"""
+        engine = create_engine(f"sqlite:///{os.path.join(self.test_dir, 'stamp.db')}")
+        # 旧版本创建的数据库：有表但缺少新增的列，也没有指纹表
+        with engine.begin() as conn:
+            conn.execute(text('CREATE TABLE "group" (id VARCHAR(36) PRIMARY KEY, name VARCHAR(100))'))
+
+        added = ensure_schema(engine, db.metadata)
+        self.assertIn("group.used_bytes", added)
+        # 记录指纹之前（如整理数据失败）下次仍会检查
+        self.assertEqual(ensure_schema(engine, db.metadata), [])
+        stamp_schema(engine, db.metadata)
+        self.assertIsNone(ensure_schema(engine, db.metadata))
+
+        # 指纹不一致（部署了新的模型）时重新检查
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE schema_stamp SET fingerprint = 'old'"))
+        self.assertEqual(ensure_schema(engine, db.metadata), [])
+        stamp_schema(engine, db.metadata)
+        self.assertIsNone(ensure_schema(engine, db.metadata))
+        engine.dispose()
+
+    def test_schema_stamped_after_data_fixups(self):
+        """测试补版本号失败时不记录指纹，下次启动重新执行"""
+        uri = f"sqlite:///{os.path.join(self.test_dir, 'boot.db')}"
+        with mock.patch.object(TestingConfig, "SQLALCHEMY_DATABASE_URI", uri):
+            with mock.patch(
+                "app.utils.file_handling.backfill_version_numbers", side_effect=RuntimeError("boom")
+            ):
+                with self.assertRaises(RuntimeError):
+                    create_app('testing')
+            with mock.patch("app.utils.file_handling.backfill_version_numbers") as backfill:
+                create_app('testing')
+                create_app('testing')
+        self.assertEqual(backfill.call_count, 1)
+
+    def test_boot_timing(self):
+        """测试记录启动各阶段耗时"""
+        app = create_app('testing')
+        timing = app.extensions["boot_timing"]
+        self.assertIn("schema", timing["phases"])
+        self.assertIn("blueprints", timing["phases"])
+        self.assertGreaterEqual(timing["total_ms"], sum(timing["phases"].values()) - 1)
+
+    def test_preload_defers_background_tasks(self):
+        """测试预加载时后台任务推迟到worker中启动，并预编译模板"""
+        with mock.patch.object(TestingConfig, "PRELOAD_APP", True), \
+                mock.patch.object(TestingConfig, "CLEAN_INTERVAL_HOUR", 1):
+            app = create_app('testing')
+        self.assertIs(app_module.preloaded_app, app)
+        self.assertIn("templates", app.extensions["boot_timing"]["phases"])
+        self.assertIsNone(app_module.cleanup_task.thread)
+
+        init_worker()
+        try:
+            self.assertTrue(app_module.cleanup_task.thread.is_alive())
+        finally:
+            app_module.cleanup_task.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
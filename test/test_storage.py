@@ -0,0 +1,130 @@
+import unittest
+import tempfile
+import os
+import shutil
+from io import BytesIO
+from app import create_app, db
+from app.models import Group, FileVersion
+from app.utils.storage import S3Storage, S3_MIN_PART_SIZE, check_storage_config, get_storage
+
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:
+    boto3 = None
+
+
+class LocalStorageTestCase(unittest.TestCase):
+    def setUp(self):
+        """在每个测试前设置环境"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.test_upload_dir = tempfile.mkdtemp()
+        self.app.config['UPLOAD_FOLDER'] = self.test_upload_dir
+
+    def tearDown(self):
+        """在每个测试后清理环境"""
+        self.app_context.pop()
+        shutil.rmtree(self.app.config['TEST_DATA_DIR'], ignore_errors=True)
+        shutil.rmtree(self.test_upload_dir, ignore_errors=True)
+
+    def test_local_backend(self):
+        """测试本地存储后端的写入、范围读取、列出和删除"""
+        storage = get_storage()
+        self.assertFalse(storage.supports_multipart)
+        self.assertEqual(storage.put_stream("group", "blob.bin", BytesIO(b"0123456789")), 10)
+
+        self.assertEqual(b"".join(storage.iter_range("group", "blob.bin", 2, 5)), b"2345")
+        self.assertEqual(storage.list("group"), ["blob.bin"])
+        self.assertEqual(
+            storage.local_path("group", "blob.bin"),
+            os.path.join(self.test_upload_dir, "group", "blob.bin"),
+        )
+
+        storage.delete("group", "blob.bin")
+        self.assertFalse(storage.exists("group", "blob.bin"))
+
+    def test_s3_chunk_size_checked(self):
+        """测试使用S3时分片大小小于最小分段大小在启动时报错"""
+        config = dict(self.app.config, STORAGE_BACKEND="s3", CHUNK_SIZE=S3_MIN_PART_SIZE - 1)
+        with self.assertRaises(ValueError):
+            check_storage_config(config)
+        check_storage_config(dict(config, CHUNK_SIZE=S3_MIN_PART_SIZE))
+        check_storage_config(dict(config, STORAGE_BACKEND="local"))
+
+
+@unittest.skipIf(boto3 is None, "需要安装boto3和moto")
+class S3StorageTestCase(unittest.TestCase):
+    def setUp(self):
+        """在每个测试前设置环境，使用moto模拟的S3"""
+        self.mock = mock_aws()
+        self.mock.start()
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="groupbin-test")
+
+        self.app = create_app('testing')
+        self.app.config.update(STORAGE_BACKEND="s3", DOWNLOAD_PRESIGNED=False)
+        self.app.extensions["groupbin_storage"] = S3Storage("groupbin-test", client=client)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.test_upload_dir = tempfile.mkdtemp()
+        self.app.config['UPLOAD_FOLDER'] = self.test_upload_dir
+        self.client = self.app.test_client()
+
+        group = Group(name="S3 Group")
+        db.session.add(group)
+        db.session.commit()
+        self.group_id = group.id
+
+    def tearDown(self):
+        """在每个测试后清理环境"""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.app.config['TEST_DATA_DIR'], ignore_errors=True)
+        self.mock.stop()
+        shutil.rmtree(self.test_upload_dir, ignore_errors=True)
+
+    def test_chunks_upload_as_multipart_parts(self):
+        """测试分片作为分段上传到S3，下载支持Range和预签名重定向"""
+        # S3除最后一段外的分段不能小于5MB
+        part_size = 5 * 1024 * 1024
+        content = os.urandom(part_size + 1000)
+        chunks = [content[:part_size], content[part_size:]]
+        for number, chunk in enumerate(chunks, 1):
+            response = self.client.post(
+                f"/file/upload_raw/{self.group_id}",
+                query_string={
+                    "resumableIdentifier": "s3-upload",
+                    "resumableFilename": "test.bin",
+                    "resumableChunkNumber": str(number),
+                    "resumableTotalChunks": "2",
+                    "resumableTotalSize": str(len(content)),
+                    "resumableCurrentChunkSize": str(len(chunk)),
+                },
+                data=chunk,
+                content_type="application/octet-stream",
+            )
+            self.assertEqual(response.status_code, 200)
+
+        version = FileVersion.query.first()
+        self.assertEqual(version.size, len(content))
+        # 本地没有合并文件，临时目录已清理
+        self.assertEqual(os.listdir(os.path.join(self.test_upload_dir, "tmp")), [])
+
+        url = f"/file/{self.group_id}/{version.file_id}/version/{version.id}"
+        response = self.client.get(url, headers={"Range": "bytes=10-19"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, content[10:20])
+
+        self.app.config["DOWNLOAD_PRESIGNED"] = True
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(version.stored_filename, response.headers["Location"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import unittest
+import tempfile
+import os
+import time
+import shutil
+from app import create_app, db
+from app.models import Group, FileVersion
+from app.utils.cleanup import CleanupTask
+from app.utils.storage_layout import StorageLayout
+
+
+class StorageLayoutTestCase(unittest.TestCase):
+    def setUp(self):
+        """在每个测试前设置环境"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        # 创建临时目录用于测试
+        self.test_upload_dir = tempfile.mkdtemp()
+        self.app.config['UPLOAD_FOLDER'] = self.test_upload_dir
+        self.client = self.app.test_client()
+
+        group = Group(name="Layout Group")
+        db.session.add(group)
+        db.session.commit()
+        self.group_id = group.id
+
+    def tearDown(self):
+        """在每个测试后清理环境"""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.app.config['TEST_DATA_DIR'], ignore_errors=True)
+
+        # 清理临时目录
+        if os.path.exists(self.test_upload_dir):
+            shutil.rmtree(self.test_upload_dir)
+
+    def use_layout(self, levels, blob_levels):
+        self.app.config['STORAGE_FANOUT_LEVELS'] = levels
+        self.app.config['STORAGE_BLOB_FANOUT_LEVELS'] = blob_levels
+        return StorageLayout.from_config(self.app.config)
+
+    def upload(self, content):
+        params = {
+            "resumableIdentifier": "layout-upload",
+            "resumableFilename": "test.txt",
+            "resumableChunkNumber": "1",
+            "resumableTotalChunks": "1",
+            "resumableTotalSize": str(len(content)),
+            "resumableCurrentChunkSize": str(len(content)),
+        }
+        response = self.client.post(
+            f"/file/upload_raw/{self.group_id}",
+            query_string=params,
+            data=content,
+            content_type="application/octet-stream",
+        )
+        file_id = response.get_json()["file_id"]
+        return FileVersion.query.filter_by(file_id=file_id).first()
+
+    def download(self, version):
+        response = self.client.get(f"/file/{self.group_id}/{version.file_id}/version/{version.id}")
+        data = response.get_data()
+        response.close()
+        return data
+
+    def test_sharded_upload_and_download(self):
+        """测试分层布局下文件写入哈希子目录并可以下载"""
+        layout = self.use_layout(2, 1)
+        version = self.upload(b"sharded")
+
+        path = layout.blob_path(self.group_id, version.stored_filename)
+        relative = os.path.relpath(path, self.test_upload_dir).split(os.sep)
+        self.assertEqual(len(relative), 5)  # ab/cd/<group_id>/ef/<stored_filename>
+        self.assertEqual(relative[2], self.group_id)
+        self.assertFalse(os.path.exists(os.path.join(self.test_upload_dir, self.group_id)))
+        self.assertEqual(self.download(version), b"sharded")
+
+    def test_migrate_flat_to_sharded(self):
+        """测试迁移旧布局的数据，迁移前后都能正常下载"""
+        self.use_layout(0, 0)
+        version = self.upload(b"legacy")
+        legacy_path = os.path.join(self.test_upload_dir, self.group_id, version.stored_filename)
+        self.assertTrue(os.path.exists(legacy_path))
+
+        # 切换布局后，未迁移的文件通过旧位置找到
+        layout = self.use_layout(2, 1)
+        self.assertEqual(self.download(version), b"legacy")
+
+        moved, groups = layout.migrate()
+        self.assertEqual((moved, groups), (1, 1))
+        self.assertFalse(os.path.exists(os.path.join(self.test_upload_dir, self.group_id)))
+        self.assertEqual(layout.group_dirs(self.group_id), [layout.group_dir_path(self.group_id)])
+        self.assertEqual(self.download(version), b"legacy")
+
+        # 再次执行不会移动任何文件
+        self.assertEqual(layout.migrate(), (0, 1))
+
+    def test_cleanup_sharded_layout(self):
+        """测试清理任务识别分层目录中的孤立小组目录和过期上传会话"""
+        layout = self.use_layout(2, 0)
+        os.makedirs(layout.group_dir_path(self.group_id))
+        orphan_dir = layout.group_dir_path("orphan-group")
+        os.makedirs(orphan_dir)
+
+        stale_session = layout.chunk_dir("stale-upload")
+        active_session = layout.chunk_dir("active-upload")
+        os.makedirs(stale_session)
+        os.makedirs(active_session)
+        old = time.time() - (self.app.config['TEMP_FILE_EXPIRATION_HOURS'] + 1) * 3600
+        os.utime(stale_session, (old, old))
+
+        CleanupTask(self.app)._cleanup_orphaned_files_on_disk()
+
+        self.assertTrue(os.path.isdir(layout.group_dir_path(self.group_id)))
+        self.assertFalse(os.path.exists(orphan_dir))
+        self.assertFalse(os.path.exists(stale_session))
+        self.assertTrue(os.path.isdir(active_session))
+
+
+if __name__ == '__main__':
+    unittest.main()
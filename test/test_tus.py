@@ -0,0 +1,168 @@
+import unittest
+import tempfile
+import os
+import shutil
+import base64
+from app import create_app, db
+from app.models import Group, File, FileVersion, UploadSession
+from app.routes.tus import try_lock
+from app.utils.upload_sessions import session_dir
+
+TUS_HEADERS = {"Tus-Resumable": "1.0.0"}
+
+
+class TusUploadTestCase(unittest.TestCase):
+    def setUp(self):
+        """在每个测试前设置环境"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        # 创建临时目录用于测试
+        self.test_upload_dir = tempfile.mkdtemp()
+        self.app.config['UPLOAD_FOLDER'] = self.test_upload_dir
+        self.client = self.app.test_client()
+
+        group = Group(name="Tus Group")
+        db.session.add(group)
+        db.session.commit()
+        self.group_id = group.id
+
+    def tearDown(self):
+        """在每个测试后清理环境"""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.app.config['TEST_DATA_DIR'], ignore_errors=True)
+
+        # 清理临时目录
+        if os.path.exists(self.test_upload_dir):
+            shutil.rmtree(self.test_upload_dir)
+
+    def create_upload(self, length, filename="tus.bin"):
+        metadata = "filename " + base64.b64encode(filename.encode()).decode()
+        response = self.client.post(
+            f"/file/tus/{self.group_id}",
+            headers=dict(TUS_HEADERS, **{"Upload-Length": str(length), "Upload-Metadata": metadata}),
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.headers["Location"]
+
+    def patch(self, location, offset, data):
+        return self.client.patch(
+            location,
+            data=data,
+            headers=dict(TUS_HEADERS, **{"Upload-Offset": str(offset)}),
+            content_type="application/offset+octet-stream",
+        )
+
+    def test_resume_and_complete(self):
+        """测试分两次PATCH上传，中途用HEAD查询偏移量，完成后创建文件记录"""
+        content = os.urandom(3000)
+        location = self.create_upload(len(content))
+
+        response = self.patch(location, 0, content[:1200])
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response.headers["Upload-Offset"], "1200")
+        self.assertEqual(File.query.count(), 0)
+
+        response = self.client.head(location, headers=TUS_HEADERS)
+        self.assertEqual(response.headers["Upload-Offset"], "1200")
+        self.assertEqual(response.headers["Upload-Length"], "3000")
+
+        response = self.patch(location, 1200, content[1200:])
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response.headers["Upload-Offset"], "3000")
+
+        file = File.query.filter_by(group_id=self.group_id).first()
+        self.assertEqual(file.original_filename, "tus.bin")
+        self.assertEqual(response.headers["X-GroupBin-File-Id"], file.id)
+        version = FileVersion.query.filter_by(file_id=file.id).first()
+        with open(os.path.join(self.test_upload_dir, self.group_id, version.stored_filename), "rb") as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(os.listdir(os.path.join(self.test_upload_dir, "tmp")), [])
+
+    def test_offset_mismatch(self):
+        """测试偏移量不一致时返回409且不写入数据"""
+        location = self.create_upload(100)
+        response = self.patch(location, 10, b"x" * 10)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.headers["Upload-Offset"], "0")
+
+    def test_patch_too_long(self):
+        """测试PATCH超出声明长度时丢弃整个请求体，偏移量不变"""
+        content = os.urandom(100)
+        location = self.create_upload(len(content))
+        self.assertEqual(self.patch(location, 0, content[:40]).status_code, 204)
+        response = self.patch(location, 40, content[40:] + b"extra")
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.headers["Upload-Offset"], "40")
+        self.assertEqual(self.client.head(location, headers=TUS_HEADERS).headers["Upload-Offset"], "40")
+
+        response = self.patch(location, 40, content[40:])
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(File.query.filter_by(group_id=self.group_id).count(), 1)
+
+    def test_patch_lock(self):
+        """测试同一上传同时只有一个PATCH写入，进程退出后遗留的锁文件不影响上传"""
+        content = os.urandom(100)
+        location = self.create_upload(len(content))
+        lock_path = os.path.join(session_dir(location.rsplit("/", 1)[1]), "patch.lock")
+
+        lock_fd = os.open(lock_path, os.O_CREAT | os.O_WRONLY)
+        try:
+            self.assertTrue(try_lock(lock_fd))
+            self.assertEqual(self.patch(location, 0, content).status_code, 423)
+        finally:
+            os.close(lock_fd)
+        # 锁文件还在，但没有进程持有锁
+        self.assertTrue(os.path.exists(lock_path))
+        self.assertEqual(self.patch(location, 0, content).status_code, 204)
+
+    def test_missing_upload_dir(self):
+        """测试上传会话的临时目录不存在时返回404并删除会话"""
+        location = self.create_upload(10)
+        upload_id = location.rsplit("/", 1)[1]
+        shutil.rmtree(session_dir(upload_id))
+        self.assertEqual(self.patch(location, 0, b"x" * 10).status_code, 404)
+        self.assertEqual(self.client.head(location, headers=TUS_HEADERS).status_code, 404)
+
+        location = self.create_upload(10)
+        shutil.rmtree(session_dir(location.rsplit("/", 1)[1]))
+        response = self.client.head(location, headers=TUS_HEADERS)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(UploadSession.query.count(), 0)
+
+    def test_cors_expose_headers(self):
+        """测试跨域请求可以读取tus响应头"""
+        location = self.create_upload(10)
+        response = self.client.head(location, headers=dict(TUS_HEADERS, Origin="https://example.com"))
+        exposed = response.headers["Access-Control-Expose-Headers"].lower()
+        for header in ("location", "upload-offset", "upload-length", "tus-resumable"):
+            self.assertIn(header, exposed)
+
+    def test_requires_tus_version(self):
+        """测试缺少Tus-Resumable头时返回412"""
+        response = self.client.post(f"/file/tus/{self.group_id}", headers={"Upload-Length": "10"})
+        self.assertEqual(response.status_code, 412)
+
+    def test_csrf_exempt(self):
+        """测试启用CSRF保护时tus客户端不需要CSRF令牌"""
+        self.app.config["WTF_CSRF_ENABLED"] = True
+        content = os.urandom(100)
+        location = self.create_upload(len(content))
+        self.assertEqual(self.patch(location, 0, content).status_code, 204)
+        self.assertEqual(File.query.filter_by(group_id=self.group_id).count(), 1)
+
+    def test_terminate(self):
+        """测试终止上传后删除临时数据"""
+        location = self.create_upload(100)
+        response = self.client.delete(location, headers=TUS_HEADERS)
+        self.assertEqual(response.status_code, 204)
+        response = self.client.head(location, headers=TUS_HEADERS)
+        self.assertEqual(response.status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,250 @@
+import unittest
+import tempfile
+import os
+import shutil
+from io import BytesIO
+from app import create_app, db
+from app.models import Group, File, FileVersion, UploadSession
+from app.utils.file_handling import backfill_version_numbers
+from app.utils.upload_advice import advise_upload
+
+
+class UploadTestCase(unittest.TestCase):
+    def setUp(self):
+        """在每个测试前设置环境"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        # 创建临时目录用于测试
+        self.test_upload_dir = tempfile.mkdtemp()
+        self.app.config['UPLOAD_FOLDER'] = self.test_upload_dir
+        self.client = self.app.test_client()
+
+        group = Group(name="Upload Group")
+        db.session.add(group)
+        db.session.commit()
+        self.group_id = group.id
+
+    def tearDown(self):
+        """在每个测试后清理环境"""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.app.config['TEST_DATA_DIR'], ignore_errors=True)
+
+        # 清理临时目录
+        if os.path.exists(self.test_upload_dir):
+            shutil.rmtree(self.test_upload_dir)
+
+    def _chunk_params(self, identifier, chunk_number, chunks, total_size, filename="test.txt"):
+        return {
+            "resumableIdentifier": identifier,
+            "resumableFilename": filename,
+            "resumableChunkNumber": str(chunk_number),
+            "resumableTotalChunks": str(len(chunks)),
+            "resumableTotalSize": str(total_size),
+            "resumableCurrentChunkSize": str(len(chunks[chunk_number - 1])),
+        }
+
+    def upload_multipart(self, content, chunk_size, identifier="multipart-upload"):
+        """以multipart表单方式逐个上传分片，返回最后一个响应"""
+        chunks = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)]
+        response = None
+        for number in range(1, len(chunks) + 1):
+            data = self._chunk_params(identifier, number, chunks, len(content))
+            data["file"] = (BytesIO(chunks[number - 1]), "blob")
+            response = self.client.post(f"/file/upload/{self.group_id}", data=data)
+        return response
+
+    def upload_raw(self, content, chunk_size, identifier="raw-upload"):
+        """以原始请求体方式逐个上传分片，返回最后一个响应"""
+        chunks = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)]
+        response = None
+        for number in range(1, len(chunks) + 1):
+            response = self.client.post(
+                f"/file/upload_raw/{self.group_id}",
+                query_string=self._chunk_params(identifier, number, chunks, len(content)),
+                data=chunks[number - 1],
+                content_type="application/octet-stream",
+            )
+        return response
+
+    def _stored_content(self, file_id):
+        version = FileVersion.query.filter_by(file_id=file_id).first()
+        path = os.path.join(self.test_upload_dir, self.group_id, version.stored_filename)
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_multipart_chunk_upload(self):
+        """测试multipart分片上传并合并"""
+        content = os.urandom(2500)
+        response = self.upload_multipart(content, 1000)
+
+        self.assertEqual(response.status_code, 200)
+        file_id = response.get_json()["file_id"]
+        self.assertEqual(self._stored_content(file_id), content)
+
+    def test_raw_body_chunk_upload(self):
+        """测试原始请求体分片上传并合并"""
+        content = os.urandom(2500)
+        response = self.upload_raw(content, 1000)
+
+        self.assertEqual(response.status_code, 200)
+        file_id = response.get_json()["file_id"]
+        self.assertEqual(File.query.get(file_id).size, len(content))
+        self.assertEqual(self._stored_content(file_id), content)
+
+    def test_raw_body_size_mismatch(self):
+        """测试原始请求体大小与声明不一致时拒绝分片"""
+        params = {
+            "resumableIdentifier": "mismatch",
+            "resumableFilename": "test.txt",
+            "resumableChunkNumber": "2",
+            "resumableTotalChunks": "3",
+            "resumableTotalSize": "3000",
+            "resumableCurrentChunkSize": "1000",
+        }
+        response = self.client.post(
+            f"/file/upload_raw/{self.group_id}",
+            query_string=params,
+            data=b"x" * 1500,
+            content_type="application/octet-stream",
+        )
+
+        self.assertEqual(response.status_code, 400)
+        upload_session = UploadSession.query.filter_by(identifier="mismatch").one()
+        self.assertEqual(upload_session.received, "")
+        chunk_dir = os.path.join(self.test_upload_dir, "tmp", upload_session.id)
+        self.assertEqual(os.listdir(chunk_dir), [])
+
+    def test_upload_session_scoped_per_group(self):
+        """测试上传会话记录已接收的分片，相同的标识在不同小组中互不影响"""
+        other = Group(name="Other Group")
+        db.session.add(other)
+        db.session.commit()
+        other_id = other.id
+
+        content = os.urandom(3000)
+        chunks = [content[i:i + 1000] for i in range(0, 3000, 1000)]
+        for number in (1, 3):
+            response = self.client.post(
+                f"/file/upload_raw/{self.group_id}",
+                query_string=self._chunk_params("same-id", number, chunks, len(content)),
+                data=chunks[number - 1],
+                content_type="application/octet-stream",
+            )
+            self.assertEqual(response.status_code, 200)
+
+        upload_session = UploadSession.query.filter_by(group_id=self.group_id).one()
+        self.assertEqual(upload_session.received, "1,3")
+        self.assertEqual(upload_session.received_bytes, 2000)
+        self.assertEqual(upload_session.total_chunks, 3)
+
+        check = {"resumableIdentifier": "same-id", "resumableChunkNumber": "3"}
+        response = self.client.get(f"/file/upload/{self.group_id}", query_string=check)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(f"/file/upload/{other_id}", query_string=check)
+        self.assertEqual(response.status_code, 204)
+
+        # 另一个小组使用相同的标识上传完整文件，不会用到本小组的分片
+        other_content = os.urandom(1000)
+        response = self.client.post(
+            f"/file/upload_raw/{other_id}",
+            query_string=self._chunk_params("same-id", 1, [other_content], 1000),
+            data=other_content,
+            content_type="application/octet-stream",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(File.query.filter_by(group_id=other_id).one().size, 1000)
+
+        # 补齐缺少的分片后完成上传，会话记录随文件记录一起删除
+        response = self.client.post(
+            f"/file/upload_raw/{self.group_id}",
+            query_string=self._chunk_params("same-id", 2, chunks, len(content)),
+            data=chunks[1],
+            content_type="application/octet-stream",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._stored_content(response.get_json()["file_id"]), content)
+        self.assertEqual(UploadSession.query.count(), 0)
+        self.assertEqual(os.listdir(os.path.join(self.test_upload_dir, "tmp")), [])
+
+    def upload_version(self, file_id, content, identifier):
+        chunks = [content]
+        return self.client.post(
+            f"/file/upload_version_raw/{self.group_id}/{file_id}",
+            query_string=self._chunk_params(identifier, 1, chunks, len(content), "report.txt"),
+            data=content,
+            content_type="application/octet-stream",
+        )
+
+    def test_version_numbers(self):
+        """测试上传时为版本编号并更新最新版本"""
+        file_id = self.upload_raw(b"v1", 1000, "version-1").get_json()["file_id"]
+        self.assertEqual(self.upload_version(file_id, b"v2", "version-2").status_code, 200)
+        self.assertEqual(self.upload_version(file_id, b"v3", "version-3").status_code, 200)
+
+        file = File.query.get(file_id)
+        self.assertEqual([v.version_number for v in file.versions], [1, 2, 3])
+        self.assertEqual(file.latest_version_id, file.versions[-1].id)
+        self.assertEqual(file.latest_version.size, 2)
+
+        # 下载最新版本，旧版本的文件名带版本号
+        response = self.client.get(f"/file/download/{self.group_id}/{file_id}")
+        self.assertIn(file.latest_version_id, response.headers["Location"])
+        response = self.client.get(
+            f"/file/{self.group_id}/{file_id}/version/{file.versions[1].id}"
+        )
+        self.assertIn("test_v2.txt", response.headers["Content-Disposition"])
+        self.assertEqual(response.data, b"v2")
+        response.close()
+
+        # 小组页面显示最新版本的大小和版本数
+        self.app.config["UNIFIED_PUBLIC_PASSWORD"] = None
+        response = self.client.get(f"/group/{self.group_id}")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"test.txt", response.data)
+        self.assertIn(b'"version_count": 3', response.data)
+
+    def test_backfill_version_numbers(self):
+        """测试为添加版本号之前的数据按上传时间编号"""
+        file_id = self.upload_raw(b"v1", 1000, "version-1").get_json()["file_id"]
+        self.upload_version(file_id, b"v2", "version-2")
+        self.upload_version(file_id, b"v3", "version-3")
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql("DROP INDEX ix_file_version_number")
+            conn.exec_driver_sql("UPDATE file_version SET version_number = 0")
+            conn.exec_driver_sql("UPDATE file SET latest_version_id = NULL")
+        db.session.expire_all()
+
+        self.assertEqual(backfill_version_numbers(), 3)
+        file = File.query.get(file_id)
+        self.assertEqual([v.size for v in file.versions], [2, 2, 2])
+        self.assertEqual([v.version_number for v in file.versions], [1, 2, 3])
+        self.assertEqual(file.latest_version.version_number, 3)
+        self.assertEqual(backfill_version_numbers(), 0)
+
+    def test_upload_advice(self):
+        """测试按文件大小和服务端负载建议分片大小和并发数"""
+        config = self.app.config
+        mb = 1024 * 1024
+        response = self.client.get(
+            "/file/upload_advice", query_string={"size": [100, 1000 * mb]}
+        )
+        small, large = response.get_json()["files"]
+
+        self.assertEqual(small["chunkSize"], config["UPLOAD_MIN_CHUNK_SIZE"])
+        self.assertEqual(small["simultaneousUploads"], 1)
+        self.assertEqual(large["chunkSize"], 10 * mb)
+        self.assertEqual(large["simultaneousUploads"], config["UPLOAD_MAX_SIMULTANEOUS"])
+
+        busy = advise_upload(1000 * mb, config, load=(config["UPLOAD_BUSY_INFLIGHT_CHUNKS"], None))
+        self.assertEqual(busy["simultaneousUploads"], 1)
+        slow = advise_upload(1000 * mb, config, load=(0, config["UPLOAD_SLOW_CHUNK_SECONDS"] + 1))
+        self.assertLess(slow["simultaneousUploads"], config["UPLOAD_MAX_SIMULTANEOUS"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import unittest
+import tempfile
+import os
+import shutil
+from sqlalchemy import create_engine, text
+from app import create_app, db
+from app.models import Group, FileVersion
+from app.utils.schema import add_missing_columns
+from app.utils.usage import reconcile_group_usage
+
+
+class GroupUsageTestCase(unittest.TestCase):
+    def setUp(self):
+        """在每个测试前设置环境"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        # 创建临时目录用于测试
+        self.test_upload_dir = tempfile.mkdtemp()
+        self.app.config['UPLOAD_FOLDER'] = self.test_upload_dir
+        self.client = self.app.test_client()
+
+        group = Group(name="Usage Group")
+        db.session.add(group)
+        db.session.commit()
+        self.group_id = group.id
+
+    def tearDown(self):
+        """在每个测试后清理环境"""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.app.config['TEST_DATA_DIR'], ignore_errors=True)
+        shutil.rmtree(self.test_upload_dir, ignore_errors=True)
+
+    def upload(self, content, identifier, file_id=None):
+        url = f"/file/upload_version_raw/{self.group_id}/{file_id}" if file_id else f"/file/upload_raw/{self.group_id}"
+        return self.client.post(
+            url,
+            query_string={
+                "resumableIdentifier": identifier,
+                "resumableFilename": "test.txt",
+                "resumableChunkNumber": "1",
+                "resumableTotalChunks": "1",
+                "resumableTotalSize": str(len(content)),
+                "resumableCurrentChunkSize": str(len(content)),
+            },
+            data=content,
+            content_type="application/octet-stream",
+        )
+
+    def usage(self):
+        group = db.session.get(Group, self.group_id)
+        db.session.refresh(group)
+        return group.used_bytes, group.file_count, group.version_count
+
+    def test_counters_follow_upload_and_delete(self):
+        """测试上传、上传新版本和删除文件时更新小组用量计数"""
+        file_id = self.upload(b"12345", "usage-1").get_json()["file_id"]
+        self.assertEqual(self.usage(), (5, 1, 1))
+
+        self.upload(b"1234567", "usage-2", file_id=file_id)
+        self.assertEqual(self.usage(), (12, 1, 2))
+
+        response = self.client.post(f"/file/delete/{self.group_id}/{file_id}")
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.usage(), (0, 0, 0))
+
+    def test_quota_rejects_new_upload(self):
+        """测试超出小组配额的新上传在开始时被拒绝"""
+        self.app.config['GROUP_QUOTA_MB'] = 10
+        self.assertEqual(self.upload(b"12345678", "quota-1").status_code, 200)
+
+        response = self.upload(b"12345", "quota-2")
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.get_json()["error"], "quota_exceeded")
+        self.assertEqual(FileVersion.query.count(), 1)
+
+        response = self.client.post(
+            f"/file/tus/{self.group_id}",
+            headers={
+                "Tus-Resumable": "1.0.0",
+                "Upload-Length": "5",
+                "Upload-Metadata": "filename dGVzdC50eHQ=",
+            },
+        )
+        self.assertEqual(response.status_code, 413)
+
+    def test_reconcile_fixes_drift(self):
+        """测试校正任务按文件记录修正偏离的计数"""
+        self.upload(b"12345", "drift-1")
+        Group.query.filter_by(id=self.group_id).update({"used_bytes": 999, "file_count": 7})
+        db.session.commit()
+
+        self.assertEqual(reconcile_group_usage(), 1)
+        self.assertEqual(self.usage(), (5, 1, 1))
+        self.assertEqual(reconcile_group_usage(), 0)
+
+    def test_add_missing_columns(self):
+        """测试给旧数据库的表补上新增的列"""
+        db_path = os.path.join(self.test_upload_dir, "old.db")
+        engine = create_engine(f"sqlite:///{db_path}")
+        with engine.begin() as conn:
+            conn.execute(text('CREATE TABLE "group" (id VARCHAR(36) PRIMARY KEY, name VARCHAR(100))'))
+            conn.execute(text("""INSERT INTO "group" (id, name) VALUES ('g1', 'old')"""))
+
+        added = add_missing_columns(engine, db.metadata)
+        self.assertIn("group.used_bytes", added)
+        with engine.connect() as conn:
+            row = conn.execute(text('SELECT used_bytes, file_count FROM "group"')).one()
+        self.assertEqual(tuple(row), (0, 0))
+        self.assertEqual(add_missing_columns(engine, db.metadata), [])
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,201 @@
+import unittest
+import tempfile
+import os
+import time
+import shutil
+import threading
+import zipfile
+from datetime import datetime
+from io import BytesIO
+from types import SimpleNamespace
+from app import create_app, db
+from app.models import Group, FileVersion
+from app.utils.storage import get_storage
+from app.utils.zip_archive import ZipCache, select_members, write_group_zip
+
+
+class ZipCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        """在每个测试前设置环境"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        # 创建临时目录用于测试
+        self.test_upload_dir = tempfile.mkdtemp()
+        self.app.config['UPLOAD_FOLDER'] = self.test_upload_dir
+        self.app.config['ZIP_CACHE_DIR'] = os.path.join(self.test_upload_dir, "zip_cache")
+        self.client = self.app.test_client()
+
+        group = Group(name="Zip Group")
+        db.session.add(group)
+        db.session.commit()
+        self.group_id = group.id
+
+    def tearDown(self):
+        """在每个测试后清理环境"""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.app.config['TEST_DATA_DIR'], ignore_errors=True)
+        shutil.rmtree(self.test_upload_dir, ignore_errors=True)
+
+    def upload(self, content, filename):
+        return self.client.post(
+            f"/file/upload_raw/{self.group_id}",
+            query_string={
+                "resumableIdentifier": filename,
+                "resumableFilename": filename,
+                "resumableChunkNumber": "1",
+                "resumableTotalChunks": "1",
+                "resumableTotalSize": str(len(content)),
+                "resumableCurrentChunkSize": str(len(content)),
+            },
+            data=content,
+            content_type="application/octet-stream",
+        ).get_json()["file_id"]
+
+    def download_zip(self, **params):
+        response = self.client.get(f"/file/zip/{self.group_id}", query_string=params)
+        self.assertEqual(response.status_code, 200)
+        data = response.get_data()
+        response.close()
+        names = sorted(zipfile.ZipFile(BytesIO(data)).namelist())
+        return response.headers.get("X-GroupBin-Zip-Cache"), names
+
+    def test_cache_hit_and_invalidation(self):
+        """测试小组内容不变时复用缓存，上传和删除文件后重新打包"""
+        file_id = self.upload(b"first", "a.txt")
+        cache, names = self.download_zip()
+        self.assertEqual((cache, len(names)), ("miss", 1))
+        self.assertEqual(self.download_zip()[0], "hit")
+
+        self.upload(b"second", "b.txt")
+        self.assertEqual(len(os.listdir(self.app.config['ZIP_CACHE_DIR'])), 0)
+        cache, names = self.download_zip()
+        self.assertEqual((cache, len(names)), ("miss", 2))
+
+        self.client.post(f"/file/delete/{self.group_id}/{file_id}")
+        cache, names = self.download_zip()
+        self.assertEqual(cache, "miss")
+        self.assertTrue(names[0].endswith("_b.txt"))
+
+    def test_selective_export(self):
+        """测试只打包最新版本、指定文件和时间范围内的版本"""
+        file_a = self.upload(b"a1", "a.txt")
+        self.upload(b"b1", "b.txt")
+        version = FileVersion.query.filter_by(file_id=file_a).one()
+        version.uploaded_at = datetime(2024, 1, 1)
+        db.session.commit()
+        self.client.post(
+            f"/file/upload_version_raw/{self.group_id}/{file_a}",
+            query_string={
+                "resumableIdentifier": "a2",
+                "resumableFilename": "a.txt",
+                "resumableChunkNumber": "1",
+                "resumableTotalChunks": "1",
+                "resumableTotalSize": "2",
+                "resumableCurrentChunkSize": "2",
+            },
+            data=b"a2",
+            content_type="application/octet-stream",
+        )
+
+        self.assertEqual(len(self.download_zip()[1]), 3)
+        self.assertEqual(self.download_zip(versions="latest")[1], ["a.txt", "b.txt"])
+        names = self.download_zip(file_id=file_a)[1]
+        self.assertEqual(len(names), 2)
+        self.assertTrue(all(name.endswith("_a.txt") for name in names))
+        names = self.download_zip(until="2024-06-01T00:00:00Z")[1]
+        self.assertEqual(names, ["v-01-01-00-00-00_a.txt"])
+
+        response = self.client.get(f"/file/zip/{self.group_id}?since=yesterday")
+        self.assertEqual(response.status_code, 400)
+
+        # 不缓存时边打包边发送
+        self.app.config['ZIP_CACHE_MAX_MB'] = 0
+        response = self.client.get(f"/file/zip/{self.group_id}", query_string={"versions": "latest"})
+        self.assertTrue(response.is_streamed)
+        with zipfile.ZipFile(BytesIO(response.get_data())) as zf:
+            self.assertEqual(zf.read("a.txt"), b"a2")
+        response.close()
+
+    def test_lru_eviction(self):
+        """测试超出缓存预算时淘汰最久未使用的压缩包"""
+        cache = ZipCache(self.app.config['ZIP_CACHE_DIR'], max_bytes=250)
+        for name in ("old", "used"):
+            cache.get_or_build("g", name, lambda f: f.write(b"x" * 100))
+        past = time.time() - 60
+        for name in ("old", "used"):
+            os.utime(cache.archive_path("g", name), (past, past))
+        # 命中缓存会更新使用时间
+        self.assertEqual(cache.get_or_build("g", "used", None), (cache.archive_path("g", "used"), True))
+
+        cache.get_or_build("g", "new", lambda f: f.write(b"x" * 100))
+        self.assertFalse(os.path.exists(cache.archive_path("g", "old")))
+        self.assertTrue(os.path.exists(cache.archive_path("g", "used")))
+        self.assertTrue(os.path.exists(cache.archive_path("g", "new")))
+
+    def test_concurrent_requests_share_build(self):
+        """测试同时请求同一份压缩包时只打包一次"""
+        cache = ZipCache(self.app.config['ZIP_CACHE_DIR'], max_bytes=1024 * 1024)
+        builds = []
+
+        def build(f):
+            builds.append(1)
+            time.sleep(0.3)
+            f.write(b"archive")
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cache.get_or_build("g", "fp", build)))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(sorted(hit for _, hit in results), [False, True, True, True])
+        self.assertEqual(os.listdir(self.app.config['ZIP_CACHE_DIR']), ["g_fp.zip"])
+
+    def test_parallel_content_aware_compression(self):
+        """测试并行压缩的压缩包可以正确解压，已压缩的内容直接存储"""
+        storage = get_storage()
+        contents = {
+            "log.txt": b"".join(b"line %d of a very repetitive log\n" % i for i in range(200000)),
+            "photo.jpg": b"jpeg" * 1000,
+            "random.bin": os.urandom(300 * 1024),
+            "empty.txt": b"",
+        }
+        files = []
+        for index, (name, content) in enumerate(contents.items()):
+            stored_filename = f"blob{index}"
+            storage.put_stream("g", stored_filename, BytesIO(content))
+            version = SimpleNamespace(
+                id=str(index),
+                stored_filename=stored_filename,
+                codec=None,
+                size=len(content),
+                uploaded_at=datetime(2024, 1, 2, 3, 4, index),
+            )
+            files.append(SimpleNamespace(id=str(index), original_filename=name, versions=[version]))
+
+        target = BytesIO()
+        write_group_zip(target, "g", select_members(files), storage, workers=4)
+
+        with zipfile.ZipFile(target) as zf:
+            self.assertIsNone(zf.testzip())
+            infos = {info.filename.split("_", 1)[1]: info for info in zf.infolist()}
+            for name, content in contents.items():
+                self.assertEqual(zf.read(infos[name]), content)
+        self.assertEqual(infos["log.txt"].compress_type, zipfile.ZIP_DEFLATED)
+        self.assertLess(infos["log.txt"].compress_size, len(contents["log.txt"]) // 10)
+        self.assertEqual(infos["photo.jpg"].compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(infos["random.bin"].compress_type, zipfile.ZIP_STORED)
+
+
+if __name__ == '__main__':
+    unittest.main()